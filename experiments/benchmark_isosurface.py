@@ -0,0 +1,71 @@
+import os
+import sys
+import argparse
+import time
+
+import numpy as np
+import torch
+
+# TripoSR is vendored in q9_triposr (one level up from experiments folder)
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "q9_triposr"))
+
+from tsr.models.isosurface import MarchingCubeHelper, SurfaceNetsHelper
+
+
+def blob_level(grid_vertices):
+    """
+    Analytic stand-in for the TripoSR density grid: a union of an ellipsoid and a torus, as a level field that is
+    negative inside the surface (the convention of the isosurface helpers).
+    """
+    p = grid_vertices - 0.5
+    ellipsoid = (p / torch.tensor([0.3, 0.22, 0.18])).norm(dim=-1) - 1.0
+    ring = torch.stack([p[:, [0, 1]].norm(dim=-1) - 0.3, p[:, 2]], dim=-1)
+    torus = (ring.norm(dim=-1) - 0.06) / 0.06
+    return torch.minimum(ellipsoid, torus)
+
+
+def min_angles(vertices, faces):
+    """Smallest interior angle of every triangle, in degrees."""
+    tri = vertices[faces]
+    angles = []
+    for i in range(3):
+        a = tri[:, (i + 1) % 3] - tri[:, i]
+        b = tri[:, (i + 2) % 3] - tri[:, i]
+        cos = (a * b).sum(-1) / (np.linalg.norm(a, axis=-1) * np.linalg.norm(b, axis=-1) + 1e-12)
+        angles.append(np.degrees(np.arccos(np.clip(cos, -1.0, 1.0))))
+    return np.min(angles, axis=0)
+
+
+def benchmark(helper, level, n_iters):
+    helper(level)  # warm-up
+    start_time = time.time()
+    for _ in range(n_iters):
+        v_pos, t_pos_idx = helper(level)
+    elapsed = (time.time() - start_time) * 1000.0 / n_iters
+    return v_pos.cpu().numpy(), t_pos_idx.cpu().numpy(), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark marching cubes against surface nets")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[128, 256, 512], help="Grid resolutions to benchmark")
+    parser.add_argument("--iters", type=int, default=3, help="Timed runs per method and resolution")
+    args = parser.parse_args()
+
+    helpers = {"marching_cubes": MarchingCubeHelper, "surface_nets": SurfaceNetsHelper}
+    print(f"{'method':<16}{'res':>6}{'verts':>11}{'faces':>11}{'ms':>10}{'min angle':>11}{'slivers':>9}")
+    for resolution in args.resolutions:
+        level = None
+        for name, helper_cls in helpers.items():
+            helper = helper_cls(resolution)
+            if level is None:
+                level = blob_level(helper.grid_vertices)
+            vertices, faces, elapsed = benchmark(helper, level, args.iters)
+            angles = min_angles(vertices, faces)
+            # share of triangles with an angle below 10 degrees
+            slivers = (angles < 10.0).mean() * 100.0
+            print(f"{name:<16}{resolution:>6}{len(vertices):>11}{len(faces):>11}{elapsed:>10.1f}{np.mean(angles):>11.1f}{slivers:>8.1f}%")
+            del helper
+
+
+if __name__ == "__main__":
+    main()
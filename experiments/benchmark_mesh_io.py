@@ -0,0 +1,103 @@
+import os
+import sys
+import argparse
+import io
+import time
+from collections import deque
+
+import numpy as np
+import trimesh
+
+# TripoSR is vendored in q9_triposr (one level up from experiments folder)
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "q9_triposr"))
+
+from tsr.mesh_io import MeshArrays, optimize_order, vertex_normals, write_glb, write_ply
+from tsr.models.isosurface import MarchingCubeHelper
+
+from benchmark_isosurface import blob_level
+
+
+def grid_mesh(n_faces):
+    """
+    Wavy height field with about `n_faces` triangles and per-vertex colors, standing in for an extracted mesh.
+    """
+    n = max(int(np.sqrt(n_faces / 2.0)), 1)
+    x, y = np.meshgrid(np.linspace(0.0, 1.0, n + 1), np.linspace(0.0, 1.0, n + 1))
+    z = 0.05 * np.sin(12.0 * x) * np.cos(9.0 * y)
+    vertices = np.stack([x, y, z], axis=-1).reshape(-1, 3).astype(np.float32)
+    corner = (np.arange(n)[:, None] * (n + 1) + np.arange(n)[None, :]).reshape(-1)
+    faces = np.concatenate(
+        [
+            np.stack([corner, corner + 1, corner + n + 2], axis=-1),
+            np.stack([corner, corner + n + 2, corner + n + 1], axis=-1),
+        ]
+    ).astype(np.int32)
+    colors = (np.random.default_rng(0).random((len(vertices), 3)) * 255).astype(np.uint8)
+    return vertices, faces, colors
+
+
+def acmr(faces, cache_size=32):
+    """Average cache miss ratio (vertex shader runs per triangle) of a FIFO post-transform cache."""
+    cache, cached, misses = deque(), set(), 0
+    for v in faces.reshape(-1).tolist():
+        if v not in cached:
+            misses += 1
+            cache.append(v)
+            cached.add(v)
+            if len(cache) > cache_size:
+                cached.discard(cache.popleft())
+    return misses / len(faces)
+
+
+def benchmark(write, n_iters):
+    timings = []
+    for _ in range(n_iters):
+        out = io.BytesIO()
+        start_time = time.time()
+        write(out)
+        timings.append(time.time() - start_time)
+    return min(timings) * 1000.0, len(out.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the numpy GLB/PLY writers against trimesh export, and the optimized GLB layout")
+    parser.add_argument("--faces", type=int, nargs="+", default=[100_000, 500_000, 1_000_000, 5_000_000], help="Face counts to benchmark")
+    parser.add_argument("--iters", type=int, default=3, help="Timed runs per writer and size, the best one is reported")
+    parser.add_argument("--mc-resolution", type=int, default=256, help="Marching cubes resolution of the mesh used to compare the optimized GLB layout")
+    args = parser.parse_args()
+
+    print(f"{'format':<8}{'faces':>10}{'trimesh ms':>12}{'mesh_io ms':>12}{'speedup':>9}{'trimesh MB':>12}{'mesh_io MB':>12}")
+    for n_faces in args.faces:
+        vertices, faces, colors = grid_mesh(n_faces)
+        mesh = trimesh.Trimesh(vertices=vertices, faces=faces, vertex_colors=colors, process=False)
+        # normals are computed once up front so that both writers only pay for serialization
+        mesh_arrays = MeshArrays.from_trimesh(mesh)
+        writers = {
+            "glb": (lambda f: mesh.export(f, file_type="glb"), lambda f: write_glb(f, mesh_arrays)),
+            "ply": (lambda f: mesh.export(f, file_type="ply"), lambda f: write_ply(f, mesh_arrays)),
+            "glb-opt": (lambda f: mesh.export(f, file_type="glb"), lambda f: write_glb(f, optimize_order(mesh_arrays), quantize=True)),
+        }
+        for name, (reference, ours) in writers.items():
+            reference_ms, reference_size = benchmark(reference, args.iters)
+            ours_ms, ours_size = benchmark(ours, args.iters)
+            print(
+                f"{name:<8}{len(faces):>10}{reference_ms:>12.1f}{ours_ms:>12.1f}{reference_ms / ours_ms:>8.1f}x"
+                f"{reference_size / 2**20:>12.1f}{ours_size / 2**20:>12.1f}"
+            )
+
+    # vertex cache efficiency and size of the optimized layout, on an actual marching cubes mesh
+    helper = MarchingCubeHelper(args.mc_resolution)
+    v_pos, t_pos_idx = helper(blob_level(helper.grid_vertices))
+    vertices, faces = v_pos.numpy(), t_pos_idx.numpy()
+    mesh_arrays = MeshArrays(vertices, faces, normals=vertex_normals(vertices, faces))
+    optimized = optimize_order(mesh_arrays)
+    print(f"\nmarching cubes mesh, {len(faces)} faces")
+    print(f"{'layout':<22}{'ACMR':>8}{'MB':>8}")
+    for name, arrays, quantize in [("original, float", mesh_arrays, False), ("optimized, float", optimized, False), ("optimized, quantized", optimized, True)]:
+        out = io.BytesIO()
+        write_glb(out, arrays, quantize=quantize)
+        print(f"{name:<22}{acmr(arrays.faces):>8.3f}{len(out.getvalue()) / 2**20:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
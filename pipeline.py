@@ -2,12 +2,18 @@ import argparse
 import os
 import sys
 import datetime
+import time
 import torch
 from src.generate_image import generate_image
 from src.generate_image_turbo import generate_image_turbo
 from src.generate_image_pixart import generate_image_pixart
-from src.image2mesh import image_to_mesh
-from src.postprocess import clean_mesh, convert_to_glb
+from src.image2mesh import image_to_trimesh
+from src.postprocess import DEFAULT_LOD_RATIOS, cleanup_mesh, write_glb
+from src.run_index import RunIndex
+
+# the DDS encoder lives with the TripoSR code
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "q9_triposr"))
+from tsr.texture_compression import encode_dds
 
 def main():
     parser = argparse.ArgumentParser(description="Ultimate 3D Asset Generation Pipeline")
@@ -26,7 +32,13 @@ def main():
     parser.add_argument("--input-image", type=str, help="Path to input image if skipping generation")
     parser.add_argument("--skip-mesh", action="store_true", help="Skip mesh generation")
     parser.add_argument("--skip-postprocess", action="store_true", help="Skip post-processing")
+    parser.add_argument("--write-intermediate", action="store_true", help="Also write the raw and cleaned meshes as OBJ files (the mesh is otherwise handed over in memory)")
     parser.add_argument("--mesh-resolution", type=int, default=256, help="Marching cubes resolution for mesh generation (default: 256)")
+    parser.add_argument("--floater-face-ratio", type=float, default=0.0, help="Drop connected components with fewer faces than this fraction of the largest one before baking (default: 0, keep all)")
+    parser.add_argument("--lod", action="store_true", help="Write a LOD chain (quadric error simplification) into the GLB")
+    parser.add_argument("--lod-ratios", type=float, nargs="+", default=DEFAULT_LOD_RATIOS, help="Face count ratio of every LOD, used with --lod (default: 1.0 0.25 0.06)")
+    parser.add_argument("--optimize-glb", action="store_true", help="Reorder the GLB for GPU vertex cache locality and quantize it (KHR_mesh_quantization) for smaller, faster-rendering files")
+    parser.add_argument("--texture-format", type=str, default="png", choices=["png", "dds-bc1", "dds-bc3"], help="Baked texture format, DDS formats are block compressed with mipmaps (default: png)")
     
     # Output
     parser.add_argument("--output-dir", type=str, default="outputs", help="Base output directory")
@@ -42,6 +54,8 @@ def main():
     # Setup paths
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     run_id = f"{timestamp}_{args.model}"
+    # every artifact is recorded in the run index, which the stage CLIs query for their latest input
+    run_index = RunIndex(os.path.join(args.output_dir, "run_index.sqlite"))
     
     # 1. Image Generation
     image_path = args.input_image
@@ -55,12 +69,15 @@ def main():
         image_filename = f"img_{run_id}.png"
         image_path = os.path.join(images_dir, image_filename)
         
+        start = time.time()
         if args.model == "sd15":
             generate_image(args.prompt, args.seed, args.steps, args.guidance, args.width, args.height, image_path)
         elif args.model == "turbo":
             generate_image_turbo(args.prompt, args.seed, args.steps, args.guidance, args.width, args.height, image_path)
         elif args.model == "pixart":
             generate_image_pixart(args.prompt, args.seed, args.steps, args.guidance, args.width, args.height, image_path)
+        image_params = {"prompt": args.prompt, "model": args.model, "seed": args.seed, "steps": args.steps, "guidance": args.guidance, "width": args.width, "height": args.height}
+        run_index.record(f"img_{run_id}", "generate_image", "image", image_path, image_params, time.time() - start)
             
         print(f"Image saved to: {image_path}")
     else:
@@ -77,13 +94,29 @@ def main():
     print(f"--- Starting Mesh Generation ---")
     # Create a unique folder for this mesh
     mesh_id = os.path.splitext(os.path.basename(image_path))[0]
+    # the stage CLIs also name runs after their image
+    index_run_id = run_index.run_id_of(image_path) or mesh_id
     raw_mesh_dir = os.path.join(args.output_dir, "raw_meshes", mesh_id)
-    # We pass a dummy output path to image_to_mesh, it uses the dir
-    output_obj_placeholder = os.path.join(raw_mesh_dir, "mesh.obj")
+    dds_format = args.texture_format[len("dds-"):] if args.texture_format != "png" else None
     
     try:
-        raw_mesh_path = image_to_mesh(image_path, output_obj_placeholder, True, args.mesh_resolution)
-        print(f"Raw mesh generated at: {raw_mesh_path}")
+        start = time.time()
+        # extraction, cleanup and export share the same in-memory mesh
+        mesh, texture = image_to_trimesh(image_path, args.mesh_resolution, True, floater_face_ratio=args.floater_face_ratio)
+        print(f"Raw mesh generated: {len(mesh.faces)} faces")
+        # encoded once for both the raw mesh dir and the GLB, the PNG texture is already part of the mesh material
+        dds = encode_dds(texture, dds_format) if dds_format is not None else None
+        mesh_params = {"image": image_path, "mc_resolution": args.mesh_resolution, "floater_face_ratio": args.floater_face_ratio}
+        mesh_seconds = time.time() - start
+        if args.write_intermediate or args.skip_postprocess:
+            raw_mesh_path = os.path.join(raw_mesh_dir, "mesh.obj")
+            os.makedirs(raw_mesh_dir, exist_ok=True)
+            mesh.export(raw_mesh_path)
+            if dds is not None:
+                with open(os.path.join(raw_mesh_dir, "texture.dds"), "wb") as f:
+                    f.write(dds)
+            run_index.record(index_run_id, "image2mesh", "raw_mesh", raw_mesh_path, mesh_params, mesh_seconds)
+            print(f"Raw mesh saved to: {raw_mesh_path}")
     except Exception as e:
         print(f"Error during mesh generation: {e}")
         sys.exit(1)
@@ -101,8 +134,15 @@ def main():
     glb_path = os.path.join(processed_dir, "mesh.glb")
     
     try:
-        clean_mesh(raw_mesh_path, cleaned_path)
-        convert_to_glb(cleaned_path, glb_path)
+        start = time.time()
+        mesh = cleanup_mesh(mesh)
+        if args.write_intermediate:
+            mesh.export(cleaned_path)
+            run_index.record(index_run_id, "postprocess", "cleaned_mesh", cleaned_path, {"input": image_path})
+            print(f"Cleaned mesh saved to: {cleaned_path}")
+        write_glb(mesh, glb_path, dds, args.lod_ratios if args.lod else None, args.optimize_glb)
+        glb_params = {"input": image_path, "lod_ratios": args.lod_ratios if args.lod else None, "optimize": args.optimize_glb, "texture_format": args.texture_format}
+        run_index.record(index_run_id, "postprocess", "glb", glb_path, glb_params, time.time() - start)
         print(f"Pipeline Complete!")
         print(f"Final GLB: {glb_path}")
     except Exception as e:
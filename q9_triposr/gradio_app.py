@@ -10,6 +10,7 @@ import torch
 from PIL import Image
 from functools import partial
 
+from tsr.aot import load_scene_encoder
 from tsr.system import TSR
 from tsr.utils import remove_background, resize_foreground, to_gradio_3d_orientation
 
@@ -31,6 +32,10 @@ model = TSR.from_pretrained(
 model.renderer.set_chunk_size(8192)
 model.to(device)
 
+# load the ahead-of-time compiled scene encoder exported by `run.py --aot-export`, if any
+if os.environ.get("TSR_AOT_DIR"):
+    load_scene_encoder(model, os.environ["TSR_AOT_DIR"], batch_size=1, device=device)
+
 rembg_session = rembg.new_session()
 
 
@@ -1,4 +1,5 @@
 import argparse
+import io
 import logging
 import os
 import time
@@ -9,9 +10,17 @@ import torch
 import xatlas
 from PIL import Image
 
+from tsr.async_writer import AsyncWriter
+from tsr.aot import benchmark_scene_encoder, export_scene_encoder, load_scene_encoder
+from tsr.onnx_backend import use_onnx_backend
+from tsr.shards import ShardReader, ShardWriter
 from tsr.system import TSR
 from tsr.utils import remove_background, resize_foreground, save_video
-from tsr.bake_texture import bake_texture
+from tsr.bake_texture import AtlasCache, TextureBaker, bake_texture
+from tsr.cleanup import remove_floaters_mesh
+from tsr.mesh_io import MeshArrays, optimize_order, write_glb, write_ply
+from tsr.simplify import simplify_mesh
+from tsr.texture_compression import DDS_MIME_TYPE, save_texture
 
 
 class Timer:
@@ -44,7 +53,13 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
 )
 parser = argparse.ArgumentParser()
-parser.add_argument("image", type=str, nargs="+", help="Path to input image(s).")
+parser.add_argument("image", type=str, nargs="*", help="Path to input image(s).")
+parser.add_argument(
+    "--input-shards",
+    default=None,
+    type=str,
+    help="Directory of tar shards (see tsr.shards) to read the input images from, in storage order, instead of image paths. The member name of each input is saved as source.txt with its outputs. Default: None",
+)
 parser.add_argument(
     "--device",
     default="cuda:0",
@@ -69,6 +84,42 @@ parser.add_argument(
     type=int,
     help="Marching cubes grid resolution. Default: 256"
 )
+parser.add_argument(
+    "--isosurface",
+    default="marching_cubes",
+    type=str,
+    choices=["marching_cubes", "surface_nets"],
+    help="Isosurface extraction method. Surface nets produce far fewer sliver triangles than marching cubes. Default: 'marching_cubes'",
+)
+parser.add_argument(
+    "--mc-slab-size",
+    default=0,
+    type=int,
+    help="If > 0, evaluate and polygonize the marching cubes grid in slabs of that many cells to bound peak memory, e.g. for resolutions of 1024 and above. Not compatible with --vertex-color-from-grid, --save-density-volume and surface nets. 0 for no slabs. Default: 0",
+)
+parser.add_argument(
+    "--mc-workers",
+    default=0,
+    type=int,
+    help="Number of worker processes polygonizing slabs, only useful with --mc-slab-size. 0 polygonizes in the main process. Default: 0",
+)
+parser.add_argument(
+    "--compact-mesh",
+    action="store_true",
+    help="If specified, keep extracted meshes as compact float32/int32/uint8 buffers instead of processed trimesh objects, which halves their memory footprint. Default: false",
+)
+parser.add_argument(
+    "--vertex-color-from-grid",
+    action="store_true",
+    help="If specified, interpolate vertex colors from the color field computed with the density grid instead of querying the model again at every vertex. Not used with --bake-texture. Default: false",
+)
+parser.add_argument(
+    "--save-density-volume",
+    default=None,
+    type=str,
+    choices=["float16", "uint8"],
+    help="If specified, save the density grid (as float16, or uint8 quantized) and the scene code next to the mesh, so that it can be re-meshed at other thresholds or lower resolutions with tsr.volume.DensityVolume. The full precision grid is also reused to extract this run's mesh, the decoder is queried once. Default: None",
+)
 parser.add_argument(
     "--no-remove-bg",
     action="store_true",
@@ -86,12 +137,40 @@ parser.add_argument(
     type=str,
     help="Output directory to save the results. Default: 'output/'",
 )
+parser.add_argument(
+    "--output-shards",
+    action="store_true",
+    help="If specified, append the outputs to tar shards with an index (see tsr.shards) in --output-dir instead of writing numbered directories of small files, e.g. for catalog-scale runs on a shared filesystem. Members keep their relative paths (0/mesh.obj, 0/texture.png, ...). Density volumes are still written as files. Default: false",
+)
+parser.add_argument(
+    "--shard-size",
+    default=1024,
+    type=int,
+    help="Size in MB after which a new output shard is started, only useful with --output-shards. Default: 1024",
+)
 parser.add_argument(
     "--model-save-format",
     default="obj",
     type=str,
-    choices=["obj", "glb"],
-    help="Format to save the extracted mesh. Default: 'obj'",
+    choices=["obj", "glb", "ply"],
+    help="Format to save the extracted mesh. GLB and PLY files are written directly from the vertex and index buffers, with the baked texture embedded in the GLB when using --bake-texture. Default: 'obj'",
+)
+parser.add_argument(
+    "--optimize-glb",
+    action="store_true",
+    help="If specified, reorder GLB meshes for GPU vertex cache locality and quantize their vertex attributes to 16/8-bit (KHR_mesh_quantization), for smaller files that render faster. Only used with --model-save-format glb. Default: false",
+)
+parser.add_argument(
+    "--floater-face-ratio",
+    default=0.0,
+    type=float,
+    help="If > 0, drop the connected components of the extracted mesh with fewer faces than this fraction of the largest component (floaters), before simplifying, baking and exporting it. Default: 0.0",
+)
+parser.add_argument(
+    "--floater-volume-ratio",
+    default=0.0,
+    type=float,
+    help="If > 0, also drop the connected components enclosing less than this fraction of the volume of the largest component. Default: 0.0",
 )
 parser.add_argument(
     "--bake-texture",
@@ -104,12 +183,93 @@ parser.add_argument(
     type=int,
     help="Texture atlas resolution, only useful with --bake-texture. Default: 2048"
 )
+parser.add_argument(
+    "--texture-format",
+    default="png",
+    type=str,
+    choices=["png", "dds-bc1", "dds-bc3"],
+    help="File format of the baked texture atlas, only useful with --bake-texture. The DDS formats are block compressed (BC1 without alpha, BC3 with alpha) with a full mip chain, ready to be uploaded to the GPU. Default: 'png'",
+)
+parser.add_argument(
+    "--bake-backend",
+    default="gl",
+    type=str,
+    choices=["gl", "cpu"],
+    help="Rasterizer used to bake the texture atlas, only useful with --bake-texture. 'cpu' needs no OpenGL context and uses all CPU cores, for headless nodes. Default: 'gl'",
+)
+parser.add_argument(
+    "--bake-target-faces",
+    default=0,
+    type=int,
+    help="If > 0, decimate the extracted mesh to about this many faces with quadric error simplification before unwrapping and baking it, which keeps baking tractable for high --mc-resolution and makes the exported mesh lighter. Only useful with --bake-texture. 0 for no decimation. Default: 0",
+)
+parser.add_argument(
+    "--atlas-cache-dir",
+    default=None,
+    type=str,
+    help="If specified, cache texture atlases in this directory, keyed by mesh geometry and pack options, so that re-baking the same mesh skips the atlas generation and a new texture resolution only repacks the charts. Only useful with --bake-texture. Default: None",
+)
+parser.add_argument(
+    "--fuse-qkv-projections",
+    action="store_true",
+    help="If specified, fuse the query/key/value projections of the transformer backbone after loading, so each attention layer runs one projection GEMM instead of three. Default: false",
+)
+parser.add_argument(
+    "--aot-dir",
+    default=None,
+    type=str,
+    help="Directory holding the ahead-of-time compiled scene encoder. If given, the compiled encoder is loaded at startup, and exported first if it is missing or was exported for another checkpoint or torch version, with a fallback to eager mode. Default: None",
+)
+parser.add_argument(
+    "--aot-export",
+    action="store_true",
+    help="If specified, re-export the compiled scene encoder to --aot-dir (required) for batch size 1 before running even if it is up to date, and report its latency against eager mode. Default: false",
+)
+parser.add_argument(
+    "--backend",
+    default="torch",
+    type=str,
+    choices=["torch", "onnx"],
+    help="Inference backend for the scene encoder and the triplane decoder. 'onnx' runs them through onnxruntime sessions after checking numerical parity with torch. Default: 'torch'",
+)
+parser.add_argument(
+    "--onnx-dir",
+    default="onnx/",
+    type=str,
+    help="Directory holding the exported ONNX models, only useful with --backend onnx. They are exported there if missing or exported for another checkpoint. Default: 'onnx/'",
+)
+parser.add_argument(
+    "--onnx-threads",
+    default=0,
+    type=int,
+    help="Number of intra-op threads for onnxruntime, only useful with --backend onnx. 0 uses all physical cores. Default: 0",
+)
+parser.add_argument(
+    "--write-workers",
+    default=1,
+    type=int,
+    help="Number of background threads encoding and writing meshes, textures and images while the next image is processed. 0 writes synchronously. Default: 1",
+)
+parser.add_argument(
+    "--max-pending-writes",
+    default=4,
+    type=int,
+    help="Maximum number of queued background writes, processing waits beyond that to bound the memory held by finished outputs. Default: 4",
+)
 parser.add_argument(
     "--render",
     action="store_true",
     help="If specified, save a NeRF-rendered video. Default: false",
 )
 args = parser.parse_args()
+if not args.image and args.input_shards is None:
+    parser.error("either image paths or --input-shards are required")
+if args.mc_slab_size > 0 and (args.vertex_color_from_grid or args.save_density_volume is not None):
+    parser.error("--mc-slab-size cannot be combined with --vertex-color-from-grid or --save-density-volume")
+if args.mc_slab_size > 0 and args.isosurface != "marching_cubes":
+    parser.error("--mc-slab-size only supports --isosurface marching_cubes")
+if args.aot_export and args.aot_dir is None:
+    parser.error("--aot-export requires --aot-dir")
 
 output_dir = args.output_dir
 os.makedirs(output_dir, exist_ok=True)
@@ -126,66 +286,199 @@ model = TSR.from_pretrained(
 )
 model.renderer.set_chunk_size(args.chunk_size)
 model.to(device)
+if args.fuse_qkv_projections:
+    model.fuse_qkv_projections()
 timer.end("Initializing model")
 
-timer.start("Processing images")
-images = []
+if args.backend == "onnx":
+    timer.start("Initializing ONNX backend")
+    use_onnx_backend(
+        model, args.onnx_dir, batch_size=1, device=device, num_threads=args.onnx_threads
+    )
+    timer.end("Initializing ONNX backend")
 
-if args.no_remove_bg:
-    rembg_session = None
-else:
-    rembg_session = rembg.new_session()
+if args.aot_dir is not None:
+    scene_encoder = None
+    if not args.aot_export:
+        timer.start("Loading compiled scene encoder")
+        scene_encoder = load_scene_encoder(model, args.aot_dir, batch_size=1, device=device)
+        timer.end("Loading compiled scene encoder")
+    if scene_encoder is None:
+        # missing, or exported for another checkpoint or torch version
+        timer.start("Exporting compiled scene encoder")
+        try:
+            export_scene_encoder(model, args.aot_dir, batch_size=1, device=device)
+            scene_encoder = load_scene_encoder(model, args.aot_dir, batch_size=1, device=device)
+        except Exception as e:
+            logging.warning(f"Failed to export the scene encoder ({e}).")
+        timer.end("Exporting compiled scene encoder")
+    if scene_encoder is None:
+        logging.info("No usable compiled scene encoder, using eager mode.")
+    elif args.aot_export:
+        eager_ms, compiled_ms = benchmark_scene_encoder(
+            model, scene_encoder, batch_size=1, device=device
+        )
+        logging.info(
+            f"Scene encoder latency: eager {eager_ms:.2f}ms, compiled {compiled_ms:.2f}ms ({eager_ms / compiled_ms:.2f}x)."
+        )
+
+# outputs are written atomically in the background, flushed at the end
+shards = ShardWriter(output_dir, max_shard_bytes=args.shard_size << 20) if args.output_shards else None
+writer = AsyncWriter(args.write_workers, args.max_pending_writes, shards=shards)
+
+try:
+    timer.start("Processing images")
+    images = []
 
-for i, image_path in enumerate(args.image):
     if args.no_remove_bg:
-        image = np.array(Image.open(image_path).convert("RGB"))
+        rembg_session = None
     else:
-        image = remove_background(Image.open(image_path), rembg_session)
-        image = resize_foreground(image, args.foreground_ratio)
-        image = np.array(image).astype(np.float32) / 255.0
-        image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
-        image = Image.fromarray((image * 255.0).astype(np.uint8))
-        if not os.path.exists(os.path.join(output_dir, str(i))):
-            os.makedirs(os.path.join(output_dir, str(i)))
-        image.save(os.path.join(output_dir, str(i), f"input.png"))
-    images.append(image)
-timer.end("Processing images")
-
-for i, image in enumerate(images):
-    logging.info(f"Running image {i + 1}/{len(images)} ...")
-
-    timer.start("Running model")
-    with torch.no_grad():
-        scene_codes = model([image], device=device)
-    timer.end("Running model")
-
-    if args.render:
-        timer.start("Rendering")
-        render_images = model.render(scene_codes, n_views=30, return_type="pil")
-        for ri, render_image in enumerate(render_images[0]):
-            render_image.save(os.path.join(output_dir, str(i), f"render_{ri:03d}.png"))
-        save_video(
-            render_images[0], os.path.join(output_dir, str(i), f"render.mp4"), fps=30
+        rembg_session = rembg.new_session()
+
+    image_paths, source_names = args.image, None
+    if args.input_shards is not None:
+        with ShardReader(args.input_shards) as input_shards:
+            source_names = input_shards.names([".png", ".jpg", ".jpeg", ".webp"])
+            image_paths = [io.BytesIO(input_shards.read(name)) for name in source_names]
+
+    def write_source(path, name):
+        with open(path, "w") as f:
+            f.write(name + "\n")
+
+    for i, image_path in enumerate(image_paths):
+        if source_names is not None:
+            # outputs are numbered, keep the input member they were generated from
+            writer.submit(os.path.join(output_dir, str(i), "source.txt"), write_source, source_names[i])
+        if args.no_remove_bg:
+            image = np.array(Image.open(image_path).convert("RGB"))
+        else:
+            image = remove_background(Image.open(image_path), rembg_session)
+            image = resize_foreground(image, args.foreground_ratio)
+            image = np.array(image).astype(np.float32) / 255.0
+            image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
+            image = Image.fromarray((image * 255.0).astype(np.uint8))
+            if shards is None and not os.path.exists(os.path.join(output_dir, str(i))):
+                os.makedirs(os.path.join(output_dir, str(i)))
+            writer.submit(os.path.join(output_dir, str(i), f"input.png"), image.save)
+        images.append(image)
+    timer.end("Processing images")
+
+    # one GL context and set of shader programs for all the bakes
+    baker = TextureBaker() if args.bake_texture and args.bake_backend == "gl" else None
+    atlas_cache = AtlasCache(args.atlas_cache_dir) if args.atlas_cache_dir is not None else None
+
+    for i, image in enumerate(images):
+        logging.info(f"Running image {i + 1}/{len(images)} ...")
+
+        timer.start("Running model")
+        with torch.no_grad():
+            scene_codes = model([image], device=device)
+        timer.end("Running model")
+
+        if args.render:
+            timer.start("Rendering")
+            render_images = model.render(scene_codes, n_views=30, return_type="pil")
+            for ri, render_image in enumerate(render_images[0]):
+                writer.submit(os.path.join(output_dir, str(i), f"render_{ri:03d}.png"), render_image.save)
+            writer.submit(
+                os.path.join(output_dir, str(i), f"render.mp4"), save_video, render_images[0], fps=30
+            )
+            timer.end("Rendering")
+
+        density_volumes = None
+        if args.save_density_volume is not None:
+            timer.start("Saving density volume")
+            density_volumes = model.extract_density_volumes(scene_codes, resolution=args.mc_resolution)
+            density_volumes[0].save(os.path.join(output_dir, str(i), "density.npy"), args.save_density_volume)
+            torch.save(scene_codes[0].cpu(), os.path.join(output_dir, str(i), "scene_code.pt"))
+            timer.end("Saving density volume")
+
+        timer.start("Extracting mesh")
+        meshes = model.extract_mesh(
+            scene_codes,
+            not args.bake_texture,
+            resolution=args.mc_resolution,
+            color_from_grid=args.vertex_color_from_grid,
+            # the grid was just queried at full precision, only the saved copy is quantized
+            density_volumes=density_volumes,
+            slab_size=args.mc_slab_size,
+            num_workers=args.mc_workers,
+            isosurface=args.isosurface,
+            return_type="compact" if args.compact_mesh else "trimesh",
         )
-        timer.end("Rendering")
+        timer.end("Extracting mesh")
 
-    timer.start("Extracting mesh")
-    meshes = model.extract_mesh(scene_codes, not args.bake_texture, resolution=args.mc_resolution)
-    timer.end("Extracting mesh")
+        if args.floater_face_ratio > 0 or args.floater_volume_ratio > 0:
+            timer.start("Removing floaters")
+            meshes[0], floater_stats = remove_floaters_mesh(meshes[0], args.floater_face_ratio, args.floater_volume_ratio)
+            logging.info(
+                f"Removed {floater_stats['removed_components']} of {floater_stats['components']} components ({floater_stats['removed_faces']} faces)."
+            )
+            timer.end("Removing floaters")
 
-    out_mesh_path = os.path.join(output_dir, str(i), f"mesh.{args.model_save_format}")
-    if args.bake_texture:
-        out_texture_path = os.path.join(output_dir, str(i), "texture.png")
+        out_mesh_path = os.path.join(output_dir, str(i), f"mesh.{args.model_save_format}")
+        if args.bake_texture:
+            texture_ext = "png" if args.texture_format == "png" else "dds"
+            out_texture_path = os.path.join(output_dir, str(i), f"texture.{texture_ext}")
 
-        timer.start("Baking texture")
-        bake_output = bake_texture(meshes[0], model, scene_codes[0], args.texture_resolution)
-        timer.end("Baking texture")
+            if args.compact_mesh:
+                meshes[0] = meshes[0].to_trimesh()
+            if 0 < args.bake_target_faces < len(meshes[0].faces):
+                timer.start("Simplifying mesh")
+                meshes[0] = simplify_mesh(meshes[0], args.bake_target_faces)
+                timer.end("Simplifying mesh")
 
-        timer.start("Exporting mesh and texture")
-        xatlas.export(out_mesh_path, meshes[0].vertices[bake_output["vmapping"]], bake_output["indices"], bake_output["uvs"], meshes[0].vertex_normals[bake_output["vmapping"]])
-        Image.fromarray((bake_output["colors"] * 255.0).astype(np.uint8)).transpose(Image.FLIP_TOP_BOTTOM).save(out_texture_path)
-        timer.end("Exporting mesh and texture")
-    else:
-        timer.start("Exporting mesh")
-        meshes[0].export(out_mesh_path)
-        timer.end("Exporting mesh")
+            timer.start("Baking texture")
+            bake_output = bake_texture(meshes[0], model, scene_codes[0], args.texture_resolution, baker=baker, backend=args.bake_backend, sparse=True, atlas_cache=atlas_cache)
+            timer.end("Baking texture")
+
+            timer.start("Exporting mesh and texture")
+            texture = writer.submit(out_texture_path, save_texture, bake_output["colors"], args.texture_format)
+            baked_mesh = MeshArrays(
+                vertices=meshes[0].vertices[bake_output["vmapping"]],
+                faces=bake_output["indices"],
+                normals=meshes[0].vertex_normals[bake_output["vmapping"]],
+                uvs=bake_output["uvs"],
+            )
+            if args.model_save_format == "glb":
+                if args.optimize_glb:
+                    baked_mesh = optimize_order(baked_mesh)
+                # the texture file is embedded as is, once encoded, a DDS one along with a PNG fallback
+                if texture_ext == "png":
+                    writer.submit(out_mesh_path, write_glb, baked_mesh, texture, quantize=args.optimize_glb)
+                else:
+                    fallback = Image.fromarray(bake_output["colors"][::-1])
+                    writer.submit(out_mesh_path, write_glb, baked_mesh, texture, DDS_MIME_TYPE, quantize=args.optimize_glb, fallback_texture=fallback)
+            elif args.model_save_format == "ply":
+                writer.submit(out_mesh_path, write_ply, baked_mesh)
+            else:
+                writer.submit(out_mesh_path, xatlas.export, baked_mesh.vertices, baked_mesh.faces, baked_mesh.uvs, baked_mesh.normals)
+            timer.end("Exporting mesh and texture")
+        else:
+            timer.start("Exporting mesh")
+            if args.model_save_format == "obj":
+                writer.submit(out_mesh_path, meshes[0].export)
+            else:
+                if args.compact_mesh:
+                    mesh_arrays = MeshArrays.from_compact(meshes[0])
+                else:
+                    mesh_arrays = MeshArrays.from_trimesh(meshes[0])
+                if args.model_save_format == "ply":
+                    writer.submit(out_mesh_path, write_ply, mesh_arrays)
+                elif args.optimize_glb:
+                    writer.submit(out_mesh_path, write_glb, optimize_order(mesh_arrays), quantize=True)
+                else:
+                    writer.submit(out_mesh_path, write_glb, mesh_arrays)
+            timer.end("Exporting mesh")
+
+    if baker is not None:
+        baker.release()
+finally:
+    # also on errors, so that the outputs of the images processed so far are written and indexed
+    timer.start("Flushing writes")
+    try:
+        writer.close()
+    finally:
+        if shards is not None:
+            shards.close()
+    timer.end("Flushing writes")
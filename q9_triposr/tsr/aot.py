@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+from .system import encode_scene
+
+
+class SceneCodeEncoder(nn.Module):
+    """
+    Image -> scene code part of `TSR` as a standalone module, so that it can be exported without the decoder and
+    renderer weights.
+    """
+
+    def __init__(self, model) -> None:
+        super().__init__()
+        self.image_tokenizer = model.image_tokenizer
+        self.tokenizer = model.tokenizer
+        self.backbone = model.backbone
+        self.post_processor = model.post_processor
+
+    def forward(self, rgb_cond: torch.FloatTensor) -> torch.FloatTensor:
+        return encode_scene(
+            self.image_tokenizer,
+            self.tokenizer,
+            self.backbone,
+            self.post_processor,
+            rgb_cond,
+        )
+
+
+class CompiledSceneEncoder:
+    """
+    Wraps a compiled encoder and permanently falls back to the eager path of the model if it fails.
+    """
+
+    def __init__(self, compiled: Callable, eager: Callable) -> None:
+        self.compiled = compiled
+        self.eager = eager
+        self.failed = False
+
+    def __call__(self, rgb_cond: torch.FloatTensor) -> torch.FloatTensor:
+        if not self.failed:
+            try:
+                return self.compiled(rgb_cond)
+            except Exception as e:
+                logging.warning(
+                    f"Compiled scene encoder failed ({e}), falling back to eager mode."
+                )
+                self.failed = True
+        return self.eager(rgb_cond)
+
+
+def _example_input(model, batch_size: int, device: str) -> torch.FloatTensor:
+    size = model.cfg.cond_image_size
+    return torch.zeros(batch_size, 1, size, size, 3, device=device)
+
+
+def _artifact_paths(aot_dir: str, batch_size: int, device: str) -> Tuple[str, str]:
+    name = f"scene_encoder_b{batch_size}_{torch.device(device).type}"
+    return (
+        os.path.join(aot_dir, f"{name}.pt2"),
+        os.path.join(aot_dir, f"{name}.json"),
+    )
+
+
+def _artifact_meta(model, batch_size: int) -> dict:
+    # the exported program embeds the weights, so a different checkpoint needs a new export
+    return {
+        "torch_version": torch.__version__,
+        "batch_size": batch_size,
+        "cond_image_size": model.cfg.cond_image_size,
+        "fused_qkv_projections": any(
+            getattr(module, "fused_projections", False) for module in model.modules()
+        ),
+        **model.checkpoint_identity(),
+    }
+
+
+@contextmanager
+def _inductor_cache_dir(directory: str):
+    # inductor only reads its cache location from the environment, restore it for the rest of the process
+    previous = os.environ.get("TORCHINDUCTOR_CACHE_DIR")
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = directory
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop("TORCHINDUCTOR_CACHE_DIR", None)
+        else:
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = previous
+
+
+def export_scene_encoder(model, aot_dir: str, batch_size: int, device: str) -> str:
+    """
+    Export the scene encoder of `model` for a fixed batch size with `torch.export` and save it to `aot_dir`.
+    """
+    os.makedirs(aot_dir, exist_ok=True)
+    program_path, meta_path = _artifact_paths(aot_dir, batch_size, device)
+    encoder = SceneCodeEncoder(model).eval()
+    with torch.no_grad():
+        exported = torch.export.export(
+            encoder, (_example_input(model, batch_size, device),), strict=False
+        )
+    torch.export.save(exported, program_path)
+    with open(meta_path, "w") as f:
+        json.dump(_artifact_meta(model, batch_size), f, indent=2)
+    return program_path
+
+
+def load_scene_encoder(
+    model, aot_dir: str, batch_size: int, device: str, use_inductor: bool = True
+) -> Optional[CompiledSceneEncoder]:
+    """
+    Load an encoder exported by `export_scene_encoder` and register it on `model` for `batch_size`. When `use_inductor`
+    is set, the exported graph is further compiled with inductor right away, using a cache inside `aot_dir` so that warm
+    processes skip most of the compilation. Returns None, leaving the eager path in place, if no usable artifact exists
+    (missing, or exported for another torch version, batch size or checkpoint).
+    """
+    program_path, meta_path = _artifact_paths(aot_dir, batch_size, device)
+    if not os.path.exists(program_path) or not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta != _artifact_meta(model, batch_size):
+        logging.warning(
+            f"Ignoring compiled scene encoder {program_path}: built for {meta}."
+        )
+        return None
+
+    try:
+        module = torch.export.load(program_path).module()
+        if use_inductor:
+            from torch._inductor import config as inductor_config
+
+            module = torch.compile(module, dynamic=False)
+            # compile with the cache of aot_dir now instead of on the first call, without changing global state
+            cache_dir = os.path.abspath(os.path.join(aot_dir, "inductor_cache"))
+            with _inductor_cache_dir(cache_dir), inductor_config.patch(fx_graph_cache=True), torch.no_grad():
+                module(_example_input(model, batch_size, device))
+    except Exception as e:
+        logging.warning(f"Failed to load compiled scene encoder ({e}), using eager mode.")
+        return None
+
+    encoder = CompiledSceneEncoder(module, model.encode)
+    model.set_scene_encoder(batch_size, encoder)
+    return encoder
+
+
+def benchmark_scene_encoder(
+    model, encoder: Callable, batch_size: int, device: str, n_iters: int = 5
+) -> Tuple[float, float]:
+    """
+    Return the mean latency in ms of the eager and the given encoder, after one warm-up call each.
+    """
+    rgb_cond = _example_input(model, batch_size, device)
+
+    def measure(fn):
+        with torch.no_grad():
+            fn(rgb_cond)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            start_time = time.time()
+            for _ in range(n_iters):
+                fn(rgb_cond)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+        return (time.time() - start_time) * 1000.0 / n_iters
+
+    return measure(model.encode), measure(encoder)
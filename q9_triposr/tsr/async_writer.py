@@ -0,0 +1,120 @@
+import logging
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable
+
+
+def atomic_write(path: str, write_fn: Callable, *args, **kwargs) -> Any:
+    """
+    Call `write_fn(tmp_path, *args, **kwargs)` on a temporary file next to `path`, with the same extension so that
+    writers picking the format from it still work, and rename it to `path` once complete. Readers never see a partial
+    file, and a failed write leaves the previous file in place. Returns the result of `write_fn`.
+    """
+    directory, filename = os.path.split(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    stem, ext = os.path.splitext(filename)
+    tmp_path = os.path.join(directory, f".{stem}.{uuid.uuid4().hex[:8]}.tmp{ext}")
+    try:
+        result = write_fn(tmp_path, *args, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return result
+
+
+class AsyncWriter:
+    """
+    Encode and write output files on background threads while the caller moves on, e.g. to inference of the next
+    image. Image encoding, compression and file I/O release the GIL, so threads overlap them with the main thread
+    without copying the buffers to another process.
+
+    At most `max_pending` writes are queued: `submit` blocks beyond that, which bounds the memory held by finished
+    buffers. With `num_workers=0` writes run synchronously in `submit`. Errors are raised by `flush`, which also
+    waits for all the writes submitted so far. With `shards` (a `tsr.shards.ShardWriter`), files are appended to its
+    tar shards instead of being written one by one.
+    """
+
+    def __init__(self, num_workers: int = 1, max_pending: int = 4, shards=None):
+        self.shards = shards
+        self.queue = queue.Queue(maxsize=max(max_pending, 1))
+        self.errors = []
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, path: str, write_fn: Callable, *args, **kwargs) -> Future:
+        """
+        Queue an `atomic_write(path, write_fn, *args, **kwargs)` (or a `ShardWriter.write`). The writer takes ownership
+        of the arguments, they must not be modified afterwards. Arguments that are futures of earlier submits are
+        replaced by their results before writing, e.g. to embed the bytes of a texture written in the background into a
+        mesh file.
+        Returns a future of the result of `write_fn`.
+        """
+        future = Future()
+        if self.threads:
+            self.queue.put((future, path, write_fn, args, kwargs))
+        else:
+            self._write(future, path, write_fn, args, kwargs)
+        return future
+
+    def _write(self, future, path, write_fn, args, kwargs) -> None:
+        try:
+            # earlier submits are dequeued first, so waiting on them cannot deadlock
+            args = [arg.result() if isinstance(arg, Future) else arg for arg in args]
+            write = atomic_write if self.shards is None else self.shards.write
+            future.set_result(write(path, write_fn, *args, **kwargs))
+        except Exception as e:
+            logging.error(f"Failed to write {path}: {e}")
+            future.set_exception(e)
+            with self.lock:
+                self.errors.append((path, e))
+
+    def _work(self) -> None:
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            finally:
+                self.queue.task_done()
+
+    def flush(self) -> None:
+        """
+        Wait for all the submitted writes, and raise the first error since the last flush.
+        """
+        self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            path, error = errors[0]
+            raise RuntimeError(
+                f"Failed to write {path} ({len(errors)} failed writes)"
+            ) from error
+
+    def close(self) -> None:
+        """
+        Flush and stop the worker threads.
+        """
+        try:
+            self.flush()
+        finally:
+            for _ in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+
+    def __enter__(self) -> "AsyncWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
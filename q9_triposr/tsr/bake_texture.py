@@ -1,19 +1,29 @@
+import hashlib
+import os
+from collections import OrderedDict
+
 import numpy as np
 import torch
 import xatlas
 import trimesh
-import moderngl
 from PIL import Image
 
+from .async_writer import atomic_write
+from .uv_rasterizer import rasterize_position_atlas_cpu
 
-def make_atlas(mesh, texture_resolution, texture_padding):
-    atlas = xatlas.Atlas()
-    atlas.add_mesh(mesh.vertices, mesh.faces)
+
+def _pack_options(texture_resolution, texture_padding):
     options = xatlas.PackOptions()
     options.resolution = texture_resolution
     options.padding = texture_padding
     options.bilinear = True
-    atlas.generate(pack_options=options)
+    return options
+
+
+def make_atlas(mesh, texture_resolution, texture_padding):
+    atlas = xatlas.Atlas()
+    atlas.add_mesh(mesh.vertices, mesh.faces)
+    atlas.generate(pack_options=_pack_options(texture_resolution, texture_padding))
     vmapping, indices, uvs = atlas[0]
     return {
         "vmapping": vmapping,
@@ -22,116 +32,297 @@ def make_atlas(mesh, texture_resolution, texture_padding):
     }
 
 
+def repack_atlas(atlas, texture_resolution, texture_padding):
+    """
+    Pack the charts of an existing atlas for another resolution or padding, without recomputing them.
+    """
+    packer = xatlas.Atlas()
+    packer.add_uv_mesh(
+        atlas["uvs"].astype(np.float32), atlas["indices"].astype(np.uint32)
+    )
+    packer.generate(pack_options=_pack_options(texture_resolution, texture_padding))
+    vmapping, indices, uvs = packer[0]
+    return {
+        "vmapping": atlas["vmapping"][vmapping],
+        "indices": indices,
+        "uvs": uvs,
+    }
+
+
+class AtlasCache:
+    """
+    Atlases keyed by a hash of the mesh geometry and the pack options, kept in memory (up to `max_entries`) and, if
+    `cache_dir` is given, saved there as .npz files. When only the resolution or padding differs from a cached atlas
+    of the same mesh, its charts are repacked instead of being computed again. The charts are saved once per mesh,
+    as the first atlas computed for it.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=8):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.atlases = OrderedDict()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def geometry_key(mesh):
+        digest = hashlib.sha1()
+        digest.update(np.ascontiguousarray(mesh.vertices, dtype=np.float32).tobytes())
+        digest.update(np.ascontiguousarray(mesh.faces, dtype=np.uint32).tobytes())
+        return digest.hexdigest()
+
+    def _path(self, geometry_key, texture_resolution, texture_padding):
+        return os.path.join(
+            self.cache_dir,
+            f"{geometry_key}_{texture_resolution}_{texture_padding}.npz",
+        )
+
+    def _charts_path(self, geometry_key):
+        return os.path.join(self.cache_dir, f"{geometry_key}_charts.npz")
+
+    def _save(self, path, atlas):
+        # complete files only, even if interrupted or if workers bake the same mesh concurrently
+        atomic_write(path, np.savez, **atlas)
+
+    def _remember(self, key, atlas):
+        self.atlases[key] = atlas
+        self.atlases.move_to_end(key)
+        while len(self.atlases) > self.max_entries:
+            self.atlases.popitem(last=False)
+
+    def _load(self, path):
+        with np.load(path) as data:
+            return {k: data[k] for k in ["vmapping", "indices", "uvs"]}
+
+    def _find_charts(self, geometry_key):
+        for (key, _, _), atlas in reversed(self.atlases.items()):
+            if key == geometry_key:
+                return atlas
+        if self.cache_dir is not None and os.path.exists(self._charts_path(geometry_key)):
+            return self._load(self._charts_path(geometry_key))
+        return None
+
+    def get(self, mesh, texture_resolution, texture_padding):
+        geometry_key = self.geometry_key(mesh)
+        key = (geometry_key, texture_resolution, texture_padding)
+        if key in self.atlases:
+            self.atlases.move_to_end(key)
+            return self.atlases[key]
+
+        path = None
+        if self.cache_dir is not None:
+            path = self._path(*key)
+            if os.path.exists(path):
+                atlas = self._load(path)
+                self._remember(key, atlas)
+                return atlas
+
+        charts = self._find_charts(geometry_key)
+        if charts is not None:
+            atlas = repack_atlas(charts, texture_resolution, texture_padding)
+        else:
+            atlas = make_atlas(mesh, texture_resolution, texture_padding)
+        atlas = {
+            "vmapping": atlas["vmapping"].astype(np.uint32),
+            "indices": atlas["indices"].astype(np.uint32),
+            "uvs": atlas["uvs"].astype(np.float32),
+        }
+        if path is not None:
+            self._save(path, atlas)
+            if charts is None:
+                self._save(self._charts_path(geometry_key), atlas)
+        self._remember(key, atlas)
+        return atlas
+
+
+BASIC_VERTEX_SHADER = """
+    #version 330
+    in vec2 in_uv;
+    in vec3 in_pos;
+    out vec3 v_pos;
+    void main() {
+        v_pos = in_pos;
+        gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
+    }
+"""
+
+BASIC_FRAGMENT_SHADER = """
+    #version 330
+    in vec3 v_pos;
+    out vec4 o_col;
+    void main() {
+        o_col = vec4(v_pos, 1.0);
+    }
+"""
+
+DILATION_VERTEX_SHADER = """
+    #version 330
+    in vec2 in_uv;
+    in vec3 in_pos;
+    out vec3 vg_pos;
+    void main() {
+        vg_pos = in_pos;
+        gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
+    }
+"""
+
+DILATION_GEOMETRY_SHADER = """
+    #version 330
+    uniform float u_resolution;
+    uniform float u_dilation;
+    layout (triangles) in;
+    layout (triangle_strip, max_vertices = 12) out;
+    in vec3 vg_pos[];
+    out vec3 vf_pos;
+    void lineSegment(int aidx, int bidx) {
+        vec2 a = gl_in[aidx].gl_Position.xy;
+        vec2 b = gl_in[bidx].gl_Position.xy;
+        vec3 aCol = vg_pos[aidx];
+        vec3 bCol = vg_pos[bidx];
+
+        vec2 dir = normalize((b - a) * u_resolution);
+        vec2 offset = vec2(-dir.y, dir.x) * u_dilation / u_resolution;
+
+        gl_Position = vec4(a + offset, 0.0, 1.0);
+        vf_pos = aCol;
+        EmitVertex();
+        gl_Position = vec4(a - offset, 0.0, 1.0);
+        vf_pos = aCol;
+        EmitVertex();
+        gl_Position = vec4(b + offset, 0.0, 1.0);
+        vf_pos = bCol;
+        EmitVertex();
+        gl_Position = vec4(b - offset, 0.0, 1.0);
+        vf_pos = bCol;
+        EmitVertex();
+    }
+    void main() {
+        lineSegment(0, 1);
+        lineSegment(1, 2);
+        lineSegment(2, 0);
+        EndPrimitive();
+    }
+"""
+
+DILATION_FRAGMENT_SHADER = """
+    #version 330
+    in vec3 vf_pos;
+    out vec4 o_col;
+    void main() {
+        o_col = vec4(vf_pos, 1.0);
+    }
+"""
+
+
+class TextureBaker:
+    """
+    Owns a standalone GL context with the position rasterization programs compiled once, and float framebuffers keyed
+    by texture resolution, so that baking many meshes does not recreate them every time. Call `release` (or use it as
+    a context manager) to free the GL resources.
+    """
+
+    def __init__(self, ctx=None) -> None:
+        import moderngl
+
+        self.owns_ctx = ctx is None
+        self.ctx = moderngl.create_context(standalone=True) if ctx is None else ctx
+        self.basic_prog = self.ctx.program(
+            vertex_shader=BASIC_VERTEX_SHADER,
+            fragment_shader=BASIC_FRAGMENT_SHADER,
+        )
+        self.gs_prog = self.ctx.program(
+            vertex_shader=DILATION_VERTEX_SHADER,
+            geometry_shader=DILATION_GEOMETRY_SHADER,
+            fragment_shader=DILATION_FRAGMENT_SHADER,
+        )
+        self.framebuffers = {}
+
+    def framebuffer(self, texture_resolution):
+        if texture_resolution not in self.framebuffers:
+            self.framebuffers[texture_resolution] = self.ctx.framebuffer(
+                color_attachments=[
+                    self.ctx.texture(
+                        (texture_resolution, texture_resolution), 4, dtype="f4"
+                    )
+                ]
+            )
+        return self.framebuffers[texture_resolution]
+
+    def rasterize(
+        self,
+        mesh,
+        atlas_vmapping,
+        atlas_indices,
+        atlas_uvs,
+        texture_resolution,
+        texture_padding,
+    ):
+        uvs = atlas_uvs.flatten().astype("f4")
+        pos = mesh.vertices[atlas_vmapping].flatten().astype("f4")
+        indices = atlas_indices.flatten().astype("i4")
+        # per-mesh buffers are released right after the bake
+        resources = [
+            self.ctx.buffer(uvs),
+            self.ctx.buffer(pos),
+            self.ctx.buffer(indices),
+        ]
+        vbo_uvs, vbo_pos, ibo = resources
+        try:
+            vao_content = [
+                vbo_uvs.bind("in_uv", layout="2f"),
+                vbo_pos.bind("in_pos", layout="3f"),
+            ]
+            basic_vao = self.ctx.vertex_array(self.basic_prog, vao_content, ibo)
+            resources.append(basic_vao)
+            gs_vao = self.ctx.vertex_array(self.gs_prog, vao_content, ibo)
+            resources.append(gs_vao)
+            fbo = self.framebuffer(texture_resolution)
+            fbo.use()
+            fbo.clear(0.0, 0.0, 0.0, 0.0)
+            self.gs_prog["u_resolution"].value = texture_resolution
+            self.gs_prog["u_dilation"].value = texture_padding
+            gs_vao.render()
+            basic_vao.render()
+
+            fbo_bytes = fbo.color_attachments[0].read()
+        finally:
+            for resource in reversed(resources):
+                resource.release()
+        fbo_np = np.frombuffer(fbo_bytes, dtype="f4").reshape(
+            texture_resolution, texture_resolution, 4
+        )
+        return fbo_np
+
+    def release(self):
+        for fbo in self.framebuffers.values():
+            for texture in fbo.color_attachments:
+                texture.release()
+            fbo.release()
+        self.framebuffers = {}
+        self.basic_prog.release()
+        self.gs_prog.release()
+        if self.owns_ctx:
+            self.ctx.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
 def rasterize_position_atlas(
     mesh, atlas_vmapping, atlas_indices, atlas_uvs, texture_resolution, texture_padding
 ):
-    ctx = moderngl.create_context(standalone=True)
-    basic_prog = ctx.program(
-        vertex_shader="""
-            #version 330
-            in vec2 in_uv;
-            in vec3 in_pos;
-            out vec3 v_pos;
-            void main() {
-                v_pos = in_pos;
-                gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
-            }
-        """,
-        fragment_shader="""
-            #version 330
-            in vec3 v_pos;
-            out vec4 o_col;
-            void main() {
-                o_col = vec4(v_pos, 1.0);
-            }
-        """,
-    )
-    gs_prog = ctx.program(
-        vertex_shader="""
-            #version 330
-            in vec2 in_uv;
-            in vec3 in_pos;
-            out vec3 vg_pos;
-            void main() {
-                vg_pos = in_pos;
-                gl_Position = vec4(in_uv * 2.0 - 1.0, 0.0, 1.0);
-            }
-        """,
-        geometry_shader="""
-            #version 330
-            uniform float u_resolution;
-            uniform float u_dilation;
-            layout (triangles) in;
-            layout (triangle_strip, max_vertices = 12) out;
-            in vec3 vg_pos[];
-            out vec3 vf_pos;
-            void lineSegment(int aidx, int bidx) {
-                vec2 a = gl_in[aidx].gl_Position.xy;
-                vec2 b = gl_in[bidx].gl_Position.xy;
-                vec3 aCol = vg_pos[aidx];
-                vec3 bCol = vg_pos[bidx];
-
-                vec2 dir = normalize((b - a) * u_resolution);
-                vec2 offset = vec2(-dir.y, dir.x) * u_dilation / u_resolution;
-
-                gl_Position = vec4(a + offset, 0.0, 1.0);
-                vf_pos = aCol;
-                EmitVertex();
-                gl_Position = vec4(a - offset, 0.0, 1.0);
-                vf_pos = aCol;
-                EmitVertex();
-                gl_Position = vec4(b + offset, 0.0, 1.0);
-                vf_pos = bCol;
-                EmitVertex();
-                gl_Position = vec4(b - offset, 0.0, 1.0);
-                vf_pos = bCol;
-                EmitVertex();
-            }
-            void main() {
-                lineSegment(0, 1);
-                lineSegment(1, 2);
-                lineSegment(2, 0);
-                EndPrimitive();
-            }
-        """,
-        fragment_shader="""
-            #version 330
-            in vec3 vf_pos;
-            out vec4 o_col;
-            void main() {
-                o_col = vec4(vf_pos, 1.0);
-            }
-        """,
-    )
-    uvs = atlas_uvs.flatten().astype("f4")
-    pos = mesh.vertices[atlas_vmapping].flatten().astype("f4")
-    indices = atlas_indices.flatten().astype("i4")
-    vbo_uvs = ctx.buffer(uvs)
-    vbo_pos = ctx.buffer(pos)
-    ibo = ctx.buffer(indices)
-    vao_content = [
-        vbo_uvs.bind("in_uv", layout="2f"),
-        vbo_pos.bind("in_pos", layout="3f"),
-    ]
-    basic_vao = ctx.vertex_array(basic_prog, vao_content, ibo)
-    gs_vao = ctx.vertex_array(gs_prog, vao_content, ibo)
-    fbo = ctx.framebuffer(
-        color_attachments=[
-            ctx.texture((texture_resolution, texture_resolution), 4, dtype="f4")
-        ]
-    )
-    fbo.use()
-    fbo.clear(0.0, 0.0, 0.0, 0.0)
-    gs_prog["u_resolution"].value = texture_resolution
-    gs_prog["u_dilation"].value = texture_padding
-    gs_vao.render()
-    basic_vao.render()
-
-    fbo_bytes = fbo.color_attachments[0].read()
-    fbo_np = np.frombuffer(fbo_bytes, dtype="f4").reshape(
-        texture_resolution, texture_resolution, 4
-    )
-    return fbo_np
+    with TextureBaker() as baker:
+        return baker.rasterize(
+            mesh,
+            atlas_vmapping,
+            atlas_indices,
+            atlas_uvs,
+            texture_resolution,
+            texture_padding,
+        )
 
 
 def positions_to_colors(model, scene_code, positions_texture, texture_resolution):
@@ -148,10 +339,61 @@ def positions_to_colors(model, scene_code, positions_texture, texture_resolution
     return rgba_f.reshape(texture_resolution, texture_resolution, 4)
 
 
-def bake_texture(mesh, model, scene_code, texture_resolution):
+def positions_to_colors_sparse(
+    model, scene_code, positions_texture, texture_resolution, chunk_size=262144
+):
+    """
+    Like `positions_to_colors`, but only the texels covered by the atlas are sent to the decoder, `chunk_size` at a
+    time, and the result is an RGBA uint8 texture.
+    """
+    positions_flat = positions_texture.reshape(-1, 4)
+    covered = np.nonzero(positions_flat[:, -1] > 0.0)[0]
+    colors = np.zeros((texture_resolution * texture_resolution, 4), dtype=np.uint8)
+    for start in range(0, len(covered), chunk_size):
+        texels = covered[start : start + chunk_size]
+        positions = torch.from_numpy(positions_flat[texels, :-1]).to(scene_code.device)
+        with torch.no_grad():
+            rgb = model.renderer.query_triplane(
+                model.decoder,
+                positions,
+                scene_code,
+            )["color"]
+        colors[texels, :-1] = (rgb * 255.0).to(torch.uint8).cpu().numpy()
+    colors[covered, -1] = 255
+    return colors.reshape(texture_resolution, texture_resolution, 4)
+
+
+def bake_texture(
+    mesh,
+    model,
+    scene_code,
+    texture_resolution,
+    baker=None,
+    backend="gl",
+    sparse=False,
+    atlas_cache=None,
+):
+    """
+    Bake the color field of `scene_code` into a texture atlas of `mesh`. The atlas is rasterized with OpenGL, or with
+    numpy on all CPU cores if `backend` is "cpu", which needs no GL context. With the GL backend, pass a `TextureBaker`
+    to reuse its context and framebuffers across calls, otherwise a temporary one is created.
+
+    With `sparse`, only covered texels are queried and "colors" is a uint8 texture instead of a float one in [0, 1].
+    An `AtlasCache` avoids recomputing the atlas of a mesh that was already baked.
+    """
+    assert backend in ["gl", "cpu"]
     texture_padding = round(max(2, texture_resolution / 256))
-    atlas = make_atlas(mesh, texture_resolution, texture_padding)
-    positions_texture = rasterize_position_atlas(
+    if atlas_cache is None:
+        atlas = make_atlas(mesh, texture_resolution, texture_padding)
+    else:
+        atlas = atlas_cache.get(mesh, texture_resolution, texture_padding)
+    if backend == "cpu":
+        rasterize = rasterize_position_atlas_cpu
+    elif baker is None:
+        rasterize = rasterize_position_atlas
+    else:
+        rasterize = baker.rasterize
+    positions_texture = rasterize(
         mesh,
         atlas["vmapping"],
         atlas["indices"],
@@ -159,9 +401,14 @@ def bake_texture(mesh, model, scene_code, texture_resolution):
         texture_resolution,
         texture_padding,
     )
-    colors_texture = positions_to_colors(
-        model, scene_code, positions_texture, texture_resolution
-    )
+    if sparse:
+        colors_texture = positions_to_colors_sparse(
+            model, scene_code, positions_texture, texture_resolution
+        )
+    else:
+        colors_texture = positions_to_colors(
+            model, scene_code, positions_texture, texture_resolution
+        )
     return {
         "vmapping": atlas["vmapping"],
         "indices": atlas["indices"],
@@ -0,0 +1,314 @@
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+import trimesh
+
+from .mesh import CompactMesh
+
+
+def _int64_columns(array: np.ndarray) -> np.ndarray:
+    # the raw bytes of every row of an array as int64 columns, zero padded
+    array = np.ascontiguousarray(array).reshape(len(array), -1).view(np.uint8)
+    array = np.pad(array, ((0, 0), (0, -array.shape[1] % 8)))
+    return array.view(np.int64)
+
+
+def _unique_rows(
+    rows: np.ndarray, return_inverse: bool = True
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    First occurrence of every distinct row of an (N, K) int64 array, in increasing order, and the index of the
+    distinct row of every row if `return_inverse`.
+    Rows are sorted by a 64-bit hash rather than lexicographically, which is several times faster; a hash collision can
+    only leave two equal rows apart, never merge different ones.
+    """
+    h = np.zeros(len(rows), dtype=np.uint64)
+    for column in rows.T:
+        h ^= column.view(np.uint64)
+        h *= np.uint64(0x9E3779B97F4A7C15)
+        h ^= h >> np.uint64(29)
+    order = np.argsort(h)
+    sorted_h = h[order]
+    new_row = np.ones(len(rows), dtype=bool)
+    new_row[1:] = sorted_h[1:] != sorted_h[:-1]
+    # only rows with the same hash as their predecessor need to be compared
+    same = np.nonzero(~new_row)[0]
+    new_row[same] = (rows[order[same]] != rows[order[same - 1]]).any(axis=1)
+    first = np.minimum.reduceat(order, np.nonzero(new_row)[0]) if len(rows) else order
+    if not return_inverse:
+        return np.sort(first), None
+    # number the distinct rows in order of first occurrence, which keeps later gathers local
+    first_order = np.argsort(first)
+    group = np.empty(len(first), dtype=np.int64)
+    group[first_order] = np.arange(len(first))
+    inverse = np.empty(len(rows), dtype=np.int64)
+    inverse[order] = group[np.cumsum(new_row) - 1]
+    return first[first_order], inverse
+
+
+def cleanup(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    attributes: Optional[np.ndarray] = None,
+    merge_digits: int = 8,
+    area_epsilon: float = 1e-12,
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], Dict[str, int]]:
+    """
+    Clean up a triangle mesh in a single vectorized pass: weld vertices equal up to `merge_digits` decimals (and with
+    equal `attributes`, so that UV seams and color boundaries are kept), drop faces with non-finite vertices,
+    degenerate faces (repeated vertices or twice the area below `area_epsilon`) and duplicate faces (same vertices in
+    any order), and compact the vertices still referenced. Faces are remapped once.
+
+    Returns the vertices, faces and attributes of the cleaned mesh, and the number of removed elements.
+    """
+    vertices = np.asarray(vertices)
+    faces = np.asarray(faces, dtype=np.int64)
+    n_vertices, n_faces = len(vertices), len(faces)
+
+    # weld on quantized positions, attributes included in the key
+    finite = np.isfinite(vertices).all(axis=1)
+    key = np.round(np.where(finite[:, None], vertices, 0.0) * 10.0**merge_digits)
+    key = key.astype(np.int64)
+    if attributes is not None:
+        key = np.concatenate([key, _int64_columns(attributes)], axis=1)
+    welded, weld_index = _unique_rows(key)
+    faces = weld_index[faces]
+
+    # degenerate faces: repeated welded vertices or no area
+    welded_vertices = vertices[welded].astype(np.float64)
+    p0 = welded_vertices[faces[:, 0]]
+    e1 = welded_vertices[faces[:, 1]] - p0
+    e2 = welded_vertices[faces[:, 2]] - p0
+    squared_double_area = (
+        (e1[:, 1] * e2[:, 2] - e1[:, 2] * e2[:, 1]) ** 2
+        + (e1[:, 2] * e2[:, 0] - e1[:, 0] * e2[:, 2]) ** 2
+        + (e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]) ** 2
+    )
+    valid = finite[welded][faces].all(axis=1)
+    n_nonfinite = int(n_faces - valid.sum())
+    degenerate = (
+        (faces[:, 0] == faces[:, 1])
+        | (faces[:, 1] == faces[:, 2])
+        | (faces[:, 2] == faces[:, 0])
+        | ~(squared_double_area > area_epsilon**2)
+    ) & valid
+    valid &= ~degenerate
+
+    # duplicates regardless of winding, the first face is kept
+    keep = np.nonzero(valid)[0]
+    a, b, c = faces[keep, 0], faces[keep, 1], faces[keep, 2]
+    lo = np.minimum(np.minimum(a, b), c)
+    hi = np.maximum(np.maximum(a, b), c)
+    first, _ = _unique_rows(
+        np.stack([lo, a + b + c - lo - hi, hi], axis=-1), return_inverse=False
+    )
+    n_duplicate = len(keep) - len(first)
+    faces = faces[keep[first]]
+
+    # compact the referenced welded vertices, in their original order
+    used = np.zeros(len(welded), dtype=bool)
+    used[faces.reshape(-1)] = True
+    kept = np.zeros(n_vertices, dtype=bool)
+    kept[welded[used]] = True
+    source = np.nonzero(kept)[0]
+    faces = (np.cumsum(kept) - 1)[welded][faces]
+
+    stats = {
+        "merged_vertices": int(n_vertices - len(welded)),
+        "unreferenced_vertices": int(len(welded) - len(source)),
+        "nonfinite_faces": n_nonfinite,
+        "degenerate_faces": int(degenerate.sum()),
+        "duplicate_faces": int(n_duplicate),
+        "vertices": int(len(source)),
+        "faces": int(len(faces)),
+    }
+    return (
+        vertices[source],
+        faces,
+        None if attributes is None else attributes[source],
+        stats,
+    )
+
+
+def connected_components(faces: np.ndarray, n_vertices: int) -> np.ndarray:
+    """
+    Label the vertices of a mesh by connected component with a vectorized union-find: every round hooks the root of
+    each edge endpoint onto the smaller root, then compresses all paths by pointer jumping, and edges already inside a
+    component are dropped. Returns the smallest vertex index of the component of every vertex.
+    """
+    parent = np.arange(n_vertices)
+    # two edges per face are enough to connect its vertices
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]]]).astype(np.int64)
+    while True:
+        root_a, root_b = parent[edges[:, 0]], parent[edges[:, 1]]
+        active = root_a != root_b
+        if not active.any():
+            return parent
+        edges, root_a, root_b = edges[active], root_a[active], root_b[active]
+        np.minimum.at(
+            parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b)
+        )
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+def remove_floaters(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    attributes: Optional[np.ndarray] = None,
+    min_face_ratio: float = 0.01,
+    min_volume_ratio: float = 0.0,
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], Dict[str, int]]:
+    """
+    Drop the connected components with fewer faces than `min_face_ratio` times the face count of the largest component,
+    or with an enclosed volume below `min_volume_ratio` times the largest volume, e.g. the small floaters marching
+    cubes leaves around the object. Unreferenced vertices are removed.
+
+    Returns the vertices, faces and attributes of the kept components, and the number of removed elements.
+    """
+    faces = np.asarray(faces, dtype=np.int64)
+    # components are indexed by their root vertex
+    face_component = connected_components(faces, len(vertices))[faces[:, 0]]
+    face_counts = np.bincount(face_component, minlength=len(vertices))
+    is_component = face_counts > 0
+    keep_component = face_counts >= min_face_ratio * face_counts.max(initial=0)
+    if min_volume_ratio > 0:
+        # divergence theorem, one signed tetrahedron per face
+        tri = np.asarray(vertices, dtype=np.float64)[faces]
+        signed = (tri[:, 0] * np.cross(tri[:, 1], tri[:, 2])).sum(-1) / 6.0
+        volumes = np.abs(np.bincount(face_component, signed, minlength=len(vertices)))
+        keep_component &= volumes >= min_volume_ratio * volumes.max(initial=0)
+    removed = is_component & ~keep_component
+
+    faces = faces[keep_component[face_component]]
+    used = np.zeros(len(vertices), dtype=bool)
+    used[faces.reshape(-1)] = True
+    stats = {
+        "components": int(is_component.sum()),
+        "removed_components": int(removed.sum()),
+        "removed_faces": int(face_counts[removed].sum()),
+        "removed_vertices": int(len(vertices) - used.sum()),
+    }
+    return (
+        vertices[used],
+        (np.cumsum(used) - 1)[faces],
+        None if attributes is None else attributes[used],
+        stats,
+    )
+
+
+def _apply_to_mesh(mesh: Union[trimesh.Trimesh, CompactMesh], fn, **kwargs):
+    # run an array-level pass on a mesh, carrying its vertex colors or texture coordinates and material along
+    if isinstance(mesh, CompactMesh):
+        vertices, faces, colors, stats = fn(
+            mesh.vertices, mesh.faces, mesh.vertex_colors, **kwargs
+        )
+        return CompactMesh(vertices, faces, colors), stats
+    if mesh.visual.kind == "vertex":
+        vertices, faces, colors, stats = fn(
+            mesh.vertices, mesh.faces, mesh.visual.vertex_colors, **kwargs
+        )
+        cleaned = trimesh.Trimesh(
+            vertices=vertices, faces=faces, vertex_colors=colors, process=False
+        )
+    elif mesh.visual.kind == "texture" and mesh.visual.uv is not None:
+        vertices, faces, uv, stats = fn(mesh.vertices, mesh.faces, mesh.visual.uv, **kwargs)
+        cleaned = trimesh.Trimesh(
+            vertices=vertices,
+            faces=faces,
+            visual=trimesh.visual.TextureVisuals(uv=uv, material=mesh.visual.material),
+            process=False,
+        )
+    else:
+        vertices, faces, _, stats = fn(mesh.vertices, mesh.faces, **kwargs)
+        cleaned = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    return cleaned, stats
+
+
+def cleanup_trimesh(mesh: trimesh.Trimesh) -> Tuple[trimesh.Trimesh, Dict[str, int]]:
+    """
+    `cleanup` a trimesh mesh, keeping its vertex colors or texture coordinates and material. Returns a new mesh and
+    the cleanup stats.
+    """
+    return _apply_to_mesh(mesh, cleanup)
+
+
+def remove_floaters_mesh(
+    mesh: Union[trimesh.Trimesh, CompactMesh],
+    min_face_ratio: float = 0.01,
+    min_volume_ratio: float = 0.0,
+) -> Tuple[Union[trimesh.Trimesh, CompactMesh], Dict[str, int]]:
+    """
+    `remove_floaters` of a trimesh or compact mesh (e.g. straight out of `TSR.extract_mesh`), keeping its vertex colors
+    or texture coordinates and material. Returns a new mesh of the same type and the stats.
+    """
+    return _apply_to_mesh(
+        mesh,
+        remove_floaters,
+        min_face_ratio=min_face_ratio,
+        min_volume_ratio=min_volume_ratio,
+    )
+
+
+def mesh_topology(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    attributes: Optional[np.ndarray] = None,
+    merge_digits: int = 8,
+) -> Dict[str, Union[int, bool, float, list, None]]:
+    """
+    Topology and geometry checks of a triangle mesh from a single sort of its edge keys. Vertices are first welded
+    like trimesh does on load (equal up to `merge_digits` decimals and equal `attributes`). Every directed edge is
+    encoded as an int64 key of its sorted endpoints with its direction in the lowest bit, so that after sorting the
+    run length of an edge is its face count and the sum of the direction bits tells whether its two faces agree.
+
+    Returns the welded vertex count, face count, unique, boundary and non-manifold edge counts, watertightness, winding
+    consistency, Euler number, bounds of the referenced vertices and signed volume (None unless watertight).
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    key = np.round(vertices * 10.0**merge_digits).astype(np.int64)
+    if attributes is not None:
+        key = np.concatenate([key, _int64_columns(attributes)], axis=1)
+    welded, weld_index = _unique_rows(key)
+    welded_faces = weld_index[faces]
+
+    a = welded_faces.reshape(-1)
+    b = welded_faces[:, [1, 2, 0]].reshape(-1)
+    edge_keys = np.sort(
+        (np.minimum(a, b) * len(welded) + np.maximum(a, b)) * 2 + (a < b)
+    )
+    edges = edge_keys >> 1
+    starts = np.flatnonzero(np.r_[True, edges[1:] != edges[:-1]]) if len(edges) else edges
+    counts = np.diff(np.r_[starts, len(edges)])
+    forward = np.add.reduceat(edge_keys & 1, starts) if len(starts) else counts
+
+    referenced = np.zeros(len(welded), dtype=bool)
+    referenced[welded_faces.reshape(-1)] = True
+    is_watertight = len(faces) > 0 and bool((counts == 2).all())
+    report = {
+        "vertices": int(len(welded)),
+        "faces": int(len(faces)),
+        "edges": int(len(starts)),
+        "boundary_edges": int((counts == 1).sum()),
+        "non_manifold_edges": int((counts > 2).sum()),
+        "is_watertight": is_watertight,
+        # only edges shared by exactly two faces have a defined orientation
+        "is_winding_consistent": len(faces) > 0 and bool((forward[counts == 2] == 1).all()),
+        "euler_number": int(referenced.sum() - len(starts) + len(faces)),
+        "bounds": None,
+        "volume": None,
+    }
+    if referenced.any():
+        used = vertices[welded[referenced]]
+        report["bounds"] = [used.min(axis=0).tolist(), used.max(axis=0).tolist()]
+    if is_watertight:
+        # divergence theorem, one signed tetrahedron per face
+        tri = vertices[faces]
+        report["volume"] = float(
+            (tri[:, 0] * np.cross(tri[:, 1], tri[:, 2])).sum() / 6.0
+        )
+    return report
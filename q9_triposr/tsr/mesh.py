@@ -0,0 +1,85 @@
+from typing import Optional, Union
+
+import numpy as np
+import torch
+import trimesh
+
+
+class CompactMesh:
+    """
+    Lightweight mesh record with contiguous float32 vertices, int32 faces and optional uint8 RGB vertex colors. Unlike
+    `trimesh.Trimesh`, nothing is merged, upcast or cached on construction; convert with `to_trimesh` when trimesh
+    functionality is needed.
+    """
+
+    __slots__ = ("vertices", "faces", "vertex_colors")
+
+    def __init__(
+        self,
+        vertices: np.ndarray,
+        faces: np.ndarray,
+        vertex_colors: Optional[np.ndarray] = None,
+    ) -> None:
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int32)
+        if vertex_colors is not None and vertex_colors.dtype != np.uint8:
+            # float colors in [0, 1]
+            vertex_colors = (np.clip(vertex_colors, 0.0, 1.0) * 255.0).round()
+        self.vertex_colors = (
+            None
+            if vertex_colors is None
+            else np.ascontiguousarray(vertex_colors, dtype=np.uint8)
+        )
+
+    @classmethod
+    def from_tensors(
+        cls,
+        v_pos: torch.FloatTensor,
+        t_pos_idx: torch.LongTensor,
+        color: Optional[torch.FloatTensor] = None,
+    ) -> "CompactMesh":
+        if color is not None:
+            color = (color.detach().float().clamp(0.0, 1.0) * 255.0).round()
+            color = color.to(torch.uint8).cpu().numpy()
+        return cls(
+            v_pos.detach().float().cpu().numpy(),
+            t_pos_idx.detach().to(torch.int32).cpu().numpy(),
+            color,
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.vertices.nbytes
+            + self.faces.nbytes
+            + (0 if self.vertex_colors is None else self.vertex_colors.nbytes)
+        )
+
+    def to_trimesh(self, process: bool = False) -> trimesh.Trimesh:
+        return trimesh.Trimesh(
+            vertices=self.vertices,
+            faces=self.faces,
+            vertex_colors=self.vertex_colors,
+            process=process,
+        )
+
+    def export(self, file_obj, file_type: Optional[str] = None, **kwargs):
+        return self.to_trimesh().export(file_obj, file_type=file_type, **kwargs)
+
+
+def build_mesh(
+    v_pos: torch.FloatTensor,
+    t_pos_idx: torch.LongTensor,
+    color: Optional[torch.FloatTensor] = None,
+    return_type: str = "trimesh",
+) -> Union[trimesh.Trimesh, CompactMesh]:
+    if return_type == "compact":
+        return CompactMesh.from_tensors(v_pos, t_pos_idx, color)
+    elif return_type == "trimesh":
+        return trimesh.Trimesh(
+            vertices=v_pos.cpu().numpy(),
+            faces=t_pos_idx.cpu().numpy(),
+            vertex_colors=None if color is None else color.cpu().numpy(),
+        )
+    else:
+        raise NotImplementedError
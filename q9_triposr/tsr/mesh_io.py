@@ -0,0 +1,468 @@
+import io
+import json
+import struct
+from dataclasses import dataclass
+from typing import BinaryIO, List, Optional, Union
+
+import numpy as np
+import trimesh
+from PIL import Image
+
+from .mesh import CompactMesh
+from .texture_compression import DDS_MIME_TYPE, decode_dds
+
+FileLike = Union[str, BinaryIO]
+
+GLTF_FLOAT = 5126
+GLTF_BYTE = 5120
+GLTF_UNSIGNED_BYTE = 5121
+GLTF_UNSIGNED_SHORT = 5123
+GLTF_UNSIGNED_INT = 5125
+GLTF_ARRAY_BUFFER = 34962
+GLTF_ELEMENT_ARRAY_BUFFER = 34963
+GLTF_TRIANGLES = 4
+
+
+@dataclass
+class MeshArrays:
+    """
+    Contiguous arrays of a mesh to be written: float vertices (V, 3), int faces (F, 3), and optionally float normals
+    (V, 3), float UVs (V, 2) with the origin at the bottom left (OBJ convention), and uint8 RGB(A) colors (V, 3|4).
+    """
+
+    vertices: np.ndarray
+    faces: np.ndarray
+    normals: Optional[np.ndarray] = None
+    uvs: Optional[np.ndarray] = None
+    colors: Optional[np.ndarray] = None
+    name: str = "mesh"
+
+    @classmethod
+    def from_trimesh(
+        cls, mesh: trimesh.Trimesh, name: str = "mesh", normals: bool = True
+    ) -> "MeshArrays":
+        uvs, colors = None, None
+        if mesh.visual.kind == "texture" and mesh.visual.uv is not None:
+            uvs = mesh.visual.uv
+        elif mesh.visual.kind == "vertex":
+            colors = mesh.visual.vertex_colors
+        return cls(
+            vertices=mesh.vertices,
+            faces=mesh.faces,
+            normals=mesh.vertex_normals if normals else None,
+            uvs=uvs,
+            colors=colors,
+            name=name,
+        )
+
+    @classmethod
+    def from_compact(
+        cls, mesh: CompactMesh, name: str = "mesh", normals: bool = True
+    ) -> "MeshArrays":
+        return cls(
+            vertices=mesh.vertices,
+            faces=mesh.faces,
+            normals=vertex_normals(mesh.vertices, mesh.faces) if normals else None,
+            colors=mesh.vertex_colors,
+            name=name,
+        )
+
+
+def vertex_normals(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """
+    Area weighted unit vertex normals, as float32.
+    """
+    tri = vertices[faces].astype(np.float32)
+    face_normals = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    normals = np.stack(
+        [
+            np.bincount(
+                faces.reshape(-1),
+                np.repeat(face_normals[:, k], 3),
+                minlength=len(vertices),
+            )
+            for k in range(3)
+        ],
+        axis=-1,
+    ).astype(np.float32)
+    normals /= np.maximum(np.linalg.norm(normals, axis=-1, keepdims=True), 1e-20)
+    return normals
+
+
+def _morton_codes(points: np.ndarray, bits: int = 10) -> np.ndarray:
+    # interleave the bits of the points quantized on a 2^bits grid over their bounding box
+    lo = points.min(axis=0)
+    extent = max((points.max(axis=0) - lo).max(), 1e-12)
+    q = ((points - lo) / extent * ((1 << bits) - 1)).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for k in range(3):
+        x = q[:, k] & 0x3FF
+        x = (x | (x << np.uint64(16))) & np.uint64(0x030000FF)
+        x = (x | (x << np.uint64(8))) & np.uint64(0x0300F00F)
+        x = (x | (x << np.uint64(4))) & np.uint64(0x030C30C3)
+        x = (x | (x << np.uint64(2))) & np.uint64(0x09249249)
+        codes |= x << np.uint64(k)
+    return codes
+
+
+def optimize_order(mesh: MeshArrays) -> MeshArrays:
+    """
+    Reorder the triangles of a mesh for vertex cache locality, and its vertices for fetch locality. Vertices are ranked
+    along a Morton curve and triangles sorted by the ranks of their vertices, so that consecutive triangles share
+    vertices; vertices are then renumbered in order of first use by the index buffer. Unused vertices are dropped.
+    """
+    rank = np.empty(len(mesh.vertices), dtype=np.int64)
+    rank[np.argsort(_morton_codes(mesh.vertices))] = np.arange(
+        len(mesh.vertices)
+    )
+    face_rank = rank[mesh.faces]
+    order = np.argsort(
+        face_rank.min(axis=1) * len(mesh.vertices) + face_rank.max(axis=1)
+    )
+    faces = mesh.faces[order]
+
+    flat = faces.reshape(-1)
+    first_use = np.full(len(mesh.vertices), len(flat), dtype=np.int64)
+    np.minimum.at(first_use, flat, np.arange(len(flat)))
+    vertex_order = np.argsort(first_use)[: np.count_nonzero(first_use < len(flat))]
+    remap = np.empty(len(mesh.vertices), dtype=np.int64)
+    remap[vertex_order] = np.arange(len(vertex_order))
+
+    def take(attribute):
+        return None if attribute is None else attribute[vertex_order]
+
+    return MeshArrays(
+        vertices=mesh.vertices[vertex_order],
+        faces=remap[faces],
+        normals=take(mesh.normals),
+        uvs=take(mesh.uvs),
+        colors=take(mesh.colors),
+        name=mesh.name,
+    )
+
+
+def texture_from_trimesh(mesh: trimesh.Trimesh) -> Optional[Image.Image]:
+    """
+    The base color image of a textured trimesh mesh, if it has one.
+    """
+    if mesh.visual.kind != "texture":
+        return None
+    material = mesh.visual.material
+    return getattr(material, "baseColorTexture", None) or getattr(
+        material, "image", None
+    )
+
+
+def _open(file_obj: FileLike):
+    if isinstance(file_obj, str):
+        return open(file_obj, "wb")
+    # caller keeps ownership of file objects
+    return _NoClose(file_obj)
+
+
+class _NoClose:
+    def __init__(self, f: BinaryIO) -> None:
+        self.f = f
+
+    def __enter__(self) -> BinaryIO:
+        return self.f
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+class _GLBBuilder:
+    """
+    Accumulates 4-byte aligned buffer views and accessors of a single binary buffer.
+    """
+
+    def __init__(self) -> None:
+        self.chunks = []
+        self.length = 0
+        self.buffer_views = []
+        self.accessors = []
+
+    def add_view(
+        self,
+        data: bytes,
+        target: Optional[int] = None,
+        byte_stride: Optional[int] = None,
+    ) -> int:
+        view = {"buffer": 0, "byteOffset": self.length, "byteLength": len(data)}
+        if target is not None:
+            view["target"] = target
+        if byte_stride is not None:
+            view["byteStride"] = byte_stride
+        self.buffer_views.append(view)
+        padding = -len(data) % 4
+        self.chunks += [data, b"\0" * padding]
+        self.length += len(data) + padding
+        return len(self.buffer_views) - 1
+
+    def add_accessor(
+        self,
+        array: np.ndarray,
+        component_type: int,
+        accessor_type: str,
+        target: Optional[int] = None,
+        normalized: bool = False,
+        min_max: bool = False,
+    ) -> int:
+        array = np.ascontiguousarray(array)
+        data, byte_stride = array, None
+        if target == GLTF_ARRAY_BUFFER and array.strides[0] % 4 != 0:
+            # every vertex attribute element must start on a 4-byte boundary, pad them with unused components
+            data = np.pad(array, ((0, 0), (0, -array.strides[0] % 4 // array.itemsize)))
+            byte_stride = data.strides[0]
+        accessor = {
+            "bufferView": self.add_view(data.tobytes(), target, byte_stride),
+            "componentType": component_type,
+            "count": len(array) if accessor_type != "SCALAR" else array.size,
+            "type": accessor_type,
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if min_max:
+            accessor["min"] = array.min(axis=0).tolist()
+            accessor["max"] = array.max(axis=0).tolist()
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def binary(self) -> bytes:
+        return b"".join(self.chunks)
+
+
+def _index_array(faces: np.ndarray, n_vertices: int):
+    if n_vertices <= np.iinfo(np.uint16).max:
+        return faces.astype(np.uint16).reshape(-1), GLTF_UNSIGNED_SHORT
+    return faces.astype(np.uint32).reshape(-1), GLTF_UNSIGNED_INT
+
+
+def _encode_texture(texture: Union[bytes, Image.Image]) -> bytes:
+    if isinstance(texture, bytes):
+        return texture
+    out = io.BytesIO()
+    texture.save(out, format="PNG")
+    return out.getvalue()
+
+
+def _gltf_uvs(uvs: np.ndarray) -> np.ndarray:
+    # glTF puts the UV origin at the top left
+    return uvs.astype(np.float32) * [1.0, -1.0] + [0.0, 1.0]
+
+
+def _add_float_attributes(builder: _GLBBuilder, mesh: MeshArrays) -> dict:
+    attributes = {
+        "POSITION": builder.add_accessor(
+            mesh.vertices.astype(np.float32),
+            GLTF_FLOAT,
+            "VEC3",
+            GLTF_ARRAY_BUFFER,
+            min_max=True,
+        )
+    }
+    if mesh.normals is not None:
+        attributes["NORMAL"] = builder.add_accessor(
+            mesh.normals.astype(np.float32), GLTF_FLOAT, "VEC3", GLTF_ARRAY_BUFFER
+        )
+    if mesh.uvs is not None:
+        attributes["TEXCOORD_0"] = builder.add_accessor(
+            _gltf_uvs(mesh.uvs).astype(np.float32), GLTF_FLOAT, "VEC2", GLTF_ARRAY_BUFFER
+        )
+    return attributes
+
+
+def _add_quantized_attributes(
+    builder: _GLBBuilder, mesh: MeshArrays, node: dict
+) -> dict:
+    """
+    KHR_mesh_quantization attributes: positions as uint16 on a uniform grid over the bounding box, mapped back by the
+    node transform (uniform so that normals are not skewed), int8 normals, and normalized uint16 UVs.
+    """
+    vertices = mesh.vertices.astype(np.float64)
+    lo = vertices.min(axis=0)
+    step = max((vertices.max(axis=0) - lo).max(), 1e-12) / 65535.0
+    node["translation"] = lo.tolist()
+    node["scale"] = [step] * 3
+    attributes = {
+        "POSITION": builder.add_accessor(
+            np.round((vertices - lo) / step).astype(np.uint16),
+            GLTF_UNSIGNED_SHORT,
+            "VEC3",
+            GLTF_ARRAY_BUFFER,
+            min_max=True,
+        )
+    }
+    if mesh.normals is not None:
+        attributes["NORMAL"] = builder.add_accessor(
+            np.round(np.clip(mesh.normals, -1.0, 1.0) * 127.0).astype(np.int8),
+            GLTF_BYTE,
+            "VEC3",
+            GLTF_ARRAY_BUFFER,
+            normalized=True,
+        )
+    if mesh.uvs is not None:
+        attributes["TEXCOORD_0"] = builder.add_accessor(
+            np.round(np.clip(_gltf_uvs(mesh.uvs), 0.0, 1.0) * 65535.0).astype(np.uint16),
+            GLTF_UNSIGNED_SHORT,
+            "VEC2",
+            GLTF_ARRAY_BUFFER,
+            normalized=True,
+        )
+    return attributes
+
+
+def write_glb(
+    file_obj: FileLike,
+    meshes: Union[MeshArrays, List[MeshArrays]],
+    texture: Optional[Union[bytes, Image.Image]] = None,
+    texture_mime_type: str = "image/png",
+    quantize: bool = False,
+    fallback_texture: Optional[Union[bytes, Image.Image]] = None,
+) -> None:
+    """
+    Write meshes to a binary glTF file (a path or a binary file object), one node per mesh, straight from their
+    arrays. `texture` (a PIL image, or encoded image bytes of `texture_mime_type`) is embedded as the base color
+    texture of a material shared by all meshes. DDS textures are referenced through the optional MSFT_texture_dds
+    extension, with a PNG `fallback_texture` (a PIL image or PNG bytes, decoded from the DDS if not given) as the
+    standard source, so that loaders without DDS support still load the file.
+    If `quantize`, vertex attributes are stored as 16 / 8-bit integers with KHR_mesh_quantization, which about halves
+    the size of the vertex data; see also `optimize_order`.
+    """
+    if isinstance(meshes, MeshArrays):
+        meshes = [meshes]
+    builder = _GLBBuilder()
+    extensions = ["KHR_mesh_quantization"] if quantize else []
+    # used if supported, the file is valid without them
+    optional_extensions = []
+    gltf = {
+        "asset": {"version": "2.0", "generator": "tsr.mesh_io"},
+        "scene": 0,
+        "scenes": [{"nodes": list(range(len(meshes)))}],
+        "nodes": [],
+        "meshes": [],
+    }
+
+    if texture is not None:
+        image = {
+            "bufferView": builder.add_view(_encode_texture(texture)),
+            "mimeType": texture_mime_type,
+        }
+        gltf["images"] = [image]
+        if texture_mime_type == DDS_MIME_TYPE:
+            if fallback_texture is None:
+                fallback_texture = Image.fromarray(decode_dds(texture))
+            gltf["images"].append(
+                {
+                    "bufferView": builder.add_view(_encode_texture(fallback_texture)),
+                    "mimeType": "image/png",
+                }
+            )
+            gltf["textures"] = [
+                {"source": 1, "extensions": {"MSFT_texture_dds": {"source": 0}}}
+            ]
+            optional_extensions.append("MSFT_texture_dds")
+        else:
+            gltf["textures"] = [{"source": 0}]
+        gltf["materials"] = [
+            {
+                "pbrMetallicRoughness": {
+                    "baseColorTexture": {"index": 0},
+                    "metallicFactor": 0.0,
+                }
+            }
+        ]
+
+    for i, mesh in enumerate(meshes):
+        node = {"name": mesh.name, "mesh": i}
+        if quantize:
+            attributes = _add_quantized_attributes(builder, mesh, node)
+        else:
+            attributes = _add_float_attributes(builder, mesh)
+        if mesh.colors is not None:
+            attributes["COLOR_0"] = builder.add_accessor(
+                mesh.colors.astype(np.uint8),
+                GLTF_UNSIGNED_BYTE,
+                "VEC4" if mesh.colors.shape[1] == 4 else "VEC3",
+                GLTF_ARRAY_BUFFER,
+                normalized=True,
+            )
+        indices, index_type = _index_array(mesh.faces, len(mesh.vertices))
+        primitive = {
+            "attributes": attributes,
+            "indices": builder.add_accessor(
+                indices, index_type, "SCALAR", GLTF_ELEMENT_ARRAY_BUFFER
+            ),
+            "mode": GLTF_TRIANGLES,
+        }
+        if texture is not None:
+            primitive["material"] = 0
+        gltf["meshes"].append({"name": mesh.name, "primitives": [primitive]})
+        gltf["nodes"].append(node)
+
+    if extensions or optional_extensions:
+        gltf["extensionsUsed"] = extensions + optional_extensions
+    if extensions:
+        gltf["extensionsRequired"] = extensions
+    gltf["bufferViews"] = builder.buffer_views
+    gltf["accessors"] = builder.accessors
+    binary = builder.binary()
+    gltf["buffers"] = [{"byteLength": len(binary)}]
+
+    json_chunk = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    json_chunk += b" " * (-len(json_chunk) % 4)
+    with _open(file_obj) as f:
+        f.write(
+            struct.pack("<4sII", b"glTF", 2, 28 + len(json_chunk) + len(binary))
+        )
+        f.write(struct.pack("<I4s", len(json_chunk), b"JSON"))
+        f.write(json_chunk)
+        f.write(struct.pack("<I4s", len(binary), b"BIN\0"))
+        f.write(binary)
+
+
+def write_ply(file_obj: FileLike, mesh: MeshArrays) -> None:
+    """
+    Write a mesh to a binary little endian PLY file (a path or a binary file object), with normals, texture
+    coordinates (as s, t) and colors if present.
+    """
+    fields = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    if mesh.normals is not None:
+        fields += [("nx", "<f4"), ("ny", "<f4"), ("nz", "<f4")]
+    if mesh.uvs is not None:
+        fields += [("s", "<f4"), ("t", "<f4")]
+    if mesh.colors is not None:
+        fields += [("red", "u1"), ("green", "u1"), ("blue", "u1")]
+        if mesh.colors.shape[1] == 4:
+            fields += [("alpha", "u1")]
+    vertex_data = np.empty(len(mesh.vertices), dtype=fields)
+    for k, name in enumerate("xyz"):
+        vertex_data[name] = mesh.vertices[:, k]
+    if mesh.normals is not None:
+        for k, name in enumerate(["nx", "ny", "nz"]):
+            vertex_data[name] = mesh.normals[:, k]
+    if mesh.uvs is not None:
+        vertex_data["s"] = mesh.uvs[:, 0]
+        vertex_data["t"] = mesh.uvs[:, 1]
+    if mesh.colors is not None:
+        for k, name in enumerate(["red", "green", "blue", "alpha"][: mesh.colors.shape[1]]):
+            vertex_data[name] = mesh.colors[:, k]
+
+    face_data = np.empty(
+        len(mesh.faces), dtype=[("count", "u1"), ("indices", "<i4", (3,))]
+    )
+    face_data["count"] = 3
+    face_data["indices"] = mesh.faces
+
+    ply_types = {"<f4": "float", "u1": "uchar"}
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {len(vertex_data)}"]
+    header += [f"property {ply_types[t]} {name}" for name, t in fields]
+    header += [
+        f"element face {len(face_data)}",
+        "property list uchar int vertex_indices",
+        "end_header",
+    ]
+    with _open(file_obj) as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        f.write(vertex_data.tobytes())
+        f.write(face_data.tobytes())
@@ -451,6 +451,7 @@ class Attention(nn.Module):
         is_cross_attention = self.cross_attention_dim != self.query_dim
         device = self.to_q.weight.data.device
         dtype = self.to_q.weight.data.dtype
+        use_bias = self.to_q.bias is not None
 
         if not is_cross_attention:
             # fetch weight matrices.
@@ -462,9 +463,15 @@ class Attention(nn.Module):
 
             # create a new single projection layer and copy over the weights.
             self.to_qkv = self.linear_cls(
-                in_features, out_features, bias=False, device=device, dtype=dtype
+                in_features, out_features, bias=use_bias, device=device, dtype=dtype
             )
             self.to_qkv.weight.copy_(concatenated_weights)
+            if use_bias:
+                self.to_qkv.bias.copy_(
+                    torch.cat(
+                        [self.to_q.bias.data, self.to_k.bias.data, self.to_v.bias.data]
+                    )
+                )
 
         else:
             concatenated_weights = torch.cat(
@@ -474,12 +481,23 @@ class Attention(nn.Module):
             out_features = concatenated_weights.shape[0]
 
             self.to_kv = self.linear_cls(
-                in_features, out_features, bias=False, device=device, dtype=dtype
+                in_features, out_features, bias=use_bias, device=device, dtype=dtype
             )
             self.to_kv.weight.copy_(concatenated_weights)
+            if use_bias:
+                self.to_kv.bias.copy_(
+                    torch.cat([self.to_k.bias.data, self.to_v.bias.data])
+                )
 
         self.fused_projections = fuse
 
+    def unfuse_projections(self):
+        if hasattr(self, "to_qkv"):
+            del self.to_qkv
+        if hasattr(self, "to_kv"):
+            del self.to_kv
+        self.fused_projections = False
+
 
 class AttnProcessor:
     r"""
@@ -651,3 +669,104 @@ class AttnProcessor2_0:
         hidden_states = hidden_states / attn.rescale_output_factor
 
         return hidden_states
+
+
+class FusedAttnProcessor2_0:
+    r"""
+    Processor for implementing scaled dot-product attention with fused projection layers. For self-attention modules,
+    all projection matrices (i.e., query, key, value) are fused. For cross-attention modules, key and value projection
+    matrices are fused. Call `Attention.fuse_projections()` before using this processor.
+    """
+
+    def __init__(self):
+        if not hasattr(F, "scaled_dot_product_attention"):
+            raise ImportError(
+                "FusedAttnProcessor2_0 requires PyTorch 2.0, to use it, please upgrade PyTorch to 2.0."
+            )
+
+    def __call__(
+        self,
+        attn: Attention,
+        hidden_states: torch.FloatTensor,
+        encoder_hidden_states: Optional[torch.FloatTensor] = None,
+        attention_mask: Optional[torch.FloatTensor] = None,
+    ) -> torch.FloatTensor:
+        residual = hidden_states
+
+        input_ndim = hidden_states.ndim
+
+        if input_ndim == 4:
+            batch_size, channel, height, width = hidden_states.shape
+            hidden_states = hidden_states.view(
+                batch_size, channel, height * width
+            ).transpose(1, 2)
+
+        batch_size, sequence_length, _ = (
+            hidden_states.shape
+            if encoder_hidden_states is None
+            else encoder_hidden_states.shape
+        )
+
+        if attention_mask is not None:
+            attention_mask = attn.prepare_attention_mask(
+                attention_mask, sequence_length, batch_size
+            )
+            # scaled_dot_product_attention expects attention_mask shape to be
+            # (batch, heads, source_length, target_length)
+            attention_mask = attention_mask.view(
+                batch_size, attn.heads, -1, attention_mask.shape[-1]
+            )
+
+        if attn.group_norm is not None:
+            hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(
+                1, 2
+            )
+
+        if encoder_hidden_states is None:
+            # one GEMM for query, key and value
+            qkv = attn.to_qkv(hidden_states)
+            query, key, value = torch.chunk(qkv, 3, dim=-1)
+        else:
+            if attn.norm_cross:
+                encoder_hidden_states = attn.norm_encoder_hidden_states(
+                    encoder_hidden_states
+                )
+            query = attn.to_q(hidden_states)
+            # one GEMM for key and value
+            kv = attn.to_kv(encoder_hidden_states)
+            key, value = torch.chunk(kv, 2, dim=-1)
+
+        inner_dim = key.shape[-1]
+        head_dim = inner_dim // attn.heads
+
+        query = query.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        key = key.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+        value = value.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
+
+        # the output of sdp = (batch, num_heads, seq_len, head_dim)
+        hidden_states = F.scaled_dot_product_attention(
+            query, key, value, attn_mask=attention_mask, dropout_p=0.0, is_causal=False
+        )
+
+        hidden_states = hidden_states.transpose(1, 2).reshape(
+            batch_size, -1, attn.heads * head_dim
+        )
+        hidden_states = hidden_states.to(query.dtype)
+
+        # linear proj
+        hidden_states = attn.to_out[0](hidden_states)
+        # dropout
+        hidden_states = attn.to_out[1](hidden_states)
+
+        if input_ndim == 4:
+            hidden_states = hidden_states.transpose(-1, -2).reshape(
+                batch_size, channel, height, width
+            )
+
+        if attn.residual_connection:
+            hidden_states = hidden_states + residual
+
+        hidden_states = hidden_states / attn.rescale_output_factor
+
+        return hidden_states
@@ -44,6 +44,7 @@ import torch.nn.functional as F
 from torch import nn
 
 from ...utils import BaseModule
+from .attention import Attention, AttnProcessor2_0, FusedAttnProcessor2_0
 from .basic_transformer_block import BasicTransformerBlock
 
 
@@ -119,6 +120,26 @@ class Transformer1D(BaseModule):
 
         self.gradient_checkpointing = self.cfg.gradient_checkpointing
 
+    def fuse_qkv_projections(self) -> None:
+        """
+        Fuses the query, key and value projections of every self-attention module into a single linear layer, and the
+        key and value projections of every cross-attention module into another, so that each attention issues one
+        projection GEMM instead of three (or two). Call this after the weights have been loaded.
+        """
+        for module in self.modules():
+            if isinstance(module, Attention) and not module.fused_projections:
+                module.fuse_projections(fuse=True)
+                module.set_processor(FusedAttnProcessor2_0())
+
+    def unfuse_qkv_projections(self) -> None:
+        """
+        Disables the fused projections enabled by `fuse_qkv_projections` and restores the default processors.
+        """
+        for module in self.modules():
+            if isinstance(module, Attention) and module.fused_projections:
+                module.unfuse_projections()
+                module.set_processor(AttnProcessor2_0())
+
     def forward(
         self,
         hidden_states: torch.Tensor,
@@ -0,0 +1,252 @@
+import json
+import logging
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from .aot import SceneCodeEncoder
+
+ONNX_OPSET = 17
+
+
+class _DecoderExport(nn.Module):
+    # onnx outputs have to be a flat tuple instead of the dict returned by the decoder
+    def __init__(self, decoder: nn.Module) -> None:
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, features: torch.Tensor):
+        out = self.decoder(features)
+        return out["density"], out["features"]
+
+
+def _encoder_path(onnx_dir: str, batch_size: int) -> str:
+    return os.path.join(onnx_dir, f"scene_encoder_b{batch_size}.onnx")
+
+
+def _decoder_path(onnx_dir: str) -> str:
+    return os.path.join(onnx_dir, "decoder.onnx")
+
+
+def _meta_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+def _onnx_meta(model, batch_size: Optional[int] = None) -> dict:
+    # the graphs embed the weights, so a different checkpoint needs a new export
+    meta = {"opset": ONNX_OPSET, **model.checkpoint_identity()}
+    if batch_size is not None:
+        meta.update(
+            batch_size=batch_size,
+            cond_image_size=model.cfg.cond_image_size,
+            fused_qkv_projections=any(
+                getattr(module, "fused_projections", False)
+                for module in model.modules()
+            ),
+        )
+    return meta
+
+
+def _example_input(model, batch_size: int, device: str) -> torch.FloatTensor:
+    size = model.cfg.cond_image_size
+    return torch.rand(batch_size, 1, size, size, 3, device=device)
+
+
+def _example_features(model, n_points: int, device: str) -> torch.FloatTensor:
+    return torch.randn(n_points, model.decoder.cfg.in_channels, device=device)
+
+
+def _onnx_models(model, onnx_dir: str, batch_size: int):
+    # the decoder is shared by all batch sizes, so each model has its own metadata
+    return [
+        (_encoder_path(onnx_dir, batch_size), _onnx_meta(model, batch_size)),
+        (_decoder_path(onnx_dir), _onnx_meta(model)),
+    ]
+
+
+def onnx_model_exists(model, onnx_dir: str, batch_size: int) -> bool:
+    """
+    Whether both onnx models exist in `onnx_dir` and were exported from the same checkpoint and options as `model`.
+    """
+    for path, meta in _onnx_models(model, onnx_dir, batch_size):
+        if not os.path.exists(path) or not os.path.exists(_meta_path(path)):
+            return False
+        with open(_meta_path(path)) as f:
+            saved_meta = json.load(f)
+        if saved_meta != meta:
+            logging.info(f"Re-exporting {path}: exported for {saved_meta}.")
+            return False
+    return True
+
+
+def export_onnx(model, onnx_dir: str, batch_size: int, device: str) -> None:
+    """
+    Export the image -> scene code part of `model` for a fixed batch size, and the triplane feature decoder with a
+    dynamic number of query points, to ONNX models in `onnx_dir`.
+    """
+    os.makedirs(onnx_dir, exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            SceneCodeEncoder(model).eval(),
+            (_example_input(model, batch_size, device),),
+            _encoder_path(onnx_dir, batch_size),
+            input_names=["rgb_cond"],
+            output_names=["scene_codes"],
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+        torch.onnx.export(
+            _DecoderExport(model.decoder).eval(),
+            (_example_features(model, 1024, device),),
+            _decoder_path(onnx_dir),
+            input_names=["features"],
+            output_names=["density", "features_out"],
+            dynamic_axes={
+                "features": {0: "n_points"},
+                "density": {0: "n_points"},
+                "features_out": {0: "n_points"},
+            },
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+    for path, meta in _onnx_models(model, onnx_dir, batch_size):
+        with open(_meta_path(path), "w") as f:
+            json.dump(meta, f, indent=2)
+
+
+def create_session(path: str, device: str, num_threads: int = 0):
+    """
+    Create an onnxruntime session tuned for single-request inference: all graph optimizations, one sequential
+    inter-op thread and `num_threads` intra-op threads (0 lets onnxruntime use all physical cores).
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = num_threads
+    options.inter_op_num_threads = 1
+    providers = ["CPUExecutionProvider"]
+    if (
+        torch.device(device).type == "cuda"
+        and "CUDAExecutionProvider" in ort.get_available_providers()
+    ):
+        providers.insert(0, "CUDAExecutionProvider")
+    return ort.InferenceSession(path, sess_options=options, providers=providers)
+
+
+class ONNXSceneEncoder:
+    def __init__(self, session) -> None:
+        self.session = session
+
+    def __call__(self, rgb_cond: torch.FloatTensor) -> torch.FloatTensor:
+        (scene_codes,) = self.session.run(
+            None, {"rgb_cond": rgb_cond.detach().cpu().numpy().astype(np.float32)}
+        )
+        return torch.from_numpy(scene_codes).to(rgb_cond.device)
+
+
+class ONNXDecoder(nn.Module):
+    """
+    Drop-in replacement for the triplane feature decoder, running on onnxruntime.
+    """
+
+    def __init__(self, session, cfg) -> None:
+        super().__init__()
+        self.session = session
+        self.cfg = cfg
+
+    def forward(self, x: torch.Tensor) -> Dict[str, torch.Tensor]:
+        inp_shape = x.shape[:-1]
+        density, features = self.session.run(
+            None,
+            {
+                "features": x.reshape(-1, x.shape[-1])
+                .detach()
+                .cpu()
+                .numpy()
+                .astype(np.float32)
+            },
+        )
+        return {
+            "density": torch.from_numpy(density).to(x.device).reshape(*inp_shape, -1),
+            "features": torch.from_numpy(features)
+            .to(x.device)
+            .reshape(*inp_shape, -1),
+        }
+
+
+def _max_abs_diff(a: torch.Tensor, b: torch.Tensor) -> float:
+    return (a.float() - b.float()).abs().max().item()
+
+
+def check_parity(
+    model,
+    encoder: ONNXSceneEncoder,
+    decoder: ONNXDecoder,
+    batch_size: int,
+    device: str,
+    atol: float = 1e-3,
+) -> Tuple[Dict[str, float], bool]:
+    """
+    Compare the onnx encoder and decoder against the torch modules of `model` on random inputs. Returns the maximum
+    absolute differences, and whether all of them are within `atol` relative to the magnitude of the torch outputs.
+    """
+    rgb_cond = _example_input(model, batch_size, device)
+    features = _example_features(model, 8192, device)
+    with torch.no_grad():
+        scene_codes_ref = model.encode(rgb_cond)
+        decoded_ref = model.decoder(features)
+    scene_codes = encoder(rgb_cond)
+    decoded = decoder(features)
+
+    errors = {"scene_codes": _max_abs_diff(scene_codes, scene_codes_ref)}
+    scales = {"scene_codes": scene_codes_ref.abs().max().item()}
+    for k in ["density", "features"]:
+        errors[k] = _max_abs_diff(decoded[k], decoded_ref[k])
+        scales[k] = decoded_ref[k].abs().max().item()
+
+    return errors, all(errors[k] <= atol * max(1.0, scales[k]) for k in errors)
+
+
+def use_onnx_backend(
+    model,
+    onnx_dir: str,
+    batch_size: int,
+    device: str,
+    num_threads: int = 0,
+    verify: bool = True,
+) -> bool:
+    """
+    Run the scene encoder and the triplane decoder of `model` through onnxruntime, exporting the onnx models to
+    `onnx_dir` first if they are missing or were exported for another checkpoint. With `verify`, the torch path is kept if the onnx outputs do not match it. Returns
+    whether the onnx backend is in use.
+    """
+    if not onnx_model_exists(model, onnx_dir, batch_size):
+        export_onnx(model, onnx_dir, batch_size, device)
+
+    encoder = ONNXSceneEncoder(
+        create_session(_encoder_path(onnx_dir, batch_size), device, num_threads)
+    )
+    decoder = ONNXDecoder(
+        create_session(_decoder_path(onnx_dir), device, num_threads), model.decoder.cfg
+    )
+
+    if verify:
+        errors, passed = check_parity(model, encoder, decoder, batch_size, device)
+        message = "max abs error: " + ", ".join(
+            f"{k} {v:.2e}" for k, v in errors.items()
+        )
+        if not passed:
+            logging.warning(
+                f"ONNX backend does not match the torch backend ({message}), using torch instead."
+            )
+            return False
+        logging.info(f"ONNX parity check passed, {message}.")
+
+    model.set_scene_encoder(batch_size, encoder)
+    model.decoder = decoder
+    return True
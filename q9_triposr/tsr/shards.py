@@ -0,0 +1,192 @@
+import io
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .async_writer import atomic_write
+
+INDEX_NAME = "index.json"
+
+
+def _write_index(directory: str, shards: List[str], members: Dict[str, list]) -> None:
+    def write(path):
+        with open(path, "w") as f:
+            json.dump({"shards": shards, "members": members}, f)
+
+    atomic_write(os.path.join(directory, INDEX_NAME), write)
+
+
+def scan_shards(directory: str) -> Dict[str, Any]:
+    """
+    Index of a shard directory built in memory by scanning its tar files, without writing it. Later shards win for
+    members stored more than once.
+    """
+    shards = sorted(f for f in os.listdir(directory) if f.endswith(".tar"))
+    members = {}
+    for shard_id, shard in enumerate(shards):
+        try:
+            with tarfile.open(os.path.join(directory, shard)) as tar:
+                for info in tar:
+                    if info.isfile():
+                        members[info.name] = [shard_id, info.offset_data, info.size]
+        except tarfile.ReadError:
+            # a shard truncated mid-member keeps the members read so far
+            pass
+    return {"shards": shards, "members": members}
+
+
+def build_index(directory: str) -> Dict[str, Any]:
+    """
+    Rebuild and write the index of a shard directory, e.g. after a run was interrupted before writing it.
+    """
+    index = scan_shards(directory)
+    _write_index(directory, index["shards"], index["members"])
+    return index
+
+
+class ShardWriter:
+    """
+    Store many small output files in a few large uncompressed tar shards under `directory` instead of one file each,
+    so that a catalog-scale run does sequential bulk writes instead of per-file metadata operations on a shared
+    filesystem. A new shard is started once the current one exceeds `max_shard_bytes`. The index (index.json) maps
+    every member name to its shard, data offset and size for random access with `ShardReader`; it is rewritten
+    whenever a shard is completed and on `close`.
+
+    Opening a directory that already holds shards appends new shards to it. Writes are thread-safe, so a
+    `tsr.async_writer.AsyncWriter` can encode outputs on several threads and append them here.
+    """
+
+    def __init__(self, directory: str, prefix: str = "shard", max_shard_bytes: int = 1 << 30):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(directory, exist_ok=True)
+        index = None
+        if os.path.exists(os.path.join(directory, INDEX_NAME)):
+            with open(os.path.join(directory, INDEX_NAME)) as f:
+                index = json.load(f)
+        # shards missing from the index were left by an interrupted run
+        tars = [f for f in os.listdir(directory) if f.endswith(".tar")]
+        if index is None or set(tars) != set(index["shards"]):
+            index = build_index(directory)
+        self.shards, self.members = index["shards"], index["members"]
+        self.lock = threading.Lock()
+        self.tar = None
+
+    def _open_shard(self) -> None:
+        if self.tar is not None:
+            self.tar.close()
+            _write_index(self.directory, self.shards, self.members)
+        name = f"{self.prefix}-{len(self.shards):05d}.tar"
+        self.tar = tarfile.open(os.path.join(self.directory, name), "w", format=tarfile.PAX_FORMAT)
+        self.shards.append(name)
+
+    def add(self, name: str, data: bytes) -> None:
+        """
+        Append a member holding `data`.
+        """
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        with self.lock:
+            if self.tar is None or self.tar.offset >= self.max_shard_bytes:
+                self._open_shard()
+            # the data follows the header blocks, long names add extended header blocks
+            header_size = len(info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors))
+            offset = self.tar.offset + header_size
+            self.tar.addfile(info, io.BytesIO(data))
+            self.tar.fileobj.flush()
+            self.members[name] = [len(self.shards) - 1, offset, len(data)]
+
+    def write(self, path: str, write_fn: Callable, *args, **kwargs) -> Any:
+        """
+        Drop-in for `tsr.async_writer.atomic_write`: call `write_fn(tmp_path, *args, **kwargs)` on a local temporary
+        file and append it as the member named after `path` relative to the shard directory, e.g. "0/mesh.obj".
+        Returns the result of `write_fn`.
+        """
+        name = os.path.relpath(os.path.abspath(path), os.path.abspath(self.directory))
+        if name.startswith(os.pardir):
+            raise ValueError(f"{path} is not inside the shard directory {self.directory}")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # same file name, writers may pick the format from the extension
+            tmp_path = os.path.join(tmp_dir, os.path.basename(path))
+            result = write_fn(tmp_path, *args, **kwargs)
+            with open(tmp_path, "rb") as f:
+                self.add(name.replace(os.sep, "/"), f.read())
+        return result
+
+    def close(self) -> None:
+        """
+        Complete the current shard and write the index.
+        """
+        with self.lock:
+            if self.tar is not None:
+                self.tar.close()
+                self.tar = None
+            _write_index(self.directory, self.shards, self.members)
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ShardReader:
+    """
+    Random access to the members of a shard directory written by `ShardWriter` (or of plain tar files, scanned in
+    memory on open, the directory is never written to). Reads are a seek and a read in the shard, no per-member file
+    is opened.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        index_path = os.path.join(directory, INDEX_NAME)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+        else:
+            index = scan_shards(directory)
+        self.shards, self.members = index["shards"], index["members"]
+        self.files = {}
+
+    def names(self, extensions: Optional[Sequence[str]] = None) -> List[str]:
+        """
+        Member names, optionally only those with one of `extensions`, in storage order so that reading them in turn
+        is sequential.
+        """
+        names = [
+            name
+            for name in self.members
+            if extensions is None or name.lower().endswith(tuple(extensions))
+        ]
+        return sorted(names, key=lambda name: self.members[name][:2])
+
+    def read(self, name: str) -> bytes:
+        shard_id, offset, size = self.members[name]
+        if shard_id not in self.files:
+            self.files[shard_id] = open(os.path.join(self.directory, self.shards[shard_id]), "rb")
+        f = self.files[shard_id]
+        f.seek(offset)
+        return f.read(size)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.members
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def close(self) -> None:
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def __enter__(self) -> "ShardReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
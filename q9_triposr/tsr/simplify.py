@@ -0,0 +1,272 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import scipy.sparse
+import trimesh
+
+
+def _unique_edges(faces: np.ndarray, n_vertices: int) -> Tuple[np.ndarray, np.ndarray]:
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    keys, counts = np.unique(edges[:, 0] * n_vertices + edges[:, 1], return_counts=True)
+    return np.stack([keys // n_vertices, keys % n_vertices], axis=-1), counts
+
+
+def _face_quadrics(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    # area weighted plane quadrics, one (4, 4) matrix per face
+    tri = vertices[faces]
+    normals = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    double_area = np.linalg.norm(normals, axis=-1, keepdims=True)
+    normals = normals / np.maximum(double_area, 1e-20)
+    planes = np.concatenate(
+        [normals, -(normals * tri[:, 0]).sum(-1, keepdims=True)], axis=-1
+    )
+    return planes[:, :, None] * planes[:, None, :] * (double_area[:, :, None] / 2.0)
+
+
+def _optimal_positions(
+    quadrics: np.ndarray, pa: np.ndarray, pb: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Position minimizing the summed quadric of every edge, falling back to the best of the endpoints and the midpoint
+    when the system is ill-conditioned. Returns the positions and their costs.
+    """
+    A = quadrics[:, :3, :3]
+    b = quadrics[:, :3, 3]
+    det = np.linalg.det(A)
+    scale = np.abs(A).max(axis=(1, 2)) ** 3
+    solvable = np.abs(det) > 1e-6 * np.maximum(scale, 1e-30)
+    positions = (pa + pb) / 2.0
+    if solvable.any():
+        positions[solvable] = np.linalg.solve(A[solvable], -b[solvable, :, None])[
+            ..., 0
+        ]
+
+    def cost(p):
+        h = np.concatenate([p, np.ones_like(p[:, :1])], axis=-1)
+        return np.einsum("ni,nij,nj->n", h, quadrics, h)
+
+    candidates = [positions, pa, pb, (pa + pb) / 2.0]
+    costs = np.stack([cost(p) for p in candidates], axis=-1)
+    # the solution is not guaranteed to stay close to the edge when the quadric is nearly degenerate
+    costs[~solvable, 0] = np.inf
+    best = costs.argmin(axis=-1)
+    positions = np.stack(candidates, axis=1)[np.arange(len(best)), best]
+    return positions, costs[np.arange(len(best)), best]
+
+
+def _independent_edges(
+    edges: np.ndarray, rank: np.ndarray, n_vertices: int
+) -> np.ndarray:
+    """
+    Select the edges with the lowest rank (a unique cost order, inf for excluded edges) of all the edges around both
+    their endpoints and their neighbors, so that no face touches two selected edges and the collapses can be applied
+    at the same time.
+    """
+    vertex_min = np.full(n_vertices, np.inf)
+    np.minimum.at(vertex_min, edges[:, 0], rank)
+    np.minimum.at(vertex_min, edges[:, 1], rank)
+    ring_min = vertex_min.copy()
+    np.minimum.at(ring_min, edges[:, 0], vertex_min[edges[:, 1]])
+    np.minimum.at(ring_min, edges[:, 1], vertex_min[edges[:, 0]])
+    return np.nonzero(
+        np.isfinite(rank)
+        & (rank == ring_min[edges[:, 0]])
+        & (rank == ring_min[edges[:, 1]])
+    )[0]
+
+
+def _valid_collapses(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    edges: np.ndarray,
+    positions: np.ndarray,
+    adjacency: scipy.sparse.csr_matrix,
+    min_normal_cos: float,
+) -> np.ndarray:
+    """
+    Check a set of independent edge collapses: the endpoints of an interior edge must share exactly two neighbors (the
+    link condition, keeping the mesh manifold), and no surviving face may flip or degenerate.
+    """
+    a, b = edges[:, 0], edges[:, 1]
+    shared = np.asarray(adjacency[a].multiply(adjacency[b]).sum(axis=1)).reshape(-1)
+    valid = shared == 2
+
+    # collapse id of every vertex, -1 if it is not an endpoint of a checked edge
+    collapse_of = np.full(len(vertices), -1, dtype=np.int64)
+    collapse_of[a] = np.arange(len(edges))
+    collapse_of[b] = np.arange(len(edges))
+    face_collapse = collapse_of[faces]
+    touched = (face_collapse >= 0).any(axis=1)
+    # faces containing the collapsed edge disappear
+    removed = np.zeros(len(faces), dtype=bool)
+    for i, j in [(0, 1), (1, 2), (2, 0)]:
+        removed |= (face_collapse[:, i] == face_collapse[:, j]) & (
+            face_collapse[:, i] >= 0
+        )
+    check = np.nonzero(touched & ~removed)[0]
+    corner_collapse = face_collapse[check]
+    old_tri = vertices[faces[check]]
+    new_tri = old_tri.copy()
+    moved = corner_collapse >= 0
+    new_tri[moved] = positions[corner_collapse[moved]]
+    old_normals = np.cross(old_tri[:, 1] - old_tri[:, 0], old_tri[:, 2] - old_tri[:, 0])
+    new_normals = np.cross(new_tri[:, 1] - new_tri[:, 0], new_tri[:, 2] - new_tri[:, 0])
+    bad = (old_normals * new_normals).sum(-1) <= min_normal_cos * np.maximum(
+        np.linalg.norm(old_normals, axis=-1) * np.linalg.norm(new_normals, axis=-1),
+        1e-30,
+    )
+    valid[corner_collapse.max(axis=1)[bad]] = False
+    return valid
+
+
+def simplify(
+    vertices: np.ndarray,
+    faces: np.ndarray,
+    target_faces: int,
+    attributes: Optional[np.ndarray] = None,
+    max_passes: int = 200,
+    min_normal_cos: float = 0.2,
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """
+    Decimate a triangle mesh down to about `target_faces` faces with quadric error edge collapses. Every pass collapses
+    a set of independent edges at once, chosen by increasing quadric error. Collapses that would flip a face (by more
+    than `min_normal_cos`), create non-manifold geometry, or move a boundary vertex are skipped. Per-vertex
+    `attributes` (e.g. colors) are interpolated along the collapsed edges.
+
+    Returns the vertices, faces and attributes of the simplified mesh, with unused vertices removed.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).copy()
+    faces = np.asarray(faces, dtype=np.int64).copy()
+    if attributes is not None:
+        attributes_dtype = attributes.dtype
+        attributes = np.asarray(attributes, dtype=np.float64).copy()
+    n_vertices = len(vertices)
+
+    quadrics = np.zeros((n_vertices, 4, 4))
+    face_quadrics = _face_quadrics(vertices, faces)
+    for k in range(3):
+        np.add.at(quadrics, faces[:, k], face_quadrics)
+
+    for _ in range(max_passes):
+        if len(faces) <= target_faces:
+            break
+        edges, counts = _unique_edges(faces, n_vertices)
+        locked = np.zeros(n_vertices, dtype=bool)
+        locked[edges[counts != 2].reshape(-1)] = True
+
+        positions, costs = _optimal_positions(
+            quadrics[edges[:, 0]] + quadrics[edges[:, 1]],
+            vertices[edges[:, 0]],
+            vertices[edges[:, 1]],
+        )
+        costs[locked[edges[:, 0]] | locked[edges[:, 1]]] = np.inf
+        adjacency = scipy.sparse.coo_matrix(
+            (
+                np.ones(2 * len(edges), dtype=np.int32),
+                (
+                    np.concatenate([edges[:, 0], edges[:, 1]]),
+                    np.concatenate([edges[:, 1], edges[:, 0]]),
+                ),
+            ),
+            shape=(n_vertices, n_vertices),
+        ).tocsr()
+
+        # unique ranks in cost order break ties between equal costs
+        rank = np.empty(len(edges), dtype=np.float64)
+        rank[np.argsort(costs, kind="stable")] = np.arange(len(edges))
+        rank[~np.isfinite(costs)] = np.inf
+
+        # every collapse removes two faces, do not go below the budget
+        budget = max((len(faces) - target_faces) // 2, 1)
+        accepted = []
+        n_accepted = 0
+        blocked = np.zeros(n_vertices, dtype=bool)
+        while n_accepted < budget:
+            # cheapest edges in their neighborhood, away from the collapses accepted so far
+            candidate_rank = np.where(
+                blocked[edges[:, 0]] | blocked[edges[:, 1]], np.inf, rank
+            )
+            selected = _independent_edges(edges, candidate_rank, n_vertices)
+            if len(selected) == 0:
+                break
+            selected = selected[np.argsort(rank[selected])][: budget - n_accepted]
+            valid = _valid_collapses(
+                vertices,
+                faces,
+                edges[selected],
+                positions[selected],
+                adjacency,
+                min_normal_cos,
+            )
+            rank[selected[~valid]] = np.inf
+            selected = selected[valid]
+            accepted.append(selected)
+            n_accepted += len(selected)
+            # block the one-ring of the collapsed vertices so that no face sees two collapses
+            collapsed = np.zeros(n_vertices, dtype=bool)
+            collapsed[edges[selected].reshape(-1)] = True
+            blocked |= collapsed
+            blocked[edges[collapsed[edges[:, 1]], 0]] = True
+            blocked[edges[collapsed[edges[:, 0]], 1]] = True
+        if n_accepted == 0:
+            break
+        selected = np.concatenate(accepted)
+
+        a, b = edges[selected, 0], edges[selected, 1]
+        new_positions = positions[selected]
+        if attributes is not None:
+            segment = vertices[b] - vertices[a]
+            t = (
+                ((new_positions - vertices[a]) * segment).sum(-1)
+                / np.maximum((segment * segment).sum(-1), 1e-30)
+            ).clip(0.0, 1.0)[:, None]
+            attributes[a] = (1.0 - t) * attributes[a] + t * attributes[b]
+        vertices[a] = new_positions
+        quadrics[a] += quadrics[b]
+
+        remap = np.arange(n_vertices)
+        remap[b] = a
+        faces = remap[faces]
+        faces = faces[
+            (faces[:, 0] != faces[:, 1])
+            & (faces[:, 1] != faces[:, 2])
+            & (faces[:, 2] != faces[:, 0])
+        ]
+
+    used = np.zeros(n_vertices, dtype=bool)
+    used[faces.reshape(-1)] = True
+    new_index = np.cumsum(used) - 1
+    faces = new_index[faces]
+    vertices = vertices[used]
+    if attributes is not None:
+        attributes = attributes[used]
+        if np.issubdtype(attributes_dtype, np.integer):
+            attributes = attributes.round()
+        attributes = attributes.astype(attributes_dtype)
+    return vertices, faces, attributes
+
+
+def simplify_mesh(mesh: trimesh.Trimesh, target_faces: int) -> trimesh.Trimesh:
+    """
+    `simplify` a trimesh mesh, keeping its vertex colors or texture coordinates and material if it has any. UV seams
+    are split edges, hence boundaries, so they are kept in place.
+    """
+    if mesh.visual.kind == "vertex":
+        vertices, faces, colors = simplify(
+            mesh.vertices, mesh.faces, target_faces, mesh.visual.vertex_colors
+        )
+        return trimesh.Trimesh(
+            vertices=vertices, faces=faces, vertex_colors=colors, process=False
+        )
+    if mesh.visual.kind == "texture" and mesh.visual.uv is not None:
+        vertices, faces, uv = simplify(
+            mesh.vertices, mesh.faces, target_faces, mesh.visual.uv
+        )
+        return trimesh.Trimesh(
+            vertices=vertices,
+            faces=faces,
+            visual=trimesh.visual.TextureVisuals(uv=uv, material=mesh.visual.material),
+            process=False,
+        )
+    vertices, faces, _ = simplify(mesh.vertices, mesh.faces, target_faces)
+    return trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
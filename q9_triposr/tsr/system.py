@@ -1,26 +1,61 @@
 import math
 import os
 from dataclasses import dataclass, field
-from typing import List, Union
+from typing import Callable, Dict, List, Optional, Union
 
 import numpy as np
 import PIL.Image
 import torch
 import torch.nn.functional as F
-import trimesh
 from einops import rearrange
 from huggingface_hub import hf_hub_download
 from omegaconf import OmegaConf
 from PIL import Image
 
-from .models.isosurface import MarchingCubeHelper
+from .models.isosurface import (
+    MarchingCubeHelper,
+    SlabMarchingCubeHelper,
+    SurfaceNetsHelper,
+)
+from .mesh import build_mesh
+from .models.transformer.transformer_1d import Transformer1D
 from .utils import (
     BaseModule,
     ImagePreprocessor,
     find_class,
     get_spherical_cameras,
     scale_tensor,
+    trilinear_interpolate,
 )
+from .volume import DensityVolume
+
+
+def encode_scene(
+    image_tokenizer, tokenizer, backbone, post_processor, rgb_cond: torch.FloatTensor
+) -> torch.FloatTensor:
+    """
+    Static-shape part of the `TSR` forward pass: (B, 1, H, W, C) image -> scene codes. Shared by `TSR.encode` and the
+    standalone encoder exported by `tsr.aot`.
+    """
+    batch_size = rgb_cond.shape[0]
+
+    input_image_tokens: torch.Tensor = image_tokenizer(
+        rearrange(rgb_cond, "B Nv H W C -> B Nv C H W", Nv=1),
+    )
+
+    input_image_tokens = rearrange(
+        input_image_tokens, "B Nv C Nt -> B (Nv Nt) C", Nv=1
+    )
+
+    tokens: torch.Tensor = tokenizer(batch_size)
+
+    tokens = backbone(
+        tokens,
+        encoder_hidden_states=input_image_tokens,
+    )
+
+    scene_codes = post_processor(tokenizer.detokenize(tokens))
+    return scene_codes
 
 
 class TSR(BaseModule):
@@ -68,6 +103,7 @@ class TSR(BaseModule):
         model = cls(cfg)
         ckpt = torch.load(weight_path, map_location="cpu")
         model.load_state_dict(ckpt)
+        model.weight_path = os.path.abspath(weight_path)
         return model
 
     def configure(self):
@@ -83,6 +119,32 @@ class TSR(BaseModule):
         self.renderer = find_class(self.cfg.renderer_cls)(self.cfg.renderer)
         self.image_processor = ImagePreprocessor()
         self.isosurface_helper = None
+        self.scene_encoders: Dict[int, Callable] = {}
+        # set by from_pretrained, identifies the weights baked into exported artifacts
+        self.weight_path: Optional[str] = None
+
+    def checkpoint_identity(self) -> dict:
+        """
+        Path, size and modification time of the loaded weights, for caches of artifacts that embed them.
+        """
+        if self.weight_path is None or not os.path.exists(self.weight_path):
+            return {"weight_path": self.weight_path}
+        stat = os.stat(self.weight_path)
+        return {
+            "weight_path": self.weight_path,
+            "weight_size": stat.st_size,
+            "weight_mtime": stat.st_mtime,
+        }
+
+    def fuse_qkv_projections(self) -> None:
+        for module in self.modules():
+            if isinstance(module, Transformer1D):
+                module.fuse_qkv_projections()
+
+    def unfuse_qkv_projections(self) -> None:
+        for module in self.modules():
+            if isinstance(module, Transformer1D):
+                module.unfuse_qkv_projections()
 
     def forward(
         self,
@@ -100,24 +162,24 @@ class TSR(BaseModule):
             device
         )
         batch_size = rgb_cond.shape[0]
+        encoder = self.scene_encoders.get(batch_size, self.encode)
+        return encoder(rgb_cond)
 
-        input_image_tokens: torch.Tensor = self.image_tokenizer(
-            rearrange(rgb_cond, "B Nv H W C -> B Nv C H W", Nv=1),
+    def encode(self, rgb_cond: torch.FloatTensor) -> torch.FloatTensor:
+        return encode_scene(
+            self.image_tokenizer,
+            self.tokenizer,
+            self.backbone,
+            self.post_processor,
+            rgb_cond,
         )
 
-        input_image_tokens = rearrange(
-            input_image_tokens, "B Nv C Nt -> B (Nv Nt) C", Nv=1
-        )
-
-        tokens: torch.Tensor = self.tokenizer(batch_size)
-
-        tokens = self.backbone(
-            tokens,
-            encoder_hidden_states=input_image_tokens,
-        )
-
-        scene_codes = self.post_processor(self.tokenizer.detokenize(tokens))
-        return scene_codes
+    def set_scene_encoder(self, batch_size: int, encoder: Optional[Callable]) -> None:
+        # replace the eager encode path for a fixed batch size, e.g. by a compiled one
+        if encoder is None:
+            self.scene_encoders.pop(batch_size, None)
+        else:
+            self.scene_encoders[batch_size] = encoder
 
     def render(
         self,
@@ -160,46 +222,156 @@ class TSR(BaseModule):
 
         return images
 
-    def set_marching_cubes_resolution(self, resolution: int):
+    def set_marching_cubes_resolution(
+        self,
+        resolution: int,
+        slab_size: int = 0,
+        num_workers: int = 0,
+        isosurface: str = "marching_cubes",
+    ):
+        assert isosurface in ["marching_cubes", "surface_nets"]
+        assert (
+            slab_size == 0 or isosurface == "marching_cubes"
+        ), "slab-wise extraction is only implemented for marching cubes."
         if (
             self.isosurface_helper is not None
             and self.isosurface_helper.resolution == resolution
+            and getattr(self.isosurface_helper, "slab_size", 0) == slab_size
+            and getattr(self.isosurface_helper, "num_workers", 0) == num_workers
+            and isinstance(self.isosurface_helper, SurfaceNetsHelper)
+            == (isosurface == "surface_nets")
         ):
             return
-        self.isosurface_helper = MarchingCubeHelper(resolution)
+        if isosurface == "surface_nets":
+            self.isosurface_helper = SurfaceNetsHelper(resolution)
+        elif slab_size > 0:
+            self.isosurface_helper = SlabMarchingCubeHelper(
+                resolution, slab_size, num_workers
+            )
+        else:
+            self.isosurface_helper = MarchingCubeHelper(resolution)
 
-    def extract_mesh(self, scene_codes, has_vertex_color, resolution: int = 256, threshold: float = 25.0):
+    def query_grid(
+        self, scene_code, grid_vertices: Optional[torch.FloatTensor] = None
+    ) -> Dict[str, torch.Tensor]:
+        if grid_vertices is None:
+            grid_vertices = self.isosurface_helper.grid_vertices
+        with torch.no_grad():
+            return self.renderer.query_triplane(
+                self.decoder,
+                scale_tensor(
+                    grid_vertices.to(scene_code.device),
+                    self.isosurface_helper.points_range,
+                    (-self.renderer.cfg.radius, self.renderer.cfg.radius),
+                ),
+                scene_code,
+            )
+
+    def extract_density_volumes(
+        self, scene_codes, resolution: int = 256, encoding: str = "float32"
+    ) -> List[DensityVolume]:
+        # full precision by default, so that the volumes can also be passed to extract_mesh and quantized on save
         self.set_marching_cubes_resolution(resolution)
+        return [
+            DensityVolume.from_density(
+                self.query_grid(scene_code)["density_act"],
+                resolution,
+                self.renderer.cfg.radius,
+                encoding,
+            )
+            for scene_code in scene_codes
+        ]
+
+    def extract_mesh(
+        self,
+        scene_codes,
+        has_vertex_color,
+        resolution: int = 256,
+        threshold: float = 25.0,
+        color_from_grid: bool = False,
+        grid_color_dtype: torch.dtype = torch.float16,
+        density_volumes: Optional[List[DensityVolume]] = None,
+        slab_size: int = 0,
+        num_workers: int = 0,
+        isosurface: str = "marching_cubes",
+        return_type: str = "trimesh",
+    ):
+        """
+        Extract one mesh per scene code with marching cubes, or with surface nets if `isosurface` is "surface_nets".
+        With `color_from_grid`, vertex colors are trilinearly interpolated from the color field computed along with
+        the density grid (stored as `grid_color_dtype`), instead of querying the decoder a second time at every vertex
+        position. If `density_volumes` are given, the
+        density grid is taken from them instead of being queried.
+
+        With `slab_size` > 0, the density grid is evaluated and polygonized in slabs of that many cells (across
+        `num_workers` processes if > 0), which bounds peak memory for high resolutions. Slabs are not compatible with
+        `color_from_grid` and `density_volumes`, nor with surface nets.
+
+        Meshes are returned as `trimesh.Trimesh`, or as `CompactMesh` if `return_type` is "compact", which skips
+        trimesh processing and keeps float32 vertices, int32 faces and uint8 colors.
+        """
+        assert slab_size == 0 or (
+            not color_from_grid and density_volumes is None
+        ), "slab-wise extraction does not support color_from_grid or density_volumes."
+        self.set_marching_cubes_resolution(
+            resolution, slab_size, num_workers, isosurface
+        )
         meshes = []
-        for scene_code in scene_codes:
-            with torch.no_grad():
-                density = self.renderer.query_triplane(
-                    self.decoder,
+        for i, scene_code in enumerate(scene_codes):
+            grid_color = None
+            if slab_size > 0:
+                v_pos, t_pos_idx = self.isosurface_helper.extract(
+                    lambda grid_vertices: -(
+                        self.query_grid(scene_code, grid_vertices)["density_act"]
+                        - threshold
+                    )
+                )
+                v_pos, t_pos_idx = v_pos.to(scene_codes.device), t_pos_idx.to(
+                    scene_codes.device
+                )
+            elif density_volumes is not None:
+                density = (
+                    density_volumes[i]
+                    .resample(resolution)
+                    .density()
+                    .view(-1, 1)
+                    .to(scene_codes.device)
+                )
+            else:
+                grid_out = self.query_grid(scene_code)
+                density = grid_out["density_act"]
+                if has_vertex_color and color_from_grid:
+                    grid_color = grid_out["color"].to(grid_color_dtype)
+                del grid_out
+            if slab_size == 0:
+                v_pos, t_pos_idx = self.isosurface_helper(-(density - threshold))
+            color = None
+            if grid_color is not None:
+                color = trilinear_interpolate(
+                    grid_color.view(resolution, resolution, resolution, -1),
                     scale_tensor(
-                        self.isosurface_helper.grid_vertices.to(scene_codes.device),
-                        self.isosurface_helper.points_range,
-                        (-self.renderer.cfg.radius, self.renderer.cfg.radius),
-                    ),
-                    scene_code,
-                )["density_act"]
-            v_pos, t_pos_idx = self.isosurface_helper(-(density - threshold))
+                        v_pos, self.isosurface_helper.points_range, (0, resolution - 1)
+                    ).to(grid_color.device),
+                )
+                del grid_color
             v_pos = scale_tensor(
                 v_pos,
                 self.isosurface_helper.points_range,
                 (-self.renderer.cfg.radius, self.renderer.cfg.radius),
             )
-            color = None
-            if has_vertex_color:
+            if has_vertex_color and color is None:
                 with torch.no_grad():
                     color = self.renderer.query_triplane(
                         self.decoder,
                         v_pos,
                         scene_code,
                     )["color"]
-            mesh = trimesh.Trimesh(
-                vertices=v_pos.cpu().numpy(),
-                faces=t_pos_idx.cpu().numpy(),
-                vertex_colors=color.cpu().numpy() if has_vertex_color else None,
+            meshes.append(
+                build_mesh(
+                    v_pos,
+                    t_pos_idx,
+                    color if has_vertex_color else None,
+                    return_type,
+                )
             )
-            meshes.append(mesh)
         return meshes
@@ -0,0 +1,245 @@
+import io
+import struct
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+DDS_MIME_TYPE = "image/vnd-ms.dds"
+
+# DDS_HEADER flags
+DDSD_CAPS = 0x1
+DDSD_HEIGHT = 0x2
+DDSD_WIDTH = 0x4
+DDSD_PIXELFORMAT = 0x1000
+DDSD_MIPMAPCOUNT = 0x20000
+DDSD_LINEARSIZE = 0x80000
+DDPF_FOURCC = 0x4
+DDSCAPS_COMPLEX = 0x8
+DDSCAPS_TEXTURE = 0x1000
+DDSCAPS_MIPMAP = 0x400000
+
+BLOCK_BYTES = {"bc1": 8, "bc3": 16}
+FOURCC = {"bc1": b"DXT1", "bc3": b"DXT5"}
+
+
+def build_mip_chain(image: np.ndarray) -> List[np.ndarray]:
+    """
+    Mip levels of an (H, W, C) uint8 image down to 1x1, each level averaging 2x2 texels of the previous one.
+    """
+    levels = [image]
+    level = image.astype(np.float32)
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        h, w = level.shape[:2]
+        # odd sizes repeat their last row / column
+        if h > 1 and h % 2 == 1:
+            level = np.concatenate([level, level[-1:]], axis=0)
+        if w > 1 and w % 2 == 1:
+            level = np.concatenate([level, level[:, -1:]], axis=1)
+        fh, fw = min(h, 2), min(w, 2)
+        level = level.reshape(
+            level.shape[0] // fh, fh, level.shape[1] // fw, fw, -1
+        ).mean(axis=(1, 3))
+        levels.append(np.round(level).astype(np.uint8))
+    return levels
+
+
+def _to_blocks(image: np.ndarray) -> np.ndarray:
+    # (H, W, C) -> (N, 16, C) 4x4 blocks in row-major order, edges padded by replication
+    h, w, c = image.shape
+    bh, bw = (h + 3) // 4, (w + 3) // 4
+    image = np.pad(image, ((0, bh * 4 - h), (0, bw * 4 - w), (0, 0)), mode="edge")
+    return (
+        image.reshape(bh, 4, bw, 4, c).transpose(0, 2, 1, 3, 4).reshape(-1, 16, c)
+    )
+
+
+def _pack_565(colors: np.ndarray) -> np.ndarray:
+    r = np.round(colors[:, 0] * 31.0 / 255.0).astype(np.uint16)
+    g = np.round(colors[:, 1] * 63.0 / 255.0).astype(np.uint16)
+    b = np.round(colors[:, 2] * 31.0 / 255.0).astype(np.uint16)
+    return (r << 11) | (g << 5) | b
+
+
+def _unpack_565(packed: np.ndarray) -> np.ndarray:
+    r = (packed >> 11) & 31
+    g = (packed >> 5) & 63
+    b = packed & 31
+    return np.stack(
+        [(r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)], axis=-1
+    ).astype(np.float32)
+
+
+def _encode_color_blocks(blocks: np.ndarray) -> np.ndarray:
+    """
+    BC1 color blocks in 4-color mode: endpoints at the extremes of the principal axis of every block, texels assigned
+    to the nearest of the 4 palette colors.
+    """
+    colors = blocks[..., :3].astype(np.float32)
+    mean = colors.mean(axis=1, keepdims=True)
+    centered = colors - mean
+    cov = np.einsum("nki,nkj->nij", centered, centered)
+    axis = np.ones((len(blocks), 3), dtype=np.float32)
+    for _ in range(8):
+        axis = np.einsum("nij,nj->ni", cov, axis)
+        axis /= np.maximum(np.linalg.norm(axis, axis=-1, keepdims=True), 1e-12)
+    proj = np.einsum("nki,ni->nk", centered, axis)
+    c0 = mean[:, 0] + axis * proj.max(axis=1, keepdims=True)
+    c1 = mean[:, 0] + axis * proj.min(axis=1, keepdims=True)
+    c0 = _pack_565(np.clip(c0, 0.0, 255.0))
+    c1 = _pack_565(np.clip(c1, 0.0, 255.0))
+    # c0 > c1 selects the 4-color mode, equal endpoints only ever use index 0
+    swap = c0 < c1
+    c0[swap], c1[swap] = c1[swap], c0[swap]
+
+    p0, p1 = _unpack_565(c0), _unpack_565(c1)
+    palette = np.stack(
+        [p0, p1, (2.0 * p0 + p1) / 3.0, (p0 + 2.0 * p1) / 3.0], axis=1
+    )
+    dist = ((colors[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(-1)
+    indices = dist.argmin(axis=-1).astype(np.uint32)
+    indices[c0 == c1] = 0
+
+    out = np.empty(len(blocks), dtype=[("c0", "<u2"), ("c1", "<u2"), ("idx", "<u4")])
+    out["c0"], out["c1"] = c0, c1
+    out["idx"] = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(
+        axis=1, dtype=np.uint32
+    )
+    return out.view(np.uint8).reshape(-1, 8)
+
+
+def _encode_alpha_blocks(blocks: np.ndarray) -> np.ndarray:
+    """
+    BC3 alpha blocks in 8-alpha mode: endpoints at the alpha range of every block, texels assigned to the nearest of
+    the 8 interpolated values.
+    """
+    alpha = blocks[..., 3].astype(np.float32)
+    a0 = alpha.max(axis=1)
+    a1 = alpha.min(axis=1)
+    weights = np.array([[7, 0], [0, 7], [6, 1], [5, 2], [4, 3], [3, 4], [2, 5], [1, 6]])
+    palette = (a0[:, None] * weights[:, 0] + a1[:, None] * weights[:, 1]) / 7.0
+    indices = np.abs(alpha[:, :, None] - palette[:, None, :]).argmin(axis=-1)
+    indices = indices.astype(np.uint64)
+    indices[a0 == a1] = 0
+    bits = (indices << (3 * np.arange(16, dtype=np.uint64))).sum(
+        axis=1, dtype=np.uint64
+    )
+    out = np.empty((len(blocks), 8), dtype=np.uint8)
+    out[:, 0] = a0
+    out[:, 1] = a1
+    out[:, 2:] = bits.astype("<u8").view(np.uint8).reshape(-1, 8)[:, :6]
+    return out
+
+
+def encode_bc(image: np.ndarray, fmt: str = "bc1") -> bytes:
+    """
+    Block compress an (H, W, 3 or 4) uint8 image with BC1 (RGB, 4 bpp) or BC3 (RGBA, 8 bpp).
+    """
+    assert fmt in BLOCK_BYTES
+    if image.shape[-1] == 3:
+        image = np.concatenate(
+            [image, np.full(image.shape[:2] + (1,), 255, dtype=np.uint8)], axis=-1
+        )
+    blocks = _to_blocks(image)
+    color = _encode_color_blocks(blocks)
+    if fmt == "bc1":
+        return color.tobytes()
+    return np.concatenate([_encode_alpha_blocks(blocks), color], axis=1).tobytes()
+
+
+def encode_dds(image: np.ndarray, fmt: str = "bc1", mipmaps: bool = True) -> bytes:
+    """
+    Encode an (H, W, C) uint8 image, rows top to bottom, as a block compressed DDS file with a full mip chain.
+    """
+    levels = build_mip_chain(image) if mipmaps else [image]
+    h, w = image.shape[:2]
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_LINEARSIZE
+    caps = DDSCAPS_TEXTURE
+    if len(levels) > 1:
+        flags |= DDSD_MIPMAPCOUNT
+        caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+    linear_size = ((w + 3) // 4) * ((h + 3) // 4) * BLOCK_BYTES[fmt]
+    pixel_format = struct.pack("<II4s5I", 32, DDPF_FOURCC, FOURCC[fmt], 0, 0, 0, 0, 0)
+    header = (
+        struct.pack("<7I", 124, flags, h, w, linear_size, 0, len(levels))
+        + b"\0" * 44
+        + pixel_format
+        + struct.pack("<5I", caps, 0, 0, 0, 0)
+    )
+    return b"".join([b"DDS ", header] + [encode_bc(level, fmt) for level in levels])
+
+
+def _decode_color_blocks(blocks: np.ndarray, three_color: bool) -> np.ndarray:
+    # (N, 8) BC1 blocks -> (N, 16, 4) RGBA texels, c0 <= c1 selects the 3-color + transparent black mode in BC1
+    c0 = blocks[:, 0:2].copy().view("<u2")[:, 0]
+    c1 = blocks[:, 2:4].copy().view("<u2")[:, 0]
+    indices = (blocks[:, 4:8].copy().view("<u4") >> (2 * np.arange(16, dtype=np.uint32))) & 3
+    p0, p1 = _unpack_565(c0), _unpack_565(c1)
+    palette = np.stack(
+        [p0, p1, (2.0 * p0 + p1) / 3.0, (p0 + 2.0 * p1) / 3.0], axis=1
+    )
+    palette = np.concatenate([palette, np.full(palette.shape[:2] + (1,), 255.0)], axis=-1)
+    if three_color:
+        low = c0 <= c1
+        palette[low, 2] = np.concatenate([(p0[low] + p1[low]) / 2.0, np.full((low.sum(), 1), 255.0)], axis=-1)
+        palette[low, 3] = 0.0
+    return np.round(np.take_along_axis(palette, indices[:, :, None].astype(np.int64), axis=1)).astype(np.uint8)
+
+
+def _decode_alpha_blocks(blocks: np.ndarray) -> np.ndarray:
+    # (N, 8) BC3 alpha blocks -> (N, 16) alpha, a0 <= a1 selects the 6-alpha + 0 / 255 mode
+    a0, a1 = blocks[:, 0].astype(np.float32), blocks[:, 1].astype(np.float32)
+    bits = np.concatenate([blocks[:, 2:], np.zeros((len(blocks), 2), dtype=np.uint8)], axis=1)
+    indices = (bits.copy().view("<u8") >> (3 * np.arange(16, dtype=np.uint64))) & np.uint64(7)
+    eight = np.array([[7, 0], [0, 7], [6, 1], [5, 2], [4, 3], [3, 4], [2, 5], [1, 6]]) / 7.0
+    six = np.array([[5, 0], [0, 5], [4, 1], [3, 2], [2, 3], [1, 4], [0, 0], [0, 0]]) / 5.0
+    palette = np.where(
+        (a0 > a1)[:, None],
+        a0[:, None] * eight[:, 0] + a1[:, None] * eight[:, 1],
+        a0[:, None] * six[:, 0] + a1[:, None] * six[:, 1],
+    )
+    palette[a0 <= a1, 7] = 255.0
+    return np.round(np.take_along_axis(palette, indices.astype(np.int64), axis=1)).astype(np.uint8)
+
+
+def decode_dds(data: bytes) -> np.ndarray:
+    """
+    Decode the top mip level of a BC1 or BC3 DDS file as written by `encode_dds` to an (H, W, 4) uint8 image, rows
+    top to bottom, e.g. for a PNG fallback of a DDS texture.
+    """
+    height, width = struct.unpack_from("<2I", data, 12)
+    fourcc = data[84:88]
+    fmt = {v: k for k, v in FOURCC.items()}[fourcc]
+    bh, bw = (height + 3) // 4, (width + 3) // 4
+    blocks = np.frombuffer(data, dtype=np.uint8, count=bh * bw * BLOCK_BYTES[fmt], offset=128)
+    blocks = blocks.reshape(bh * bw, BLOCK_BYTES[fmt])
+    if fmt == "bc1":
+        texels = _decode_color_blocks(blocks, three_color=True)
+    else:
+        texels = _decode_color_blocks(blocks[:, 8:], three_color=False)
+        texels[..., 3] = _decode_alpha_blocks(blocks[:, :8])
+    image = texels.reshape(bh, bw, 4, 4, 4).transpose(0, 2, 1, 3, 4).reshape(bh * 4, bw * 4, 4)
+    return image[:height, :width]
+
+
+def save_dds(
+    path: str, image: np.ndarray, fmt: str = "bc1", mipmaps: bool = True
+) -> None:
+    with open(path, "wb") as f:
+        f.write(encode_dds(image, fmt, mipmaps))
+
+
+def save_texture(path: str, image: np.ndarray, texture_format: str = "png") -> bytes:
+    """
+    Save a baked (H, W, C) uint8 texture, rows bottom to top as baked, as a PNG or block compressed DDS file
+    (`texture_format` "dds-bc1" or "dds-bc3"). Returns the file content, e.g. to embed it in a GLB.
+    """
+    if texture_format == "png":
+        buffer = io.BytesIO()
+        Image.fromarray(image[::-1]).save(buffer, format="PNG")
+        data = buffer.getvalue()
+    else:
+        data = encode_dds(image[::-1], texture_format[len("dds-"):])
+    with open(path, "wb") as f:
+        f.write(data)
+    return data
@@ -233,6 +233,33 @@ def scale_tensor(dat: torch.FloatTensor, inp_scale: ValidScale, tgt_scale: Valid
     return dat
 
 
+def trilinear_interpolate(
+    volume: torch.Tensor, points: torch.FloatTensor
+) -> torch.FloatTensor:
+    """
+    Trilinearly interpolate a (X, Y, Z, C) volume of any dtype at (N, 3) points given in voxel index coordinates.
+    Returns (N, C) float32 values; points outside the volume are clamped to its border.
+    """
+    size = torch.as_tensor(volume.shape[:3], device=points.device)
+    points = torch.minimum(points.clamp_min(0.0), (size - 1).to(points.dtype))
+    lower = torch.minimum(points.floor().long(), (size - 2).clamp_min(0))
+    frac = points - lower
+    out = torch.zeros(
+        points.shape[0], volume.shape[-1], dtype=torch.float32, device=points.device
+    )
+    for dx in (0, 1):
+        wx = frac[:, 0] if dx else 1 - frac[:, 0]
+        for dy in (0, 1):
+            wy = frac[:, 1] if dy else 1 - frac[:, 1]
+            for dz in (0, 1):
+                wz = frac[:, 2] if dz else 1 - frac[:, 2]
+                corner = volume[
+                    lower[:, 0] + dx, lower[:, 1] + dy, lower[:, 2] + dz
+                ].float()
+                out += (wx * wy * wz)[:, None] * corner
+    return out
+
+
 def get_activation(name) -> Callable:
     if name is None:
         return lambda x: x
@@ -0,0 +1,203 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+# number of candidate pixels evaluated at once per band
+PIXEL_CHUNK_SIZE = 1 << 21
+
+
+def dilation_triangles(tri_px: np.ndarray, tri_attr: np.ndarray, dilation: float):
+    """
+    Reproduce the edge dilation geometry shader of `tsr.bake_texture`: every edge of a triangle is widened into a quad
+    of half-width `dilation` / 2 pixels, attributes being interpolated along the edge only, and the three quads are
+    emitted as a single 12 vertex triangle strip (which also fills the joins at the corners).
+    """
+    edges = [(0, 1), (1, 2), (2, 0)]
+    strip_px, strip_attr = [], []
+    for a, b in edges:
+        pa, pb = tri_px[:, a], tri_px[:, b]
+        direction = pb - pa
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # degenerate edges give nan positions, dropped like in GL
+            direction = direction / np.linalg.norm(direction, axis=-1, keepdims=True)
+        offset = np.stack([-direction[:, 1], direction[:, 0]], axis=-1) * (
+            dilation / 2.0
+        )
+        strip_px += [pa + offset, pa - offset, pb + offset, pb - offset]
+        strip_attr += [tri_attr[:, a]] * 2 + [tri_attr[:, b]] * 2
+    strip_px = np.stack(strip_px, axis=1)
+    strip_attr = np.stack(strip_attr, axis=1)
+    # triangle k of the strip is made of vertices k, k + 1, k + 2
+    strip_idx = np.arange(10)[:, None] + np.arange(3)[None, :]
+    return (
+        strip_px[:, strip_idx].reshape(-1, 3, 2),
+        strip_attr[:, strip_idx].reshape(-1, 3, tri_attr.shape[-1]),
+    )
+
+
+def _rasterize_band(
+    out: np.ndarray,
+    tri_px: np.ndarray,
+    tri_attr: np.ndarray,
+    tri_ids: np.ndarray,
+    row_start: int,
+    row_stop: int,
+) -> None:
+    resolution = out.shape[1]
+    tri_px = tri_px[tri_ids]
+    tri_attr = tri_attr[tri_ids]
+
+    # bounding boxes of the covered pixel centers, clipped to the band
+    lo = np.ceil(tri_px.min(axis=1) - 0.5).astype(np.int64)
+    hi = np.floor(tri_px.max(axis=1) - 0.5).astype(np.int64)
+    x0 = np.maximum(lo[:, 0], 0)
+    x1 = np.minimum(hi[:, 0], resolution - 1)
+    y0 = np.maximum(lo[:, 1], row_start)
+    y1 = np.minimum(hi[:, 1], row_stop - 1)
+    width = np.maximum(x1 - x0 + 1, 0)
+    n_pixels = width * np.maximum(y1 - y0 + 1, 0)
+
+    # barycentric coordinates as affine functions of the pixel center, i.e. edge functions normalized by the signed
+    # area of the triangle, so that both windings are accepted
+    p0, p1, p2 = tri_px[:, 0], tri_px[:, 1], tri_px[:, 2]
+    area = (p1[:, 0] - p0[:, 0]) * (p2[:, 1] - p0[:, 1]) - (p1[:, 1] - p0[:, 1]) * (
+        p2[:, 0] - p0[:, 0]
+    )
+    n_pixels[area == 0] = 0
+    with np.errstate(divide="ignore"):
+        inv_area = 1.0 / area
+    # evaluated relative to the first pixel center of the bounding box, so that float32 is accurate enough
+    origin = np.stack([x0 + 0.5, y0 + 0.5], axis=-1)
+    coefs = []
+    for a, b in [(p1, p2), (p2, p0)]:
+        coefs += [
+            (a[:, 1] - b[:, 1]) * inv_area,
+            (b[:, 0] - a[:, 0]) * inv_area,
+            (
+                (b[:, 0] - a[:, 0]) * (origin[:, 1] - a[:, 1])
+                - (b[:, 1] - a[:, 1]) * (origin[:, 0] - a[:, 0])
+            )
+            * inv_area,
+        ]
+    coefs = np.stack(coefs, axis=-1).astype(np.float32)
+
+    # split the triangles, in drawing order, into chunks with a bounded number of candidate pixels
+    cum_pixels = np.cumsum(n_pixels)
+    bounds = np.searchsorted(
+        cum_pixels, np.arange(PIXEL_CHUNK_SIZE, cum_pixels[-1], PIXEL_CHUNK_SIZE)
+    )
+    for chunk in np.split(np.arange(len(tri_ids)), np.unique(bounds + 1)):
+        chunk = chunk[n_pixels[chunk] > 0]
+        if len(chunk) == 0:
+            continue
+        counts = n_pixels[chunk]
+        local = np.arange(counts.sum(), dtype=np.int32) - np.repeat(
+            (np.cumsum(counts) - counts).astype(np.int32), counts
+        )
+        chunk_width = np.repeat(width[chunk].astype(np.int32), counts)
+        dy = local // chunk_width
+        dx = local - dy * chunk_width
+        coef = np.repeat(coefs[chunk], counts, axis=0)
+        dx, dy = dx.astype(np.float32), dy.astype(np.float32)
+        w0 = coef[:, 0] * dx + coef[:, 1] * dy + coef[:, 2]
+        w1 = coef[:, 3] * dx + coef[:, 4] * dy + coef[:, 5]
+        w2 = 1.0 - w0 - w1
+        inside = np.nonzero((w0 >= 0) & (w1 >= 0) & (w2 >= 0))[0]
+        tri = np.repeat(chunk, counts)[inside]
+        px = x0[tri] + dx[inside].astype(np.int64)
+        py = y0[tri] + dy[inside].astype(np.int64)
+        attr = tri_attr[tri]
+        values = (
+            w0[inside, None] * attr[:, 0]
+            + w1[inside, None] * attr[:, 1]
+            + w2[inside, None] * attr[:, 2]
+        )
+        # later triangles overwrite earlier ones, as in GL without depth test
+        out[py, px, :-1] = values
+        out[py, px, -1] = 1.0
+
+
+def rasterize_triangles(
+    out: np.ndarray,
+    tri_px: np.ndarray,
+    tri_attr: np.ndarray,
+    band_rows: int = 64,
+    num_workers: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Rasterize triangles given in pixel coordinates (T, 3, 2) with per-vertex attributes (T, 3, C) into `out`
+    (R, R, C + 1), in order, setting the last channel to 1 at covered pixel centers. Triangles are binned into bands of
+    `band_rows` rows that are rasterized in parallel by `num_workers` threads (all cores if None).
+    """
+    resolution = out.shape[0]
+    valid = np.isfinite(tri_px).all(axis=(1, 2))
+    tri_ids = np.nonzero(valid)[0]
+    if len(tri_ids) == 0:
+        return out
+    rows = tri_px[tri_ids, :, 1]
+    first_band = np.clip(np.ceil(rows.min(axis=1) - 0.5), 0, resolution - 1).astype(
+        np.int64
+    ) // band_rows
+    last_band = np.clip(np.floor(rows.max(axis=1) - 0.5), 0, resolution - 1).astype(
+        np.int64
+    ) // band_rows
+    counts = np.maximum(last_band - first_band + 1, 0)
+    binned_tri = np.repeat(tri_ids, counts)
+    binned_band = np.repeat(first_band, counts) + (
+        np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    )
+    # stable sort keeps the drawing order within every band
+    order = np.argsort(binned_band, kind="stable")
+    binned_tri, binned_band = binned_tri[order], binned_band[order]
+    bands, starts = np.unique(binned_band, return_index=True)
+    band_tris = np.split(binned_tri, starts[1:])
+
+    def work(band, tris):
+        _rasterize_band(
+            out,
+            tri_px,
+            tri_attr,
+            tris,
+            band * band_rows,
+            min((band + 1) * band_rows, resolution),
+        )
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if num_workers <= 1:
+        for band, tris in zip(bands, band_tris):
+            work(band, tris)
+    else:
+        # bands cover disjoint rows, and numpy releases the GIL in the heavy parts
+        with ThreadPoolExecutor(num_workers) as executor:
+            list(executor.map(work, bands, band_tris))
+    return out
+
+
+def rasterize_position_atlas_cpu(
+    mesh,
+    atlas_vmapping,
+    atlas_indices,
+    atlas_uvs,
+    texture_resolution,
+    texture_padding,
+    num_workers: Optional[int] = None,
+):
+    """
+    CPU equivalent of `tsr.bake_texture.rasterize_position_atlas`, returning the same (R, R, 4) float32 texture of
+    positions and coverage, rows ordered bottom-up like the GL framebuffer.
+    """
+    tri_px = (
+        atlas_uvs.astype(np.float64)[atlas_indices.astype(np.int64)] * texture_resolution
+    )
+    tri_attr = mesh.vertices[atlas_vmapping].astype(np.float32)[
+        atlas_indices.astype(np.int64)
+    ]
+    out = np.zeros((texture_resolution, texture_resolution, 4), dtype=np.float32)
+    # dilated edges first, the triangles themselves are drawn over them
+    dilation_px, dilation_attr = dilation_triangles(tri_px, tri_attr, texture_padding)
+    rasterize_triangles(out, dilation_px, dilation_attr, num_workers=num_workers)
+    rasterize_triangles(out, tri_px, tri_attr, num_workers=num_workers)
+    return out
@@ -0,0 +1,163 @@
+import json
+import os
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import trimesh
+
+from .mesh import CompactMesh, build_mesh
+from .models.isosurface import MarchingCubeHelper
+from .utils import scale_tensor
+
+FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+
+class DensityVolume:
+    """
+    Density grid of a scene code, sampled on the marching cubes grid and stored either as float16 or as uint8
+    quantized in log space, or at full float32 precision. Saved volumes are memory-mapped on load, so re-running
+    marching cubes at another threshold or at a lower resolution never touches the decoder again.
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        radius: float,
+        encoding: str = "float16",
+        scale: float = 1.0,
+        offset: float = 0.0,
+    ) -> None:
+        assert encoding in ["float32", "float16", "uint8"]
+        assert data.ndim == 3 and data.shape[0] == data.shape[1] == data.shape[2]
+        self.data = data
+        self.radius = radius
+        self.encoding = encoding
+        self.scale = scale
+        self.offset = offset
+
+    @property
+    def resolution(self) -> int:
+        return self.data.shape[0]
+
+    @classmethod
+    def from_density(
+        cls,
+        density: torch.FloatTensor,
+        resolution: int,
+        radius: float,
+        encoding: str = "float16",
+    ) -> "DensityVolume":
+        density = density.detach().float().view(resolution, resolution, resolution)
+        if encoding == "float32":
+            return cls(density.cpu().numpy(), radius, encoding)
+        elif encoding == "float16":
+            data = density.clamp(0.0, FLOAT16_MAX).half().cpu().numpy()
+            return cls(data, radius, encoding)
+        elif encoding == "uint8":
+            # densities are exp-activated and span several orders of magnitude,
+            # quantize in log space to keep precision around the usual thresholds
+            log_density = torch.log1p(density.clamp_min(0.0))
+            offset = log_density.min().item()
+            scale = max(log_density.max().item() - offset, 1e-6) / 255.0
+            data = (
+                ((log_density - offset) / scale).round().clamp(0, 255).to(torch.uint8)
+            )
+            return cls(data.cpu().numpy(), radius, encoding, scale, offset)
+        else:
+            raise NotImplementedError
+
+    def density(self) -> torch.FloatTensor:
+        data = torch.from_numpy(np.array(self.data))
+        if self.encoding in ["float32", "float16"]:
+            return data.float()
+        return torch.expm1(data.float() * self.scale + self.offset)
+
+    def encode(self, encoding: str) -> "DensityVolume":
+        """
+        The volume stored with another encoding.
+        """
+        if encoding == self.encoding:
+            return self
+        return DensityVolume.from_density(
+            self.density(), self.resolution, self.radius, encoding
+        )
+
+    def save(self, path: str, encoding: Optional[str] = None) -> None:
+        """
+        Save the volume to `path` (a .npy file) along with a .json file holding its metadata, re-encoded first if
+        `encoding` is given, e.g. to keep a full precision volume in memory and write it quantized.
+        """
+        if encoding is not None and encoding != self.encoding:
+            self.encode(encoding).save(path)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        out = np.lib.format.open_memmap(
+            path, mode="w+", dtype=self.data.dtype, shape=self.data.shape
+        )
+        out[:] = self.data
+        out.flush()
+        del out
+        with open(os.path.splitext(path)[0] + ".json", "w") as f:
+            json.dump(
+                {
+                    "resolution": self.resolution,
+                    "radius": self.radius,
+                    "encoding": self.encoding,
+                    "scale": self.scale,
+                    "offset": self.offset,
+                },
+                f,
+                indent=2,
+            )
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "DensityVolume":
+        with open(os.path.splitext(path)[0] + ".json") as f:
+            meta = json.load(f)
+        data = np.load(path, mmap_mode="r" if mmap else None)
+        return cls(data, meta["radius"], meta["encoding"], meta["scale"], meta["offset"])
+
+    def resample(self, resolution: int) -> "DensityVolume":
+        """
+        Trilinearly resample the volume to another grid resolution, e.g. to derive a lower level of detail.
+        """
+        if resolution == self.resolution:
+            return self
+        density = F.interpolate(
+            self.density()[None, None],
+            size=(resolution, resolution, resolution),
+            mode="trilinear",
+            align_corners=True,
+        )[0, 0]
+        return DensityVolume.from_density(
+            density, resolution, self.radius, self.encoding
+        )
+
+    def extract_mesh(
+        self,
+        threshold: float = 25.0,
+        isosurface_helper: Optional[MarchingCubeHelper] = None,
+        return_type: str = "trimesh",
+    ) -> Union[trimesh.Trimesh, CompactMesh]:
+        if isosurface_helper is None or isosurface_helper.resolution != self.resolution:
+            isosurface_helper = MarchingCubeHelper(self.resolution)
+        v_pos, t_pos_idx = isosurface_helper(-(self.density().view(-1) - threshold))
+        v_pos = scale_tensor(
+            v_pos,
+            isosurface_helper.points_range,
+            (-self.radius, self.radius),
+        )
+        return build_mesh(v_pos, t_pos_idx, return_type=return_type)
+
+    def extract_lod_meshes(
+        self,
+        resolutions: Sequence[int],
+        threshold: float = 25.0,
+        return_type: str = "trimesh",
+    ) -> List[Union[trimesh.Trimesh, CompactMesh]]:
+        return [
+            self.resample(resolution).extract_mesh(threshold, return_type=return_type)
+            for resolution in resolutions
+        ]
@@ -0,0 +1,126 @@
+"""
+Directory-scale batch runner for the mesh post-processing and validation scripts.
+Meshes are processed across a process pool, results are streamed to a JSON lines file,
+and meshes whose content (and task options) did not change since the last run are skipped.
+"""
+
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+def find_files(root: str, extensions: Sequence[str], exclude: Sequence[str] = ()) -> List[str]:
+    """
+    All files under root with one of the given extensions, skipping paths containing any of the exclude substrings.
+    """
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if filename.lower().endswith(tuple(extensions)) and not any(e in path for e in exclude):
+                paths.append(path)
+    return sorted(paths)
+
+
+def file_digest(path: str, options: Optional[dict] = None, dependencies: Sequence[str] = (), chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-1 of the file content, streamed in chunks, of the task options and of the other files the task reads, so that
+    changing any of them re-runs the task. Missing dependencies are hashed as such, adding one also re-runs the task.
+    """
+    h = hashlib.sha1()
+    for file_path in [path] + list(dependencies):
+        h.update(file_path.encode("utf-8"))
+        if not os.path.exists(file_path):
+            h.update(b"\0missing")
+            continue
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+    h.update(json.dumps(options or {}, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_digests(results_path: str) -> Dict[str, str]:
+    """
+    Digest of the last successful result of every path in a results file (later lines win).
+    """
+    digests = {}
+    if not os.path.exists(results_path):
+        return digests
+    with open(results_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a run interrupted mid-write leaves a truncated last line
+                continue
+            if record.get("status") == "ok":
+                digests[record["path"]] = record["digest"]
+            else:
+                digests.pop(record.get("path"), None)
+    return digests
+
+
+def _run_task(task: Callable, path: str, digest: str, options: dict) -> dict:
+    # runs in a worker process, failures are reported instead of raised so that one bad mesh does not stop the batch
+    start = time.time()
+    record = {"path": path, "digest": digest}
+    try:
+        record["result"] = task(path, **options)
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+        record["traceback"] = traceback.format_exc()
+    record["seconds"] = round(time.time() - start, 3)
+    return record
+
+
+def run_batch(task: Callable, paths: Sequence[str], results_path: str, options: Optional[dict] = None,
+              workers: Optional[int] = None, max_tasks_per_child: int = 16, force: bool = False,
+              dependencies: Optional[Callable[[str], List[str]]] = None) -> Dict[str, int]:
+    """
+    Run task(path, **options) on every path across a process pool and append one JSON line per result to results_path.
+    task must be a module-level function returning a JSON-serializable value.
+    At most 2 tasks per worker are in flight, and workers are recycled after max_tasks_per_child tasks, which bounds
+    memory; paths whose digest matches their last successful result are skipped unless force is set.
+    dependencies maps a path to the other files its task reads (e.g. a texture next to the mesh), which are part of
+    its digest.
+    Returns the number of processed, skipped and failed paths.
+    """
+    options = options or {}
+    workers = workers or os.cpu_count() or 1
+    done = {} if force else load_digests(results_path)
+    summary = {"processed": 0, "skipped": 0, "failed": 0}
+
+    os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+    with open(results_path, "a") as out, ProcessPoolExecutor(workers, max_tasks_per_child=max_tasks_per_child) as pool:
+        pending = set()
+
+        def drain(return_when):
+            nonlocal pending
+            finished, pending = wait(pending, return_when=return_when)
+            for future in finished:
+                record = future.result()
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                summary["processed" if record["status"] == "ok" else "failed"] += 1
+                print(f"[{record['status']}] {record['path']} ({record['seconds']}s)")
+
+        for path in paths:
+            digest = file_digest(path, options, dependencies(path) if dependencies is not None else ())
+            if done.get(path) == digest:
+                summary["skipped"] += 1
+                continue
+            if len(pending) >= 2 * workers:
+                drain(FIRST_COMPLETED)
+            pending.add(pool.submit(_run_task, task, path, digest, options))
+        if pending:
+            drain(ALL_COMPLETED)
+
+    print(f"Batch done: {summary['processed']} processed, {summary['skipped']} unchanged, {summary['failed']} failed.")
+    return summary
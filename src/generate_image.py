@@ -6,7 +6,7 @@ from typing import Optional
 from diffusers import StableDiffusionPipeline
 import torch
 
-def generate_image(prompt: str, seed: Optional[int], steps: int, guidance: float, width: int , height: int, output_path: str) -> str:
+def generate_image(prompt: str, seed: Optional[int], steps: int, guidance: float, width: int , height: int, output_path: str, writer=None) -> str:
     """
     Placeholder for text-to-image generation.
     """
@@ -22,11 +22,18 @@ def generate_image(prompt: str, seed: Optional[int], steps: int, guidance: float
     
     import os
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    image.save(output_path)
+    if writer is not None:
+        # encoded and written in the background (tsr.async_writer.AsyncWriter)
+        writer.submit(output_path, image.save)
+    else:
+        image.save(output_path)
     return output_path
 
 if __name__ == "__main__":
     import datetime
+    import os
+    import time
+    from run_index import RunIndex
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     output_filename = f"outputs/images/img_{timestamp}.png"
     
@@ -35,6 +42,9 @@ if __name__ == "__main__":
     width=576
     height=576
     print(f"Generating image to {output_filename}...")
+    start = time.time()
     generate_image(prompt, seed, 26, 7.5, width, height, output_filename)
+    with RunIndex() as run_index:
+        run_index.record(os.path.splitext(os.path.basename(output_filename))[0], "generate_image", "image", output_filename, {"prompt": prompt, "seed": seed, "steps": 26, "guidance": 7.5, "width": width, "height": height}, time.time() - start)
     print(f"Done. Image saved to {output_filename}")
     output_filename = f"outputs/images/img_{timestamp}_({seed}).png"
\ No newline at end of file
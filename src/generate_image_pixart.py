@@ -8,7 +8,7 @@ from diffusers import DiffusionPipeline
 import os
 from typing import Optional
 
-def generate_image_pixart(prompt: str, seed: Optional[int], steps: int, guidance: float, width: int, height: int, output_path: str) -> str:
+def generate_image_pixart(prompt: str, seed: Optional[int], steps: int, guidance: float, width: int, height: int, output_path: str, writer=None) -> str:
     """
     Generate an image using PixArt-XL.
     """
@@ -33,11 +33,17 @@ def generate_image_pixart(prompt: str, seed: Optional[int], steps: int, guidance
     image = pipe(prompt, num_inference_steps=steps, guidance_scale=guidance, width=width, height=height, generator=generator).images[0]
     
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    image.save(output_path)
+    if writer is not None:
+        # encoded and written in the background (tsr.async_writer.AsyncWriter)
+        writer.submit(output_path, image.save)
+    else:
+        image.save(output_path)
     return output_path
 
 if __name__ == "__main__":
     import datetime
+    import time
+    from run_index import RunIndex
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     output_filename = f"outputs/images/img_{timestamp}_pixart.png"
     
@@ -46,5 +52,8 @@ Isolated object, no background, no shadows, no ground, centered, evenly lit, ort
 Game art style, crisp details, simple textures, consistent proportions, no environment, no reflections, no particles, no blur."""
 
     print(f"Generating image to {output_filename}...")
+    start = time.time()
     generate_image_pixart(prompt, 42, output_filename)
+    with RunIndex() as run_index:
+        run_index.record(os.path.splitext(os.path.basename(output_filename))[0], "generate_image_pixart", "image", output_filename, {"prompt": prompt, "seed": 42}, time.time() - start)
     print(f"Done. Image saved to {output_filename}")
@@ -9,7 +9,7 @@ from diffusers import StableDiffusionPipeline
 import torch
 import os
 
-def generate_image_turbo(prompt: str, seed: Optional[int], steps: int, guidance: float, width: int, height: int, output_path: str) -> str:
+def generate_image_turbo(prompt: str, seed: Optional[int], steps: int, guidance: float, width: int, height: int, output_path: str, writer=None) -> str:
     """
     Generate an image using SD-Turbo.
     """
@@ -40,11 +40,17 @@ def generate_image_turbo(prompt: str, seed: Optional[int], steps: int, guidance:
     ).images[0]
     
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    image.save(output_path)
+    if writer is not None:
+        # encoded and written in the background (tsr.async_writer.AsyncWriter)
+        writer.submit(output_path, image.save)
+    else:
+        image.save(output_path)
     return output_path
 
 if __name__ == "__main__":
     import datetime
+    import time
+    from run_index import RunIndex
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     output_filename = f"outputs/images/img_{timestamp}_turbo.png"
     
@@ -53,5 +59,8 @@ if __name__ == "__main__":
     
     print(f"Generating image to {output_filename}...")
     # SD-Turbo defaults: 1 step, 0.0 guidance
+    start = time.time()
     generate_image_turbo(prompt, seed=42, steps=50, guidance=7.5, output_path=output_filename)
+    with RunIndex() as run_index:
+        run_index.record(os.path.splitext(os.path.basename(output_filename))[0], "generate_image_turbo", "image", output_filename, {"prompt": prompt, "seed": 42, "steps": 50, "guidance": 7.5}, time.time() - start)
     print(f"Done. Image saved to {output_filename}")
@@ -5,18 +5,96 @@ Stub for converting generated images to 3D meshes using TripoSR (or similar).
 import os
 import subprocess
 import sys
+from typing import Optional, Tuple
 
+import numpy as np
+import trimesh
+from PIL import Image
 
-def image_to_mesh(image_path: str, output_obj: str, output_tex: str, mc_resolution: int = 256) -> str:
+# TripoSR is imported in-process by image_to_trimesh
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(project_root, "q9_triposr"))
+
+# shared by the in-process and the subprocess paths, so that both produce the same mesh
+DEFAULT_FOREGROUND_RATIO = 0.9  # ensure the object fills the volume
+DEFAULT_TEXTURE_RESOLUTION = 4096  # high res textures
+
+# loaded TripoSR models and rembg sessions, kept across calls
+_triposr_models = {}
+_rembg_sessions = []
+
+
+def _load_triposr(device: str):
+    if device not in _triposr_models:
+        from tsr.system import TSR
+
+        model = TSR.from_pretrained("stabilityai/TripoSR", config_name="config.yaml", weight_name="model.ckpt")
+        model.renderer.set_chunk_size(8192)
+        model.to(device)
+        _triposr_models[device] = model
+    return _triposr_models[device]
+
+
+def _preprocess_image(image_path: str, foreground_ratio: float) -> Image.Image:
+    # same preprocessing as q9_triposr/run.py
+    import rembg
+    from tsr.utils import remove_background, resize_foreground
+
+    if not _rembg_sessions:
+        _rembg_sessions.append(rembg.new_session())
+    image = remove_background(Image.open(image_path), _rembg_sessions[0])
+    image = resize_foreground(image, foreground_ratio)
+    image = np.array(image).astype(np.float32) / 255.0
+    image = image[:, :, :3] * image[:, :, 3:4] + (1 - image[:, :, 3:4]) * 0.5
+    return Image.fromarray((image * 255.0).astype(np.uint8))
+
+
+def image_to_trimesh(image_path: str, mc_resolution: int = 256, output_tex: bool = True, texture_resolution: int = DEFAULT_TEXTURE_RESOLUTION, foreground_ratio: float = DEFAULT_FOREGROUND_RATIO, device: Optional[str] = None, floater_face_ratio: float = 0.0) -> Tuple[trimesh.Trimesh, Optional[np.ndarray]]:
+    """
+    Convert image to 3D mesh using TripoSR in this process, without writing any file.
+    Returns the mesh, and with output_tex the baked RGBA texture (rows top to bottom), which the mesh material
+    also holds. Without output_tex, the mesh has vertex colors.
+    If floater_face_ratio > 0, components with fewer faces than this fraction of the largest one are dropped
+    before baking.
+    """
+    import torch
+    from tsr.bake_texture import bake_texture
+    from tsr.cleanup import remove_floaters_mesh
+
+    if device is None:
+        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    model = _load_triposr(device)
+    image = _preprocess_image(image_path, foreground_ratio)
+    with torch.no_grad():
+        scene_codes = model([image], device=device)
+    mesh = model.extract_mesh(scene_codes, not output_tex, resolution=mc_resolution)[0]
+    if floater_face_ratio > 0:
+        mesh, stats = remove_floaters_mesh(mesh, floater_face_ratio)
+        print(f"Removed {stats['removed_components']} floating components ({stats['removed_faces']} faces)")
+    if not output_tex:
+        return mesh, None
+
+    bake_output = bake_texture(mesh, model, scene_codes[0], texture_resolution, sparse=True)
+    vmapping = bake_output["vmapping"]
+    texture = np.ascontiguousarray(bake_output["colors"][::-1])
+    textured = trimesh.Trimesh(
+        vertices=mesh.vertices[vmapping],
+        faces=bake_output["indices"],
+        vertex_normals=mesh.vertex_normals[vmapping],
+        visual=trimesh.visual.TextureVisuals(uv=bake_output["uvs"], image=Image.fromarray(texture)),
+    )
+    return textured, texture
+
+
+def image_to_mesh(image_path: str, output_obj: str, output_tex: str, mc_resolution: int = 256, texture_format: str = "png", texture_resolution: int = DEFAULT_TEXTURE_RESOLUTION, foreground_ratio: float = DEFAULT_FOREGROUND_RATIO) -> str:
     """
     Convert image to 3D mesh using TripoSR.
+    texture_format is "png", or "dds-bc1" / "dds-bc3" for block compressed textures with mipmaps.
     """
     output_dir = os.path.dirname(output_obj)
     os.makedirs(output_dir, exist_ok=True)
     
     # Calculate absolute path to q9_triposr/run.py
-    # This file is in src/, so we go up one level to get to root
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     triposr_script = os.path.join(project_root, "q9_triposr", "run.py")
 
     # Run TripoSR: python run.py image.png --output-dir output/
@@ -25,11 +103,12 @@ def image_to_mesh(image_path: str, output_obj: str, output_tex: str, mc_resoluti
         image_path, 
         "--output-dir", output_dir,
         "--mc-resolution", str(mc_resolution),      # Higher resolution for smoother mesh
-        "--foreground-ratio", "0.9"    # Ensure object fills the volume
+        "--foreground-ratio", str(foreground_ratio)
     ]
     if output_tex:
         cmd.append("--bake-texture")
-        cmd.extend(["--texture-resolution", "4096"]) # High res textures
+        cmd.extend(["--texture-resolution", str(texture_resolution)])
+        cmd.extend(["--texture-format", texture_format])
     
     subprocess.run(cmd, check=True)
     
@@ -40,21 +119,28 @@ def image_to_mesh(image_path: str, output_obj: str, output_tex: str, mc_resoluti
 if __name__ == "__main__":
     import glob
     import argparse
+    import time
+    from run_index import DEFAULT_INDEX_PATH, RunIndex
     
     parser = argparse.ArgumentParser()
     parser.add_argument("--image", type=str, help="")
     parser.add_argument("--mc-resolution", type=int, default=256, help="Marching cubes resolution")
+    parser.add_argument("--texture-format", type=str, default="png", choices=["png", "dds-bc1", "dds-bc3"], help="Baked texture format, DDS formats are block compressed with mipmaps (default: png)")
+    parser.add_argument("--run-index", type=str, default=DEFAULT_INDEX_PATH, help=f"Run index database (default: {DEFAULT_INDEX_PATH})")
     args = parser.parse_args()
 
+    run_index = RunIndex(args.run_index)
     image_path = args.image
     
     if not image_path:
-        # Find the most recent image in outputs/images
-        list_of_files = glob.glob('outputs/images/*.png') 
-        if not list_of_files:
-            print("No images found in outputs/images/")
-            sys.exit(1)
-        image_path = max(list_of_files, key=os.path.getctime)
+        # Find the most recent image, in the run index or (outputs from before the index) in outputs/images
+        image_path = run_index.latest(["image"])
+        if not image_path:
+            list_of_files = glob.glob('outputs/images/*.png') 
+            if not list_of_files:
+                print("No images found in outputs/images/")
+                sys.exit(1)
+            image_path = max(list_of_files, key=os.path.getctime)
         print(f"No image provided. Using latest: {image_path}")
 
     # Create a unique output folder based on the image filename
@@ -65,6 +151,15 @@ if __name__ == "__main__":
     output_obj = os.path.join(output_dir, "mesh.obj")
     
     print(f"Processing {image_path} -> {output_dir} with resolution {args.mc_resolution}")
-    image_to_mesh(image_path, output_obj, True, mc_resolution=args.mc_resolution)
+    start = time.time()
+    mesh_path = image_to_mesh(image_path, output_obj, True, mc_resolution=args.mc_resolution, texture_format=args.texture_format)
+    run_id = run_index.run_id_of(image_path) or base_name
+    mesh_params = {"image": image_path, "mc_resolution": args.mc_resolution, "texture_format": args.texture_format}
+    run_index.record(run_id, "image2mesh", "raw_mesh", mesh_path, mesh_params, time.time() - start)
+    # TripoSR names the texture after its format, and writes none without baking
+    texture_path = os.path.join(os.path.dirname(mesh_path), "texture.png" if args.texture_format == "png" else "texture.dds")
+    if os.path.isfile(texture_path):
+        run_index.record(run_id, "image2mesh", "texture", texture_path, mesh_params)
+    run_index.close()
 
 
@@ -52,6 +52,7 @@ def image_to_shape_mesh(image_path, output_dir):
         output_type="mesh"
     ).images
     
+    obj_paths = []
     for i, mesh_result in enumerate(mesh_results):
         # Save OBJ using trimesh
         obj_path = os.path.join(output_dir, f"mesh_{i}.obj")
@@ -62,28 +63,42 @@ def image_to_shape_mesh(image_path, output_dir):
         tm_mesh = trimesh.Trimesh(vertices=verts, faces=faces)
         tm_mesh.export(obj_path)
         print(f"Saved OBJ to {obj_path}")
+        obj_paths.append(obj_path)
+    return obj_paths
 
 if __name__ == "__main__":
     import argparse
     import glob
+    import time
+    from run_index import DEFAULT_INDEX_PATH, RunIndex
     
     parser = argparse.ArgumentParser()
     parser.add_argument("--image", type=str, help="Path to input image")
+    parser.add_argument("--run-index", type=str, default=DEFAULT_INDEX_PATH, help=f"Run index database (default: {DEFAULT_INDEX_PATH})")
     args = parser.parse_args()
 
+    run_index = RunIndex(args.run_index)
     image_path = args.image
     
     if not image_path:
-        # Find the most recent image in outputs/images
-        list_of_files = glob.glob('outputs/images/*.png') 
-        if not list_of_files:
-            print("No images found in outputs/images/")
-            sys.exit(1)
-        image_path = max(list_of_files, key=os.path.getctime)
+        # Find the most recent image, in the run index or (outputs from before the index) in outputs/images
+        image_path = run_index.latest(["image"])
+        if not image_path:
+            list_of_files = glob.glob('outputs/images/*.png') 
+            if not list_of_files:
+                print("No images found in outputs/images/")
+                sys.exit(1)
+            image_path = max(list_of_files, key=os.path.getctime)
         print(f"No image provided. Using latest: {image_path}")
 
     # Create a unique output folder based on the image filename
     base_name = os.path.splitext(os.path.basename(image_path))[0]
     output_dir = os.path.join("outputs", "shape_meshes", base_name)
     
-    image_to_shape_mesh(image_path, output_dir)
+    start = time.time()
+    mesh_paths = image_to_shape_mesh(image_path, output_dir)
+    seconds = time.time() - start
+    run_id = run_index.run_id_of(image_path) or base_name
+    for mesh_path in mesh_paths:
+        run_index.record(run_id, "image2mesh_shape", "shape_mesh", mesh_path, {"image": image_path}, seconds)
+    run_index.close()
@@ -5,30 +5,50 @@ Handles cleanup and conversion to GLB.
 
 import trimesh
 import os
+import struct
 import sys
 import glob
+from typing import List, Optional, Union
+from PIL import Image
 
-def clean_mesh(input_obj: str, output_obj: str) -> str:
+# the vectorized mesh cleanup, simplification and writers live with the TripoSR code
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "q9_triposr"))
+from tsr.cleanup import cleanup_trimesh, remove_floaters_mesh
+from tsr.mesh_io import MeshArrays, optimize_order, texture_from_trimesh, write_glb as write_glb_arrays
+from tsr.simplify import simplify_mesh
+from tsr.texture_compression import DDS_MIME_TYPE
+
+DEFAULT_LOD_RATIOS = [1.0, 0.25, 0.06]
+
+def cleanup_mesh(mesh: trimesh.Trimesh, floater_face_ratio: float = 0.0, floater_volume_ratio: float = 0.0) -> trimesh.Trimesh:
+    """
+    Clean up a mesh: weld duplicate vertices, remove degenerate and duplicate faces, and unreferenced vertices.
+    All of it is done in a single vectorized pass (tsr.cleanup), which returns a new mesh.
+    If floater_face_ratio or floater_volume_ratio are > 0, connected components smaller than these fractions of the
+    largest component (in faces, or enclosed volume) are dropped afterwards.
+    """
+    cleaned, stats = cleanup_trimesh(mesh)
+    print(
+        f"Cleanup: merged {stats['merged_vertices']} vertices, removed {stats['degenerate_faces']} degenerate, "
+        f"{stats['duplicate_faces']} duplicate and {stats['nonfinite_faces']} non-finite faces, "
+        f"{stats['unreferenced_vertices']} unreferenced vertices -> {stats['vertices']} vertices, {stats['faces']} faces"
+    )
+    if floater_face_ratio > 0 or floater_volume_ratio > 0:
+        cleaned, stats = remove_floaters_mesh(cleaned, floater_face_ratio, floater_volume_ratio)
+        print(f"Removed {stats['removed_components']} of {stats['components']} components ({stats['removed_faces']} faces)")
+    return cleaned
+
+def clean_mesh(input_obj: str, output_obj: str, floater_face_ratio: float = 0.0, floater_volume_ratio: float = 0.0) -> str:
     """
-    Clean up the mesh: remove duplicates, degenerate faces, and unreferenced vertices.
+    Clean up the mesh file: remove duplicates, degenerate faces, and unreferenced vertices,
+    and optionally floaters (see cleanup_mesh).
     """
     print(f"Cleaning mesh: {input_obj}")
     # Load mesh
     # force='mesh' ensures we get a Trimesh object, not a Scene
-    mesh = trimesh.load(input_obj, force='mesh')
-    
-    # Basic cleanup operations
-    # process=True (default in load) already does some, but we can be explicit
-    mesh.process() 
-    
-    # Remove duplicate faces
-    mesh.update_faces(mesh.unique_faces())
-    
-    # Remove degenerate faces (zero area)
-    mesh.update_faces(mesh.nondegenerate_faces())
-    
-    # Remove vertices not referenced by any face
-    mesh.remove_unreferenced_vertices()
+    # process=False: welding is left to the cleanup pass
+    mesh = trimesh.load(input_obj, force='mesh', process=False)
+    mesh = cleanup_mesh(mesh, floater_face_ratio, floater_volume_ratio)
     
     # Ensure output directory exists
     os.makedirs(os.path.dirname(output_obj), exist_ok=True)
@@ -38,31 +58,166 @@ def clean_mesh(input_obj: str, output_obj: str) -> str:
     print(f"Cleaned mesh saved to: {output_obj}")
     return output_obj
 
-def convert_to_glb(input_obj: str, output_glb: str) -> str:
+def generate_lods(mesh: trimesh.Trimesh, ratios: List[float]) -> List[trimesh.Trimesh]:
     """
-    Convert OBJ to GLB (binary glTF), which is better for web/AR.
+    Build a LOD chain by quadric error simplification, one mesh per face count ratio (e.g. 1.0, 0.25, 0.06).
+    Vertex colors and UVs are carried over to every level.
+    """
+    lods = []
+    for ratio in ratios:
+        target_faces = int(len(mesh.faces) * ratio)
+        if target_faces >= len(mesh.faces):
+            lods.append(mesh)
+        else:
+            lods.append(simplify_mesh(mesh, target_faces))
+        print(f"LOD{len(lods) - 1}: {len(lods[-1].faces)} faces")
+    return lods
+
+def write_glb(mesh: trimesh.Trimesh, output_glb: str, texture: Optional[Union[str, bytes, Image.Image]] = None, lod_ratios: Optional[List[float]] = None, optimize: bool = False) -> str:
+    """
+    Export an in-memory mesh to GLB.
+    texture is a baked texture to embed as the base color texture: a PNG/DDS path, a PIL image, or DDS file bytes.
+    A mesh which already carries its texture material needs none. With a DDS texture, that material image (or else
+    the decoded DDS) is embedded as the PNG fallback for loaders without DDS support.
+    If lod_ratios are given, the GLB holds one simplified mesh per ratio, in nodes named LOD0, LOD1, ...
+    If optimize is set, triangles and vertices are reordered for GPU cache locality and the vertex attributes are
+    quantized to 16/8-bit (KHR_mesh_quantization), for smaller files that render faster.
     """
-    print(f"Converting to GLB: {input_obj}")
-    mesh = trimesh.load(input_obj, force='mesh')
-    
     # Ensure output directory exists
     os.makedirs(os.path.dirname(output_glb), exist_ok=True)
     
-    mesh.export(output_glb)
+    mime_type = "image/png"
+    fallback_texture = None
+    if isinstance(texture, bytes):
+        mime_type = DDS_MIME_TYPE
+    elif isinstance(texture, str):
+        # embed the image file as is, no re-encoding
+        if texture.lower().endswith(".dds"):
+            mime_type = DDS_MIME_TYPE
+        elif texture.lower().endswith((".jpg", ".jpeg")):
+            mime_type = "image/jpeg"
+        with open(texture, "rb") as f:
+            texture = f.read()
+    elif texture is None:
+        texture = texture_from_trimesh(mesh)
+    if mime_type == DDS_MIME_TYPE:
+        material_image = texture_from_trimesh(mesh)
+        height, width = struct.unpack_from("<2I", texture, 12)
+        # trimesh gives materials without an image a placeholder one
+        if material_image is not None and material_image.size == (width, height):
+            fallback_texture = material_image
+
+    lods = generate_lods(mesh, lod_ratios) if lod_ratios else [mesh]
+    # written straight from the vertex / index buffers, one node per LOD
+    mesh_arrays = [MeshArrays.from_trimesh(lod, f"LOD{i}" if lod_ratios else "mesh") for i, lod in enumerate(lods)]
+    if optimize:
+        mesh_arrays = [optimize_order(arrays) for arrays in mesh_arrays]
+    write_glb_arrays(output_glb, mesh_arrays, texture, mime_type, quantize=optimize, fallback_texture=fallback_texture)
     print(f"GLB saved to: {output_glb}")
     return output_glb
 
+def convert_to_glb(input_obj: str, output_glb: str, texture: Optional[str] = None, lod_ratios: Optional[List[float]] = None, optimize: bool = False) -> str:
+    """
+    Convert OBJ to GLB (binary glTF), which is better for web/AR.
+    If a baked texture (PNG, or block compressed DDS) is given, it is embedded as the base color texture.
+    If lod_ratios are given, the GLB holds one simplified mesh per ratio, in nodes named LOD0, LOD1, ...
+    If optimize is set, the GLB is cache-optimized and quantized (see write_glb).
+    """
+    print(f"Converting to GLB: {input_obj}")
+    mesh = trimesh.load(input_obj, force='mesh')
+    return write_glb(mesh, output_glb, texture, lod_ratios, optimize)
+
+def sibling_textures(mesh_path: str) -> List[str]:
+    """
+    Paths of the texture.png / texture.dds TripoSR writes next to a mesh, in order of preference, existing or not.
+    """
+    return [os.path.join(os.path.dirname(mesh_path), f"texture.{ext}") for ext in ["png", "dds"]]
+
+def process_mesh(input_path: str, texture: Optional[str] = None, lod_ratios: Optional[List[float]] = None, optimize: bool = False,
+                 floater_face_ratio: float = 0.0, floater_volume_ratio: float = 0.0, batch_dir: Optional[str] = None) -> dict:
+    """
+    Clean up a mesh and convert it to GLB in outputs/processed_meshes/<parent folder name>/, or with batch_dir in
+    outputs/processed_meshes/<folder relative to batch_dir>/, which mirrors the batch tree so that no two meshes of
+    a batch share an output path.
+    texture "auto" embeds the texture.png / texture.dds written next to the mesh by TripoSR, if any.
+    Returns the output paths.
+    """
+    # Define output paths
+    # We want to save to outputs/processed_meshes/<parent_folder_name>/
+    # e.g. outputs/processed_meshes/img_20251206_003056/
+    
+    # Get the parent folder name of the input file (e.g. img_20251206_003056)
+    parent_folder_name = os.path.basename(os.path.dirname(input_path))
+    
+    # If the parent folder is just "0" (TripoSR subfolder), go up one more level
+    if parent_folder_name == "0":
+        parent_folder_name = os.path.basename(os.path.dirname(os.path.dirname(input_path)))
+
+    if batch_dir is not None:
+        parent_folder_name = os.path.relpath(os.path.dirname(os.path.abspath(input_path)), os.path.abspath(batch_dir))
+
+    output_dir = os.path.normpath(os.path.join("outputs", "processed_meshes", parent_folder_name))
+    os.makedirs(output_dir, exist_ok=True)
+
+    basename = os.path.splitext(os.path.basename(input_path))[0]
+    
+    cleaned_path = os.path.join(output_dir, f"{basename}_cleaned.obj")
+    glb_path = os.path.join(output_dir, f"{basename}.glb")
+
+    if texture == "auto":
+        texture = next((t for t in sibling_textures(input_path) if os.path.exists(t)), None)
+
+    clean_mesh(input_path, cleaned_path, floater_face_ratio, floater_volume_ratio)
+    convert_to_glb(cleaned_path, glb_path, texture, lod_ratios, optimize)
+    return {"cleaned": cleaned_path, "glb": glb_path}
+
 if __name__ == "__main__":
     import argparse
+    import time
+    from run_index import DEFAULT_INDEX_PATH, RunIndex
     
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", type=str, help="Path to input mesh")
+    parser.add_argument("--batch-dir", type=str, default=None, help="Post-process every OBJ under this directory across a process pool instead of a single mesh")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes of the batch mode (default: all cores)")
+    parser.add_argument("--results", type=str, default=None, help="JSON lines file the batch results are appended to (default: <batch-dir>/postprocess_results.jsonl)")
+    parser.add_argument("--force", action="store_true", help="In batch mode, also re-process meshes that did not change since the last run")
+    parser.add_argument("--texture", type=str, default=None, help="Baked texture (PNG or DDS) to embed in the GLB, 'auto' for the texture next to the mesh (the default in batch mode)")
+    parser.add_argument("--lod", action="store_true", help="Write a LOD chain into the GLB")
+    parser.add_argument("--lod-ratios", type=float, nargs="+", default=DEFAULT_LOD_RATIOS, help="Face count ratio of every LOD, used with --lod (default: 1.0 0.25 0.06)")
+    parser.add_argument("--floater-face-ratio", type=float, default=0.0, help="Drop connected components with fewer faces than this fraction of the largest one (default: 0, keep all)")
+    parser.add_argument("--floater-volume-ratio", type=float, default=0.0, help="Drop connected components enclosing less than this fraction of the largest volume (default: 0, keep all)")
+    parser.add_argument("--optimize", action="store_true", help="Reorder the mesh for GPU vertex cache locality and quantize it (KHR_mesh_quantization) for smaller, faster-rendering GLBs")
+    parser.add_argument("--run-index", type=str, default=DEFAULT_INDEX_PATH, help=f"Run index database (default: {DEFAULT_INDEX_PATH})")
     args = parser.parse_args()
+
+    options = dict(
+        lod_ratios=args.lod_ratios if args.lod else None,
+        optimize=args.optimize,
+        floater_face_ratio=args.floater_face_ratio,
+        floater_volume_ratio=args.floater_volume_ratio,
+    )
+
+    if args.batch_dir:
+        from batch import find_files, run_batch
+        paths = find_files(args.batch_dir, [".obj"], exclude=["_cleaned"])
+        results = args.results or os.path.join(args.batch_dir, "postprocess_results.jsonl")
+        texture = args.texture or "auto"
+        # a re-baked texture re-runs its mesh
+        dependencies = sibling_textures if texture == "auto" else (lambda path: [texture])
+        summary = run_batch(process_mesh, paths, results, dict(options, texture=texture, batch_dir=args.batch_dir), workers=args.workers, force=args.force, dependencies=dependencies)
+        sys.exit(1 if summary["failed"] else 0)
     
+    run_index = RunIndex(args.run_index)
     input_path = args.input
     
     if not input_path:
-        # Find the most recent mesh in outputs/shape_meshes or outputs/raw_meshes
+        input_path = run_index.latest(["raw_mesh", "shape_mesh"])
+        if input_path:
+            print(f"No input provided. Using latest found: {input_path}")
+
+    if not input_path:
+        # outputs from before the run index: find the most recent mesh in outputs/shape_meshes or outputs/raw_meshes
         # We look for mesh.obj or mesh_*.obj recursively
         # shape_meshes might be flat or nested
         shape_meshes = glob.glob('outputs/shape_meshes/**/*.obj', recursive=True)
@@ -80,31 +235,14 @@ if __name__ == "__main__":
         input_path = max(all_meshes, key=os.path.getctime)
         print(f"No input provided. Using latest found: {input_path}")
 
-    # Define output paths
-    # We want to save to outputs/processed_meshes/<parent_folder_name>/
-    # e.g. outputs/processed_meshes/img_20251206_003056/
-    
-    # Get the parent folder name of the input file (e.g. img_20251206_003056)
-    parent_folder_name = os.path.basename(os.path.dirname(input_path))
-    
-    # If the parent folder is just "0" (TripoSR subfolder), go up one more level
-    if parent_folder_name == "0":
-        parent_folder_name = os.path.basename(os.path.dirname(os.path.dirname(input_path)))
-
-    output_dir = os.path.join("outputs", "processed_meshes", parent_folder_name)
-    os.makedirs(output_dir, exist_ok=True)
-
-    basename = os.path.splitext(os.path.basename(input_path))[0]
-    
-    cleaned_path = os.path.join(output_dir, f"{basename}_cleaned.obj")
-    glb_path = os.path.join(output_dir, f"{basename}.glb")
-    
     # Run pipeline
     try:
-        clean_mesh(input_path, cleaned_path)
-        convert_to_glb(cleaned_path, glb_path)
+        start = time.time()
+        outputs = process_mesh(input_path, args.texture, **options)
+        seconds = time.time() - start
+        run_id = run_index.run_id_of(input_path) or os.path.basename(os.path.dirname(outputs["glb"]))
+        run_index.record(run_id, "postprocess", "cleaned_mesh", outputs["cleaned"], dict(options, input=input_path), seconds)
+        run_index.record(run_id, "postprocess", "glb", outputs["glb"], dict(options, input=input_path), seconds)
         print("Post-processing complete.")
     except Exception as e:
         print(f"Error during post-processing: {e}")
-
-
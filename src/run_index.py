@@ -0,0 +1,125 @@
+"""
+SQLite index of the artifacts written by every pipeline stage (run id, parameters, paths, hashes, timings).
+The CLIs query it for the latest artifact of a kind and for cross-run lookups instead of globbing the outputs tree.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import List, Optional, Sequence
+
+DEFAULT_INDEX_PATH = os.path.join("outputs", "run_index.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha1 TEXT,
+    metadata TEXT,
+    seconds REAL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_kind_created ON artifacts (kind, created);
+CREATE INDEX IF NOT EXISTS artifacts_run ON artifacts (run_id);
+CREATE INDEX IF NOT EXISTS artifacts_path ON artifacts (path);
+"""
+
+
+def file_sha1(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-1 of the file content, streamed in chunks.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class RunIndex:
+    """
+    Artifacts recorded by the pipeline stages, one row per written file.
+    kind is one of "image", "raw_mesh", "shape_mesh", "texture", "cleaned_mesh", "glb" or "validation".
+    metadata holds the stage parameters (or the report of the validation stage) as JSON.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30.0)
+        self.connection.row_factory = sqlite3.Row
+        # concurrent stages read while one writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def record(self, run_id: str, stage: str, kind: str, path: str, metadata: Optional[dict] = None, seconds: Optional[float] = None) -> None:
+        """
+        Record an artifact written by a stage, with the hash of its content if it exists.
+        """
+        path = os.path.normpath(path)
+        sha1 = file_sha1(path) if os.path.isfile(path) else None
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO artifacts (run_id, stage, kind, path, sha1, metadata, seconds, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_id, stage, kind, path, sha1, json.dumps(metadata) if metadata is not None else None, seconds, time.time()),
+            )
+
+    def latest(self, kinds: Sequence[str]) -> Optional[str]:
+        """
+        Path of the most recently recorded artifact of one of the kinds that still exists, None if there is none.
+        """
+        # one query per kind walks the (kind, created) index backwards, an IN over several kinds sorts all their rows
+        latest_path, latest_created = None, None
+        for kind in kinds:
+            query = "SELECT path, created FROM artifacts WHERE kind = ? ORDER BY created DESC"
+            for row in self.connection.execute(query, (kind,)):
+                if os.path.exists(row["path"]):
+                    if latest_created is None or row["created"] > latest_created:
+                        latest_path, latest_created = row["path"], row["created"]
+                    break
+        return latest_path
+
+    def run_id_of(self, path: str) -> Optional[str]:
+        """
+        Run id of the latest artifact recorded at path, so that later stages are recorded under the same run.
+        """
+        row = self.connection.execute(
+            "SELECT run_id FROM artifacts WHERE path = ? ORDER BY created DESC LIMIT 1", (os.path.normpath(path),)
+        ).fetchone()
+        return row["run_id"] if row is not None else None
+
+    def artifacts(self, run_id: str) -> List[dict]:
+        """
+        All artifacts of a run, oldest first.
+        """
+        rows = self.connection.execute("SELECT * FROM artifacts WHERE run_id = ? ORDER BY created", (run_id,))
+        return [dict(row, metadata=json.loads(row["metadata"]) if row["metadata"] else None) for row in rows]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> "RunIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query the run index")
+    parser.add_argument("--index", type=str, default=DEFAULT_INDEX_PATH, help=f"Run index database (default: {DEFAULT_INDEX_PATH})")
+    parser.add_argument("--latest", type=str, nargs="+", default=None, help="Print the latest artifact of these kinds")
+    parser.add_argument("--run", type=str, default=None, help="Print all artifacts of this run id")
+    args = parser.parse_args()
+
+    with RunIndex(args.index) as index:
+        if args.latest:
+            print(index.latest(args.latest))
+        if args.run:
+            print(json.dumps(index.artifacts(args.run), indent=2))
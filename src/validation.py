@@ -9,17 +9,33 @@ import sys
 import json
 import glob
 
-def validate_mesh(mesh_path: str) -> dict:
+# the vectorized mesh checks live with the TripoSR code
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "q9_triposr"))
+from tsr.cleanup import mesh_topology
+
+def validate_mesh(mesh_path: str, fast: bool = False, raise_errors: bool = False) -> dict:
     """
     Load mesh and gather stats (polycount, vertex count, integrity).
+    A mesh that fails to load gives an {"error": ...} report, or raises with raise_errors (as in batch mode, so that
+    it is reported as failed and re-validated on the next run).
+    fast computes the same report from a single sorted edge key pass (tsr.cleanup.mesh_topology) instead of
+    trimesh's edge graph, several times faster on large meshes.
     """
     print(f"Validating mesh: {mesh_path}")
     
     try:
-        mesh = trimesh.load(mesh_path, force='mesh')
+        mesh = trimesh.load(mesh_path, force='mesh', process=not fast)
+        if len(mesh.faces) == 0:
+            # trimesh loads unparseable OBJ files as empty meshes
+            raise ValueError("mesh has no faces")
     except Exception as e:
+        if raise_errors:
+            raise
         return {"error": f"Failed to load mesh: {str(e)}"}
 
+    if fast:
+        return validate_arrays(mesh, os.path.basename(mesh_path))
+
     report = {
         "filename": os.path.basename(mesh_path),
         "vertices": len(mesh.vertices),
@@ -39,17 +55,58 @@ def validate_mesh(mesh_path: str) -> dict:
 
     return report
 
+def validate_arrays(mesh: trimesh.Trimesh, filename: str) -> dict:
+    """
+    validate_mesh report of an unprocessed mesh, computed by tsr.cleanup.mesh_topology.
+    Vertices are welded the way trimesh processes them on load, keeping UV seams apart.
+    """
+    has_texture = hasattr(mesh, 'visual') and mesh.visual.kind == 'texture'
+    uv = mesh.visual.uv if has_texture else None
+    topology = mesh_topology(mesh.vertices, mesh.faces, uv)
+    return {
+        "filename": filename,
+        "vertices": topology["vertices"],
+        "faces": topology["faces"],
+        "is_watertight": topology["is_watertight"],
+        "is_winding_consistent": topology["is_winding_consistent"],
+        "euler_number": topology["euler_number"],
+        "volume": topology["volume"],
+        "bounds": topology["bounds"],
+        "has_texture": has_texture,
+    }
+
 if __name__ == "__main__":
     import argparse
+    import time
+    from run_index import DEFAULT_INDEX_PATH, RunIndex
     
     parser = argparse.ArgumentParser()
     parser.add_argument("--input", type=str, help="Path to input mesh (OBJ or GLB)")
+    parser.add_argument("--fast", action="store_true", help="Vectorized topology checks, several times faster on large meshes")
+    parser.add_argument("--batch-dir", type=str, default=None, help="Validate every GLB and OBJ under this directory across a process pool instead of a single mesh")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes of the batch mode (default: all cores)")
+    parser.add_argument("--results", type=str, default=None, help="JSON lines file the batch reports are appended to (default: <batch-dir>/validation_results.jsonl)")
+    parser.add_argument("--force", action="store_true", help="In batch mode, also re-validate meshes that did not change since the last run")
+    parser.add_argument("--run-index", type=str, default=DEFAULT_INDEX_PATH, help=f"Run index database (default: {DEFAULT_INDEX_PATH})")
     args = parser.parse_args()
+
+    if args.batch_dir:
+        from batch import find_files, run_batch
+        results = args.results or os.path.join(args.batch_dir, "validation_results.jsonl")
+        summary = run_batch(validate_mesh, find_files(args.batch_dir, [".glb", ".obj"]), results, {"fast": args.fast, "raise_errors": True}, workers=args.workers, force=args.force)
+        sys.exit(1 if summary["failed"] else 0)
     
+    run_index = RunIndex(args.run_index)
     input_path = args.input
     
     if not input_path:
-        # Find the most recent GLB (final output)
+        # Find the most recent GLB (final output), falling back to cleaned OBJs
+        input_path = run_index.latest(["glb"]) or run_index.latest(["cleaned_mesh"])
+        if input_path:
+            print(f"No input provided. Using latest found: {input_path}")
+
+    if not input_path:
+        # outputs from before the run index
         glbs = glob.glob('outputs/*.glb')
         if not glbs:
             # Fallback to cleaned OBJs
@@ -62,7 +119,11 @@ if __name__ == "__main__":
         input_path = max(glbs, key=os.path.getctime)
         print(f"No input provided. Using latest found: {input_path}")
 
-    stats = validate_mesh(input_path)
+    start = time.time()
+    stats = validate_mesh(input_path, args.fast)
+    run_id = run_index.run_id_of(input_path) or os.path.basename(os.path.dirname(input_path))
+    run_index.record(run_id, "validation", "validation", input_path, stats, time.time() - start)
+    run_index.close()
     print(json.dumps(stats, indent=2))
 
 